@@ -246,20 +246,12 @@ async def test_ai_model(
         
         start_time = time.time()
         
-        # 构建测试配置
-        test_config = {
-            "api_key": model.api_key,
-            "base_url": model.base_url,
-            "model": model.model,
-            "temperature": model.temperature,
-            "max_tokens": min(model.max_tokens, 100),  # 测试时限制token数
-            "timeout": model.timeout
-        }
-        
-        # 调用LLM进行测试
+        # 调用LLM进行测试（使用该模型配置对应的客户端）
         llm_response = await llm_manager.text_completion(
             prompt=test_request.test_prompt,
-            **test_config
+            model_config=model,
+            temperature=model.temperature,
+            max_tokens=min(model.max_tokens, 100)  # 测试时限制token数
         )
         
         latency = (time.time() - start_time) * 1000  # 转换为毫秒
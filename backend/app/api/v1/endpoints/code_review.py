@@ -2,9 +2,10 @@
 代码评审流水线相关API端点
 """
 import os
+import asyncio
 import time
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Request
 from sqlmodel import Session
 from app.api.v1.deps import get_db
 from app.crud.crud_pipeline import code_diff, requirement_text
@@ -19,7 +20,8 @@ from app.schemas.pipeline import (
     TaskExecutionRequest, TaskExecutionResponse,
     TaskProgress, PipelineStats, CodeReviewResult
 )
-from app.core.git_utils import generate_diff
+from app.core.git_utils import generate_diff_async
+from app.services.diff_content_service import diff_content_service
 from app.core.config import settings
 
 router = APIRouter()
@@ -108,13 +110,8 @@ def read_code_diff(
     return diff
 
 
-@router.get("/diffs/{diff_id}/content")
-def read_diff_content(
-    *,
-    db: Session = Depends(get_db),
-    diff_id: int
-):
-    """获取差异文件内容"""
+def _get_diff_file(db: Session, diff_id: int):
+    """获取代码差异记录并校验差异文件存在"""
     diff = code_diff.get(db=db, id=diff_id)
     if not diff:
         raise HTTPException(
@@ -122,22 +119,30 @@ def read_diff_content(
             detail="代码差异不存在"
         )
     
-    if not diff.diff_file_path or not os.path.exists(diff.diff_file_path):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="差异文件不存在"
-        )
+    diff_content_service.ensure_file(diff.diff_file_path)
+    return diff
+
+
+@router.get("/diffs/{diff_id}/content")
+def read_diff_content(
+    *,
+    db: Session = Depends(get_db),
+    diff_id: int,
+    offset: int = 0,
+    limit: Optional[int] = None
+):
+    """获取差异文件内容（按文件分页）"""
+    diff = _get_diff_file(db, diff_id)
     
     try:
-        with open(diff.diff_file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        page = diff_content_service.read_page(diff.diff_file_path, offset=offset, limit=limit)
         
         return {
             "diff_id": diff_id,
-            "content": content,
             "file_path": diff.diff_file_path,
             "base_ref": diff.base_ref,
-            "head_ref": diff.head_ref
+            "head_ref": diff.head_ref,
+            **page
         }
     except Exception as e:
         raise HTTPException(
@@ -146,6 +151,52 @@ def read_diff_content(
         )
 
 
+@router.get("/diffs/{diff_id}/files")
+def list_diff_files(
+    *,
+    db: Session = Depends(get_db),
+    diff_id: int,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    path: Optional[str] = None
+):
+    """分页获取差异中的文件列表"""
+    diff = _get_diff_file(db, diff_id)
+    return {
+        "diff_id": diff_id,
+        **diff_content_service.list_files(diff.diff_file_path, offset=offset, limit=limit, path=path)
+    }
+
+
+@router.get("/diffs/{diff_id}/files/{file_index}")
+def read_diff_file(
+    *,
+    db: Session = Depends(get_db),
+    diff_id: int,
+    file_index: int
+):
+    """获取差异中单个文件的内容"""
+    diff = _get_diff_file(db, diff_id)
+    return {
+        "diff_id": diff_id,
+        **diff_content_service.get_file(diff.diff_file_path, file_index)
+    }
+
+
+@router.get("/diffs/{diff_id}/raw")
+def read_diff_raw(
+    *,
+    db: Session = Depends(get_db),
+    request: Request,
+    diff_id: int
+):
+    """获取原始差异文件（支持Range、ETag和gzip）"""
+    diff = _get_diff_file(db, diff_id)
+    return diff_content_service.raw_response(
+        request, diff.diff_file_path, os.path.basename(diff.diff_file_path)
+    )
+
+
 # ===== 需求文本管理 =====
 @router.post("/requirements", response_model=RequirementTextResponse)
 def create_requirement_text(
@@ -468,24 +519,24 @@ def read_execution_progress(
 
 
 # ===== 后台任务函数 =====
-def generate_diff_task(db_session: Session, diff_id: int, repository):
-    """后台生成差异文件任务"""
+async def generate_diff_task(db_session: Session, diff_id: int, repository):
+    """后台生成差异文件任务（数据库操作是同步调用，放到线程池执行，不阻塞事件循环）"""
     try:
         # 更新状态为生成中
-        code_diff.update_status(db_session, diff_id=diff_id, status="generating")
+        await asyncio.to_thread(code_diff.update_status, db_session, diff_id=diff_id, status="generating")
 
         # 生成差异文件路径
         diff_dir = os.path.join(settings.UPLOAD_DIR, "diffs")
         os.makedirs(diff_dir, exist_ok=True)
 
-        diff_obj = code_diff.get(db_session, diff_id)
+        diff_obj = await asyncio.to_thread(code_diff.get, db_session, diff_id)
         output_path = os.path.join(
             diff_dir,
             f"diff_{diff_id}_{diff_obj.base_ref}_{diff_obj.head_ref}.diff"
         )
 
-        # 生成差异
-        success, message = generate_diff(
+        # 生成差异（异步子进程，不占用线程池）
+        success, message, stats = await generate_diff_async(
             repository.url,
             repository.username,
             repository.password,
@@ -495,21 +546,25 @@ def generate_diff_task(db_session: Session, diff_id: int, repository):
         )
 
         if success:
-            code_diff.update_status(
+            await asyncio.to_thread(
+                code_diff.update_status,
                 db_session,
                 diff_id=diff_id,
                 status="completed",
-                diff_file_path=output_path
+                diff_file_path=output_path,
+                diff_metadata=stats
             )
         else:
-            code_diff.update_status(
+            await asyncio.to_thread(
+                code_diff.update_status,
                 db_session,
                 diff_id=diff_id,
                 status="failed",
                 error_message=message
             )
     except Exception as e:
-        code_diff.update_status(
+        await asyncio.to_thread(
+            code_diff.update_status,
             db_session,
             diff_id=diff_id,
             status="failed",
@@ -583,7 +638,7 @@ async def execute_code_review_task(
                     db_session,
                     query=diff_content[:1000],  # 使用差异内容的前1000字符作为查询
                     knowledge_base_id=task.knowledge_base_id,
-                    max_context_length=2000
+                    max_context_tokens=settings.RAG_MAX_CONTEXT_TOKENS
                 )
                 knowledge_context = context
             except Exception as e:
@@ -1,12 +1,16 @@
 """
 AI对话功能API端点（适配前端需求）
 """
+import json
+import asyncio
 import time
 from datetime import datetime
-from typing import List
+from typing import Any, Dict, List, Optional
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session, select
 from app.api.v1.deps import get_db
+from app.core.database import engine
 from app.models.conversation import Conversation, Message
 from app.models.ai_model import AIModelConfig
 from app.schemas.ai_model import (
@@ -15,6 +19,7 @@ from app.schemas.ai_model import (
 )
 from app.core.response import StandardJSONResponse
 from app.core.llm_client import llm_manager
+from app.core.tokenizer import ContextBudgeter
 from app.crud.crud_ai_model import ai_model_config
 
 router = APIRouter()
@@ -168,6 +173,124 @@ def get_conversation_detail(
         )
 
 
+def _get_user_conversation(db: Session, conversation_id: str, user_id: int) -> Optional[Conversation]:
+    """获取属于当前用户的对话"""
+    return db.exec(
+        select(Conversation).where(
+            Conversation.id == int(conversation_id),
+            Conversation.user_id == user_id
+        )
+    ).first()
+
+
+def _build_llm_messages(
+    db: Session,
+    conversation: Conversation,
+    content: str,
+    model: AIModelConfig
+) -> List[Dict[str, str]]:
+    """根据对话历史构建发送给LLM的消息列表，超出模型上下文窗口时丢弃最早的历史消息"""
+    history_messages = db.exec(
+        select(Message).where(
+            Message.conversation_id == conversation.id
+        ).order_by(Message.created_at.asc())
+    ).all()
+    
+    messages = []
+    if conversation.system_prompt:
+        messages.append({"role": "system", "content": conversation.system_prompt})
+    
+    for msg in history_messages:
+        messages.append({"role": msg.role, "content": msg.content})
+    
+    messages.append({"role": "user", "content": content})
+    
+    budgeter = ContextBudgeter(model.model, max_output_tokens=model.max_tokens)
+    return budgeter.fit_messages(messages)
+
+
+def _sse_event(event: str, data: Any) -> str:
+    """格式化Server-Sent-Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _save_assistant_message(
+    conversation_id: str,
+    model_config_id: int,
+    prompt_template_id: Optional[int],
+    llm_response,
+    partial_content: str,
+    processing_time: float
+) -> Dict[str, Any]:
+    """
+    持久化流式生成的AI消息并更新对话和模型统计
+    
+    请求级会话在流式响应期间可能已关闭，这里使用独立会话；
+    未收到完整响应（生成失败或客户端中途断开）时保存已生成的部分内容和错误信息。
+    
+    Returns:
+        需要发送给客户端的最终事件 {"event": 事件类型, "data": 事件数据}
+    """
+    with Session(engine) as session:
+        try:
+            conv = session.get(Conversation, conversation_id)
+            
+            if not llm_response or not llm_response.success:
+                error_detail = llm_response.error_message if llm_response else "未收到完整的AI响应（生成中断）"
+                session.add(Message(
+                    conversation_id=conversation_id,
+                    role="assistant",
+                    content=partial_content or "抱歉，我遇到了一些问题，请稍后再试。",
+                    error_message=error_detail,
+                    processing_time=processing_time,
+                    prompt_template_id=prompt_template_id
+                ))
+                if conv:
+                    conv.message_count += 1
+                    conv.last_message_at = datetime.utcnow().isoformat()
+                    session.add(conv)
+                session.commit()
+                return {"event": "error", "data": {"message": f"AI响应失败: {error_detail}"}}
+            
+            ai_message = Message(
+                conversation_id=conversation_id,
+                role="assistant",
+                content=llm_response.content,
+                tokens=llm_response.tokens_used,
+                model_used=llm_response.model,
+                processing_time=processing_time,
+                prompt_template_id=prompt_template_id
+            )
+            session.add(ai_message)
+            
+            # 更新对话统计
+            if conv:
+                conv.total_tokens += llm_response.tokens_used
+                conv.message_count += 1
+                conv.last_message_at = datetime.utcnow().isoformat()
+                session.add(conv)
+            
+            # 更新模型使用统计
+            ai_model_config.update_usage_stats(
+                session, model_id=model_config_id, tokens_used=llm_response.tokens_used
+            )
+            
+            session.commit()
+            session.refresh(ai_message)
+            
+            return {"event": "done", "data": {
+                "id": str(ai_message.id),
+                "role": ai_message.role,
+                "content": ai_message.content,
+                "timestamp": ai_message.created_at.isoformat() + "Z",
+                "tokens": ai_message.tokens
+            }}
+        except Exception as e:
+            session.rollback()
+            print(f"保存AI消息失败: {e}")
+            return {"event": "error", "data": {"message": f"保存消息失败: {str(e)}"}}
+
+
 @router.post("/conversations/{conversation_id}/messages", tags=["AI对话"])
 async def send_message(
     *,
@@ -179,12 +302,7 @@ async def send_message(
     """发送消息"""
     try:
         # 获取对话
-        conversation = db.exec(
-            select(Conversation).where(
-                Conversation.id == int(conversation_id),
-                Conversation.user_id == user_id
-            )
-        ).first()
+        conversation = _get_user_conversation(db, conversation_id, user_id)
         
         if not conversation:
             return StandardJSONResponse(
@@ -203,6 +321,9 @@ async def send_message(
                 message="AI模型配置不存在"
             )
         
+        # 构建消息历史（在保存用户消息之前查询，避免重复）
+        messages = _build_llm_messages(db, conversation, message_in.content, model)
+        
         # 保存用户消息
         user_message = Message(
             conversation_id=int(conversation_id),
@@ -212,38 +333,14 @@ async def send_message(
         )
         db.add(user_message)
         
-        # 获取对话历史
-        history_messages = db.exec(
-            select(Message).where(
-                Message.conversation_id == int(conversation_id)
-            ).order_by(Message.created_at.asc())
-        ).all()
-        
-        # 构建消息历史
-        messages = []
-        if conversation.system_prompt:
-            messages.append({"role": "system", "content": conversation.system_prompt})
-        
-        for msg in history_messages:
-            messages.append({"role": msg.role, "content": msg.content})
-        
-        messages.append({"role": "user", "content": message_in.content})
-        
         # 调用LLM
         start_time = time.time()
         
-        llm_config = {
-            "api_key": model.api_key,
-            "base_url": model.base_url,
-            "model": model.model,
-            "temperature": model.temperature,
-            "max_tokens": model.max_tokens,
-            "timeout": model.timeout
-        }
-        
         llm_response = await llm_manager.chat_completion(
             messages=messages,
-            **llm_config
+            model_config=model,
+            temperature=model.temperature,
+            max_tokens=model.max_tokens
         )
         
         processing_time = time.time() - start_time
@@ -311,6 +408,106 @@ async def send_message(
         )
 
 
+@router.post("/conversations/{conversation_id}/messages/stream", tags=["AI对话"])
+async def stream_message(
+    *,
+    db: Session = Depends(get_db),
+    conversation_id: str,
+    message_in: MessageCreate,
+    user_id: int = 1  # TODO: 从认证中获取用户ID
+):
+    """
+    发送消息（SSE流式返回）
+    
+    事件类型：delta（增量内容）、done（已保存的AI消息）、error（失败信息）
+    """
+    try:
+        conversation = _get_user_conversation(db, conversation_id, user_id)
+        if not conversation:
+            return StandardJSONResponse(
+                content=None,
+                status_code=404,
+                message="对话不存在"
+            )
+        
+        model_config_id = int(message_in.model_config_id or conversation.model_config_id)
+        model = ai_model_config.get(db=db, id=model_config_id)
+        if not model:
+            return StandardJSONResponse(
+                content=None,
+                status_code=404,
+                message="AI模型配置不存在"
+            )
+        
+        messages = _build_llm_messages(db, conversation, message_in.content, model)
+        
+        # 在提交前解析模型客户端和参数，流式生成期间不再访问请求级会话中的对象
+        llm_client = llm_manager.get_model_client(model)
+        llm_params = {
+            "temperature": model.temperature,
+            "max_tokens": model.max_tokens
+        }
+        
+        # 先保存用户消息，流中断时用户输入也不会丢失
+        user_message = Message(
+            conversation_id=conversation.id,
+            role="user",
+            content=message_in.content,
+            context_data=message_in.context
+        )
+        db.add(user_message)
+        conversation.message_count += 1
+        conversation.last_message_at = datetime.utcnow().isoformat()
+        db.add(conversation)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        return StandardJSONResponse(
+            content=None,
+            status_code=500,
+            message=f"发送消息失败: {str(e)}"
+        )
+    
+    conv_id = conversation.id
+    prompt_template_id = int(message_in.prompt_template_id) if message_in.prompt_template_id else None
+    
+    async def event_stream():
+        start_time = time.time()
+        llm_response = None
+        content_parts: List[str] = []
+        try:
+            async for chunk in llm_client.stream_chat_completion(messages, **llm_params):
+                if chunk.done:
+                    llm_response = chunk.response
+                else:
+                    content_parts.append(chunk.delta)
+                    yield _sse_event("delta", {"content": chunk.delta})
+        finally:
+            # 客户端断开时生成器在yield处被关闭，这里仍会执行，已生成的内容和统计不会丢失；
+            # 持久化是同步数据库操作，放到线程池执行，并用shield保证流被取消时保存仍会完成
+            save = asyncio.ensure_future(asyncio.to_thread(
+                _save_assistant_message,
+                conv_id,
+                model_config_id,
+                prompt_template_id,
+                llm_response,
+                "".join(content_parts),
+                time.time() - start_time
+            ))
+            saved = await asyncio.shield(save)
+        
+        yield _sse_event(saved["event"], saved["data"])
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
 @router.put("/conversations/{conversation_id}", tags=["AI对话"])
 def update_conversation(
     *,
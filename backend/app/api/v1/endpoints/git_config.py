@@ -11,7 +11,8 @@ from app.schemas.git import (
     GitConnectionTestRequest, GitConnectionTestResponse,
     RepositoryCreate, RepositoryUpdate, RepositoryResponse
 )
-from app.core.git_utils import test_git_connection
+from app.core.git_utils import test_git_connection_async
+from app.core.git_mirror import git_mirror
 from app.core.security import decrypt_token
 
 router = APIRouter()
@@ -107,7 +108,7 @@ def delete_git_credential(
 
 
 @router.post("/credentials/test", response_model=GitConnectionTestResponse)
-def test_git_connection_endpoint(
+async def test_git_connection_endpoint(
     *,
     db: Session = Depends(get_db),
     test_request: GitConnectionTestRequest
@@ -136,7 +137,7 @@ def test_git_connection_endpoint(
     # 解密token并测试连接
     try:
         token = decrypt_token(active_credential.encrypted_token)
-        success, message = test_git_connection(
+        success, message = await test_git_connection_async(
             test_url, active_credential.username, token
         )
         
@@ -243,4 +244,6 @@ def delete_repository(
         )
 
     repository.remove(db=db, id=repository_id)
+    # 清理本地镜像缓存
+    git_mirror.remove_mirror(repo.url)
     return {"message": "仓库配置已删除"}
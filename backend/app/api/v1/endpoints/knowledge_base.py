@@ -2,17 +2,18 @@
 知识库管理相关API端点
 """
 import os
+import json
 import time
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
 from sqlmodel import Session
 from app.api.v1.deps import get_db
-from app.crud.crud_knowledge_base import knowledge_base, document, document_chunk
+from app.crud.crud_knowledge_base import knowledge_base, document, document_chunk, ingestion_batch
 from app.schemas.knowledge_base import (
     KnowledgeBaseCreate, KnowledgeBaseUpdate, KnowledgeBaseResponse,
     DocumentResponse, DocumentUploadResponse, DocumentChunkResponse,
     RAGSearchRequest, RAGSearchResponse, DocumentProcessingStatus,
-    KnowledgeBaseStats
+    KnowledgeBaseStats, IngestionBatchResponse
 )
 from app.services.rag_service import rag_service
 from app.core.config import settings
@@ -250,6 +251,248 @@ async def upload_document(
         )
 
 
+@router.put("/{kb_id}/documents/{document_id}", response_model=DocumentUploadResponse)
+async def update_document(
+    *,
+    db: Session = Depends(get_db),
+    kb_id: int,
+    document_id: int,
+    file: UploadFile = File(...),
+    metadata: Optional[str] = Form(None)
+):
+    """更新文档内容，只对变化的切片重新向量化"""
+    kb = knowledge_base.get(db=db, id=kb_id)
+    if not kb:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="知识库不存在"
+        )
+    
+    if not kb.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="知识库未激活"
+        )
+    
+    if file.size > settings.MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"文件大小超过限制: {settings.MAX_FILE_SIZE} bytes"
+        )
+    
+    from app.services.document_service import document_service
+    
+    try:
+        doc, _ = await document_service.update_document(
+            db=db,
+            knowledge_base_id=kb_id,
+            document_id=document_id,
+            file=file,
+            metadata=metadata
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"更新文档失败: {str(e)}"
+        )
+    
+    return DocumentUploadResponse(
+        id=doc.id,
+        filename=doc.filename,
+        original_filename=doc.original_filename,
+        file_size=doc.file_size,
+        file_type=doc.file_type,
+        status=doc.status,
+        created_at=doc.created_at
+    )
+
+
+@router.post("/{kb_id}/documents/{document_id}/reindex", response_model=DocumentResponse)
+def reindex_document(
+    *,
+    db: Session = Depends(get_db),
+    kb_id: int,
+    document_id: int
+):
+    """按当前切分配置增量重建文档索引"""
+    from app.crud.crud_knowledge_base import DOCUMENT_PROCESSING_STATUSES
+    from app.services.document_service import document_service
+    
+    doc = document.get(db=db, id=document_id)
+    if not doc or doc.knowledge_base_id != kb_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="文档不存在"
+        )
+    
+    if doc.status in DOCUMENT_PROCESSING_STATUSES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="文档正在处理中，请稍后再试"
+        )
+    
+    doc = document.update_status(db, document_id=document_id, status="pending")
+    document_service.start_reindex(db, doc)
+    return doc
+
+
+def _batch_response(db: Session, batch) -> IngestionBatchResponse:
+    """组装批量入库任务响应（含聚合进度）"""
+    from app.services.ingestion_service import bulk_ingestion_service
+    
+    return IngestionBatchResponse(
+        id=batch.id,
+        knowledge_base_id=batch.knowledge_base_id,
+        source_type=batch.source_type,
+        source=batch.source,
+        status=batch.status,
+        total_files=batch.total_files,
+        skipped_files=batch.skipped_files,
+        dispatched=batch.dispatched,
+        error_message=batch.error_message,
+        batch_metadata=batch.batch_metadata,
+        created_at=batch.created_at,
+        updated_at=batch.updated_at,
+        **{
+            key: value for key, value in bulk_ingestion_service.get_progress(db, batch).items()
+            if key != "status_counts"
+        }
+    )
+
+
+@router.post("/{kb_id}/documents/bulk", response_model=IngestionBatchResponse)
+async def bulk_ingest_documents(
+    *,
+    db: Session = Depends(get_db),
+    kb_id: int,
+    file: Optional[UploadFile] = File(None),
+    directory: Optional[str] = Form(None),
+    metadata: Optional[str] = Form(None)
+):
+    """批量导入文档（zip/tar压缩包或服务器目录），后台去重并分批入库"""
+    from app.services.ingestion_service import bulk_ingestion_service
+    from app.tasks.document_tasks import prepare_ingestion_batch
+    
+    kb = knowledge_base.get(db=db, id=kb_id)
+    if not kb:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="知识库不存在"
+        )
+    
+    if not kb.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="知识库未激活"
+        )
+    
+    if bool(file) == bool(directory):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="请上传压缩包或指定服务器目录（二选一）"
+        )
+    
+    doc_metadata = {}
+    if metadata:
+        try:
+            doc_metadata = json.loads(metadata)
+        except json.JSONDecodeError:
+            pass
+    
+    if file:
+        if not bulk_ingestion_service.is_archive(file.filename):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"不支持的压缩包格式: {file.filename}"
+            )
+        source_type, source = "archive", file.filename
+    else:
+        try:
+            bulk_ingestion_service.resolve_directory(directory)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+        source_type, source = "directory", directory
+    
+    batch = ingestion_batch.create(db=db, obj_in={
+        "knowledge_base_id": kb_id,
+        "source_type": source_type,
+        "source": source,
+        "batch_metadata": {"doc_metadata": doc_metadata}
+    })
+    
+    try:
+        if file:
+            # 压缩包分块写入磁盘，不整体读入内存
+            work_dir = bulk_ingestion_service.batch_dir(batch.id)
+            os.makedirs(work_dir, exist_ok=True)
+            archive_path = os.path.join(work_dir, os.path.basename(file.filename))
+            written = 0
+            with open(archive_path, "wb") as f:
+                while True:
+                    chunk = await file.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > settings.BULK_INGEST_MAX_ARCHIVE_SIZE:
+                        raise ValueError(f"压缩包大小超过限制: {settings.BULK_INGEST_MAX_ARCHIVE_SIZE} bytes")
+                    f.write(chunk)
+            batch = ingestion_batch.update_batch(
+                db, batch_id=batch.id,
+                batch_metadata={**(batch.batch_metadata or {}), "archive_path": archive_path}
+            )
+        
+        prepare_ingestion_batch.delay(batch.id)
+        return _batch_response(db, batch)
+    except ValueError as e:
+        ingestion_batch.update_batch(db, batch_id=batch.id, status="failed", error_message=str(e))
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        ingestion_batch.update_batch(db, batch_id=batch.id, status="failed", error_message=str(e))
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"创建批量入库任务失败: {str(e)}"
+        )
+
+
+@router.get("/{kb_id}/ingestion-batches", response_model=List[IngestionBatchResponse])
+def read_ingestion_batches(
+    *,
+    db: Session = Depends(get_db),
+    kb_id: int
+):
+    """获取知识库的批量入库任务列表"""
+    batches = ingestion_batch.get_by_knowledge_base(db, kb_id=kb_id)
+    return [_batch_response(db, batch) for batch in batches]
+
+
+@router.get("/{kb_id}/ingestion-batches/{batch_id}", response_model=IngestionBatchResponse)
+def read_ingestion_batch(
+    *,
+    db: Session = Depends(get_db),
+    kb_id: int,
+    batch_id: int
+):
+    """获取批量入库任务进度"""
+    batch = ingestion_batch.get(db=db, id=batch_id)
+    if not batch or batch.knowledge_base_id != kb_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="批量入库任务不存在"
+        )
+    return _batch_response(db, batch)
+
+
 @router.get("/{kb_id}/documents", response_model=List[DocumentResponse])
 def read_documents(
     *,
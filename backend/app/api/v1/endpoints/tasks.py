@@ -2,10 +2,11 @@
 三级分离的任务管理API端点
 """
 import os
+import asyncio
 import json
 import time
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, BackgroundTasks, Request
 from sqlmodel import Session
 from app.api.v1.deps import get_db
 from app.crud.crud_task import code_diff_task, requirement_parse_task, pipeline_task, task_execution
@@ -18,6 +19,7 @@ from app.schemas.task import (
     TaskExecutionResponse, TaskExecutionRequest, TaskStats
 )
 from app.core.config import settings
+from app.services.diff_content_service import diff_content_service
 from app.tasks.requirement_tasks import parse_requirement_text, process_requirement_file
 
 router = APIRouter()
@@ -49,11 +51,24 @@ def create_code_diff_task(
             head_ref=task_in.head_ref
         )
         
-        if existing_task:
+        # 路径过滤和差异模式保存在任务元数据中
+        task_data = task_in.model_dump(exclude={"path_filters", "diff_mode"})
+        diff_options = {}
+        if task_in.path_filters:
+            diff_options["path_filters"] = task_in.path_filters
+        if task_in.diff_mode:
+            diff_options["diff_mode"] = task_in.diff_mode
+        task_data["task_metadata"] = {**(task_in.task_metadata or {}), **diff_options}
+        
+        # 过滤条件不同的差异不能复用
+        if existing_task and all(
+            (existing_task.task_metadata or {}).get(key) == diff_options.get(key)
+            for key in ("path_filters", "diff_mode")
+        ):
             return existing_task
         
         # 创建任务
-        task = code_diff_task.create(db=db, obj_in=task_in)
+        task = code_diff_task.create(db=db, obj_in=task_data)
         
         # 后台生成差异
         background_tasks.add_task(
@@ -151,13 +166,8 @@ def update_code_diff_task(
         )
 
 
-@router.get("/code-diff/{task_id}/content", tags=["代码差异任务"])
-def read_code_diff_content(
-    *,
-    db: Session = Depends(get_db),
-    task_id: int
-):
-    """获取代码差异内容"""
+def _get_diff_task_file(db: Session, task_id: int):
+    """获取代码差异任务并校验差异文件存在"""
     task = code_diff_task.get(db=db, id=task_id)
     if not task:
         raise HTTPException(
@@ -165,26 +175,34 @@ def read_code_diff_content(
             detail="代码差异任务不存在"
         )
     
-    if not task.diff_file_path or not os.path.exists(task.diff_file_path):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="差异文件不存在"
-        )
+    diff_content_service.ensure_file(task.diff_file_path)
+    return task
+
+
+@router.get("/code-diff/{task_id}/content", tags=["代码差异任务"])
+def read_code_diff_content(
+    *,
+    db: Session = Depends(get_db),
+    task_id: int,
+    offset: int = 0,
+    limit: Optional[int] = None
+):
+    """获取代码差异内容（按文件分页）"""
+    task = _get_diff_task_file(db, task_id)
     
     try:
-        with open(task.diff_file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        page = diff_content_service.read_page(task.diff_file_path, offset=offset, limit=limit)
         
         return {
             "task_id": task_id,
-            "content": content,
             "file_path": task.diff_file_path,
             "summary": task.diff_summary,
             "stats": {
                 "files_changed": task.files_changed,
                 "lines_added": task.lines_added,
                 "lines_deleted": task.lines_deleted
-            }
+            },
+            **page
         }
     except Exception as e:
         raise HTTPException(
@@ -193,6 +211,52 @@ def read_code_diff_content(
         )
 
 
+@router.get("/code-diff/{task_id}/files", tags=["代码差异任务"])
+def list_code_diff_files(
+    *,
+    db: Session = Depends(get_db),
+    task_id: int,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    path: Optional[str] = None
+):
+    """分页获取差异中的文件列表"""
+    task = _get_diff_task_file(db, task_id)
+    return {
+        "task_id": task_id,
+        **diff_content_service.list_files(task.diff_file_path, offset=offset, limit=limit, path=path)
+    }
+
+
+@router.get("/code-diff/{task_id}/files/{file_index}", tags=["代码差异任务"])
+def read_code_diff_file(
+    *,
+    db: Session = Depends(get_db),
+    task_id: int,
+    file_index: int
+):
+    """获取差异中单个文件的内容"""
+    task = _get_diff_task_file(db, task_id)
+    return {
+        "task_id": task_id,
+        **diff_content_service.get_file(task.diff_file_path, file_index)
+    }
+
+
+@router.get("/code-diff/{task_id}/raw", tags=["代码差异任务"])
+def read_code_diff_raw(
+    *,
+    db: Session = Depends(get_db),
+    request: Request,
+    task_id: int
+):
+    """获取原始差异文件（支持Range、ETag和gzip）"""
+    task = _get_diff_task_file(db, task_id)
+    return diff_content_service.raw_response(
+        request, task.diff_file_path, os.path.basename(task.diff_file_path)
+    )
+
+
 # ===== 需求解析任务管理 =====
 @router.post("/requirements", response_model=RequirementParseTaskResponse, tags=["需求解析任务"])
 def create_requirement_task(
@@ -334,42 +398,47 @@ def read_requirement_selectors(db: Session = Depends(get_db)):
 
 
 # ===== 后台任务函数 =====
-def generate_code_diff_task(task_id: int, repository):
-    """生成代码差异的后台任务"""
-    from app.core.git_utils import generate_diff
+async def generate_code_diff_task(task_id: int, repository):
+    """
+    生成代码差异的后台任务
+    
+    在事件循环上运行，git子进程和差异写入不占用线程；数据库操作是同步调用，放到线程池执行。
+    """
+    from app.core.git_utils import generate_diff_async
     import time
     
-    db = next(get_db())
+    db = await asyncio.to_thread(lambda: next(get_db()))
     
     try:
         # 更新状态为处理中
-        code_diff_task.update_status(db, task_id=task_id, status="processing")
+        await asyncio.to_thread(code_diff_task.update_status, db, task_id=task_id, status="processing")
         
         # 生成差异文件路径
         diff_dir = os.path.join(settings.UPLOAD_DIR, "diffs")
         os.makedirs(diff_dir, exist_ok=True)
         
-        task = code_diff_task.get(db, task_id)
+        task = await asyncio.to_thread(code_diff_task.get, db, task_id)
         output_path = os.path.join(
             diff_dir, 
             f"diff_{task_id}_{task.base_ref}_{task.head_ref}.diff"
         )
         
-        # 生成差异
-        success, message = generate_diff(
+        # 生成差异（异步子进程，不占用线程池）
+        metadata = task.task_metadata or {}
+        success, message, stats = await generate_diff_async(
             repository.url,
             repository.username,
             repository.password,
             task.base_ref,
             task.head_ref,
-            output_path
+            output_path,
+            path_filters=metadata.get("path_filters"),
+            mode=metadata.get("diff_mode")
         )
         
         if success:
-            # 分析差异文件
-            stats = analyze_diff_file(output_path)
-            
-            code_diff_task.update_status(
+            await asyncio.to_thread(
+                code_diff_task.update_status,
                 db, 
                 task_id=task_id, 
                 status="completed",
@@ -377,56 +446,27 @@ def generate_code_diff_task(task_id: int, repository):
                 diff_summary=f"变更了{stats['files_changed']}个文件，新增{stats['lines_added']}行，删除{stats['lines_deleted']}行",
                 files_changed=stats['files_changed'],
                 lines_added=stats['lines_added'],
-                lines_deleted=stats['lines_deleted']
+                lines_deleted=stats['lines_deleted'],
+                task_metadata={"diff_index_path": stats['index_path']}
             )
         else:
-            code_diff_task.update_status(
+            await asyncio.to_thread(
+                code_diff_task.update_status,
                 db, 
                 task_id=task_id, 
                 status="failed",
                 error_message=message
             )
     except Exception as e:
-        code_diff_task.update_status(
+        await asyncio.to_thread(
+            code_diff_task.update_status,
             db, 
             task_id=task_id, 
             status="failed",
             error_message=str(e)
         )
     finally:
-        db.close()
-
-
-def analyze_diff_file(file_path: str) -> dict:
-    """分析差异文件统计信息"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        lines = content.split('\n')
-        files_changed = 0
-        lines_added = 0
-        lines_deleted = 0
-        
-        for line in lines:
-            if line.startswith('diff --git'):
-                files_changed += 1
-            elif line.startswith('+') and not line.startswith('+++'):
-                lines_added += 1
-            elif line.startswith('-') and not line.startswith('---'):
-                lines_deleted += 1
-        
-        return {
-            'files_changed': files_changed,
-            'lines_added': lines_added,
-            'lines_deleted': lines_deleted
-        }
-    except Exception:
-        return {
-            'files_changed': 0,
-            'lines_added': 0,
-            'lines_deleted': 0
-        }
+        await asyncio.to_thread(db.close)
 
 
 # ===== 流水线任务管理 =====
@@ -12,7 +12,8 @@ celery_app = Celery(
     include=[
         "app.tasks.code_diff_tasks",
         "app.tasks.requirement_tasks", 
-        "app.tasks.pipeline_tasks"
+        "app.tasks.pipeline_tasks",
+        "app.tasks.document_tasks"
     ]
 )
 
@@ -35,6 +36,7 @@ celery_app.conf.task_routes = {
     "app.tasks.code_diff_tasks.*": {"queue": "code_diff"},
     "app.tasks.requirement_tasks.*": {"queue": "requirement"},
     "app.tasks.pipeline_tasks.*": {"queue": "pipeline"},
+    "app.tasks.document_tasks.*": {"queue": "ingestion"},
 }
 
 # 定义队列
@@ -56,6 +58,10 @@ celery_app.conf.task_queues = {
         "exchange": "pipeline",
         "routing_key": "pipeline",
     },
+    "ingestion": {
+        "exchange": "ingestion",
+        "routing_key": "ingestion",
+    },
 }
 
 if __name__ == "__main__":
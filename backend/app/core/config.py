@@ -36,6 +36,41 @@ class Settings(BaseSettings):
     LLM_MAX_TOKENS: int = 2000
     LLM_TIMEOUT: int = 60
 
+    # LLM HTTP连接池配置
+    LLM_HTTP2: bool = True
+    LLM_POOL_MAX_CONNECTIONS: int = 100
+    LLM_POOL_MAX_KEEPALIVE: int = 20
+    LLM_POOL_KEEPALIVE_EXPIRY: float = 30.0
+    LLM_CONNECT_TIMEOUT: float = 10.0
+
+    # LLM响应缓存配置（temperature为0的请求默认走缓存）
+    LLM_CACHE_ENABLED: bool = False
+    LLM_CACHE_PATH: str = "./cache/llm_cache.db"
+    LLM_CACHE_TTL: int = 86400  # 24小时
+    LLM_CACHE_MAX_MEMORY_ENTRIES: int = 1024
+    LLM_CACHE_MAX_DISK_MB: int = 512
+
+    # LLM限流与重试配置（按提供商生效，RPM/TPM为0表示不限制）
+    LLM_INITIAL_CONCURRENCY: int = 4
+    LLM_MIN_CONCURRENCY: int = 1
+    LLM_MAX_CONCURRENCY: int = 32
+    LLM_LATENCY_TARGET: float = 30.0
+    LLM_RPM_LIMIT: int = 0
+    LLM_TPM_LIMIT: int = 0
+    LLM_MAX_RETRIES: int = 4
+    LLM_RETRY_BASE_DELAY: float = 1.0
+    LLM_RETRY_MAX_DELAY: float = 60.0
+
+    # Token计数配置（TOKENIZER_BACKEND: auto在编码表已缓存时使用tiktoken，否则启发式估算，不联网；
+    # tiktoken允许联网下载编码表；heuristic仅用启发式估算）
+    TOKENIZER_BACKEND: str = "auto"
+    TOKENIZER_CACHE_DIR: str = "./cache/tiktoken"
+    LLM_DEFAULT_CONTEXT_WINDOW: int = 8192
+    RAG_MAX_CONTEXT_TOKENS: int = 2000
+
+    # 代码评审配置（大差异按token预算拆分后并发评审）
+    CODE_REVIEW_CHUNK_TOKENS: int = 6000
+
     # Celery配置
     CELERY_BROKER_URL: str = "redis://localhost:6379/0"
     CELERY_RESULT_BACKEND: str = "redis://localhost:6379/0"
@@ -43,12 +78,58 @@ class Settings(BaseSettings):
     CELERY_RESULT_SERIALIZER: str = "json"
     CELERY_TIMEZONE: str = "UTC"
     
+    # 任务级重试退避（LLM调用内部已按429/5xx重试，这里处理剩余失败；文档处理按阶段单独重试）
+    TASK_RETRY_BASE_DELAY: float = 10.0
+    TASK_RETRY_MAX_DELAY: float = 300.0
+    TASK_MAX_RETRIES: int = 3
+    DOCUMENT_STAGE_RETRY_BASE_DELAY: float = 5.0
+    DOCUMENT_STAGE_RETRY_MAX_DELAY: float = 120.0
+    DOCUMENT_STAGE_MAX_RETRIES: int = 3
+    
     # 向量数据库配置
     CHROMA_PERSIST_DIRECTORY: str = "./chroma_db"
     
+    # 向量化配置（模型按知识库的embedding_model选择，接口地址/密钥为空时沿用LLM配置）
+    EMBEDDING_BATCH_SIZE: int = 64
+    EMBEDDING_WORKERS: int = 4
+    EMBEDDING_DEVICE: str = "cpu"  # sentence-transformers本地模型运行设备
+    EMBEDDING_BASE_URL: Optional[str] = None
+    EMBEDDING_API_KEY: Optional[str] = None
+    EMBEDDING_CACHE_ENABLED: bool = True  # 按(模型, 切片内容哈希)缓存向量
+    EMBEDDING_CACHE_PATH: str = "./cache/embedding_cache.db"
+    EMBEDDING_CACHE_MAX_DISK_MB: int = 2048
+    
+    # Git镜像缓存配置
+    GIT_MIRROR_DIR: str = "./git_mirrors"
+    GIT_MIRROR_MAX_SIZE_MB: int = 10240
+    GIT_MIRROR_FETCH_TTL: int = 60  # 距上次fetch超过该秒数才重新fetch
+    GIT_TIMEOUT: int = 600
+    GIT_DIFF_MODE: str = "mirror"  # mirror: 完整镜像；partial: 浅层部分克隆，只获取差异所需对象
+    GIT_MAX_CONCURRENCY: int = 4  # 同时运行的git子进程上限（异步路径）
+    GIT_STREAM_CHUNK_SIZE: int = 65536
+    DIFF_PAGE_SIZE: int = 50  # 差异内容分页：每页最多文件数
+    DIFF_PAGE_MAX_BYTES: int = 1048576  # 差异内容分页：每页最大字节数
+
     # 文件上传配置
     UPLOAD_DIR: str = "./uploads"
     MAX_FILE_SIZE: int = 10485760  # 10MB
+    INGEST_FLUSH_BATCH_SIZE: int = 256  # 文档入库时每批向量化并写入的切片数
+    TEXT_SPLITTER_LENGTH_UNIT: str = "char"  # 知识库切片长度单位：char按字符，token按分词器token数
+    
+    # PDF/Word文本提取子进程配置
+    EXTRACTION_WORKERS: int = 0  # 单个文件并行解析的进程数，0表示CPU核数
+    EXTRACTION_PAGES_PER_TASK: int = 32  # 大PDF按该页数拆分到不同进程
+    EXTRACTION_TIMEOUT: int = 300  # 单个文件解析超时（秒）
+    EXTRACTION_MAX_MEMORY_MB: int = 2048  # 单个解析进程地址空间上限，0表示不限制
+    
+    # 知识库批量入库配置
+    BULK_INGEST_ROOT: str = ""  # 允许批量导入的服务器目录根路径，为空时禁用目录导入
+    BULK_INGEST_WINDOW: int = 32  # 同时在入库流水线中的文档数上限
+    BULK_INGEST_POLL_INTERVAL: int = 5  # 检查批次进度并补充提交的间隔（秒）
+    BULK_INGEST_STALE_TIMEOUT: int = 3600  # 批次中的文档超过该时间（秒）状态未推进时标记为失败
+    BULK_INGEST_MAX_FILES: int = 10000
+    BULK_INGEST_MAX_ARCHIVE_SIZE: int = 1073741824  # 1GB
+    BULK_INGEST_MAX_EXTRACTED_SIZE: int = 5368709120  # 5GB
     
     # 日志配置
     LOG_LEVEL: str = "INFO"
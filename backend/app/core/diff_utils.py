@@ -0,0 +1,474 @@
+"""
+统一差异格式（unified diff）解析工具
+"""
+import os
+import re
+import json
+import hashlib
+from typing import List, Optional
+
+
+HUNK_HEADER_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$')
+
+
+class DiffHunk:
+    """差异块（以@@开头的一段变更）"""
+
+    def __init__(self, old_start: int, old_lines: int, new_start: int, new_lines: int, section: str = ""):
+        self.old_start = old_start
+        self.old_lines = old_lines
+        self.new_start = new_start
+        self.new_lines = new_lines
+        # @@ ... @@ 之后的函数/类上下文
+        self.section = section
+        self.lines: List[str] = []
+
+    @property
+    def header(self) -> str:
+        return f"@@ -{self.old_start},{self.old_lines} +{self.new_start},{self.new_lines} @@{self.section}"
+
+    @property
+    def text(self) -> str:
+        return "\n".join([self.header] + self.lines)
+
+    @property
+    def added(self) -> int:
+        return sum(1 for line in self.lines if line.startswith('+'))
+
+    @property
+    def deleted(self) -> int:
+        return sum(1 for line in self.lines if line.startswith('-'))
+
+    def content_hash(self, path: str) -> str:
+        """
+        计算差异块内容哈希
+
+        只包含文件路径和变更内容，不包含@@行号，
+        因此文件前部变更导致差异块整体平移时哈希不变。
+        """
+        payload = "\n".join([path] + self.lines)
+        return hashlib.sha256(payload.encode('utf-8', errors='replace')).hexdigest()
+
+    def split(self, max_lines: int) -> List["DiffHunk"]:
+        """
+        按行数拆分为多个子块，并重新计算每个子块的起始行号
+
+        Args:
+            max_lines: 每个子块最多包含的行数
+
+        Returns:
+            子块列表
+        """
+        if len(self.lines) <= max_lines:
+            return [self]
+
+        pieces = []
+        old_line = self.old_start
+        new_line = self.new_start
+        for i in range(0, len(self.lines), max_lines):
+            body = self.lines[i:i + max_lines]
+            old_count = sum(1 for line in body if line[:1] in (' ', '-'))
+            new_count = sum(1 for line in body if line[:1] in (' ', '+'))
+            piece = DiffHunk(old_line, old_count, new_line, new_count, self.section)
+            piece.lines = body
+            pieces.append(piece)
+            old_line += old_count
+            new_line += new_count
+        return pieces
+
+
+class FileDiff:
+    """单个文件的差异"""
+
+    def __init__(self, old_path: Optional[str] = None, new_path: Optional[str] = None):
+        self.old_path = old_path
+        self.new_path = new_path
+        # diff --git / index / --- / +++ 等文件头行
+        self.header_lines: List[str] = []
+        self.hunks: List[DiffHunk] = []
+        self.is_binary = False
+
+    @property
+    def path(self) -> str:
+        if self.new_path and self.new_path != "/dev/null":
+            return self.new_path
+        return self.old_path or ""
+
+    @property
+    def header(self) -> str:
+        return "\n".join(self.header_lines)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.header_lines + [hunk.text for hunk in self.hunks])
+
+    @property
+    def added(self) -> int:
+        return sum(hunk.added for hunk in self.hunks)
+
+    @property
+    def deleted(self) -> int:
+        return sum(hunk.deleted for hunk in self.hunks)
+
+
+def _strip_prefix(path: str) -> str:
+    """去掉git差异路径中的a/、b/前缀"""
+    path = path.split('\t')[0].strip()
+    if path.startswith('"') and path.endswith('"'):
+        path = path[1:-1]
+    if path.startswith(('a/', 'b/')):
+        return path[2:]
+    return path
+
+
+def parse_unified_diff(diff_text: str) -> List[FileDiff]:
+    """
+    解析统一差异格式文本
+
+    Args:
+        diff_text: git diff输出
+
+    Returns:
+        文件差异列表
+    """
+    files: List[FileDiff] = []
+    current: Optional[FileDiff] = None
+    hunk: Optional[DiffHunk] = None
+    old_remaining = new_remaining = 0
+
+    for line in diff_text.splitlines():
+        # 差异块内部按头部声明的行数消费，避免把以---/+++开头的内容行误判为文件头
+        if hunk is not None and (old_remaining > 0 or new_remaining > 0):
+            hunk.lines.append(line)
+            tag = line[:1]
+            if tag == '-':
+                old_remaining -= 1
+            elif tag == '+':
+                new_remaining -= 1
+            elif tag != '\\':
+                old_remaining -= 1
+                new_remaining -= 1
+            continue
+
+        if hunk is not None and line.startswith('\\'):
+            # "\ No newline at end of file"
+            hunk.lines.append(line)
+            continue
+
+        if line.startswith('diff --git '):
+            current = FileDiff()
+            parts = line[len('diff --git '):].split(' b/', 1)
+            if len(parts) == 2:
+                current.old_path = _strip_prefix(parts[0])
+                current.new_path = parts[1]
+            current.header_lines.append(line)
+            files.append(current)
+            hunk = None
+            continue
+
+        match = HUNK_HEADER_RE.match(line)
+        if match and current is not None:
+            hunk = DiffHunk(
+                old_start=int(match.group(1)),
+                old_lines=int(match.group(2)) if match.group(2) is not None else 1,
+                new_start=int(match.group(3)),
+                new_lines=int(match.group(4)) if match.group(4) is not None else 1,
+                section=match.group(5)
+            )
+            current.hunks.append(hunk)
+            old_remaining, new_remaining = hunk.old_lines, hunk.new_lines
+            continue
+
+        if line.startswith('--- '):
+            # 非git格式的差异没有diff --git行，以---开始新文件
+            if current is None or current.hunks:
+                current = FileDiff()
+                files.append(current)
+            current.old_path = _strip_prefix(line[4:])
+            current.header_lines.append(line)
+            hunk = None
+            continue
+
+        if current is None:
+            continue
+
+        if line.startswith('+++ '):
+            current.new_path = _strip_prefix(line[4:])
+        elif line.startswith('Binary files ') or line.startswith('GIT binary patch'):
+            current.is_binary = True
+        current.header_lines.append(line)
+        hunk = None
+
+    return files
+
+
+
+HUNK_HEADER_BYTES_RE = re.compile(rb'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+# 差异索引格式版本，结构变化时递增，旧索引会被重新构建
+# （版本2：修正文件/差异块长度多包含下一个头部行的问题）
+DIFF_INDEX_VERSION = 2
+
+DIFF_INDEX_SUFFIX = ".index.json"
+
+
+class DiffIndexBuilder:
+    """
+    流式差异解析与索引
+
+    按任意大小的字节块喂入git diff输出，单遍统计变更文件数和增删行数，
+    同时记录每个文件及差异块在文件中的字节偏移，不保留差异内容，
+    内存占用只与文件/差异块数量有关。
+
+    索引结构：
+        {
+            "version": 2, "total_bytes": ..., "files_changed": ..., "lines_added": ..., "lines_deleted": ...,
+            "files": [{
+                "path", "old_path", "new_path", "offset", "length", "added", "deleted", "is_binary",
+                "hunks": [[offset, length, old_start, old_lines, new_start, new_lines, added, deleted], ...]
+            }]
+        }
+    """
+
+    def __init__(self):
+        self.files: List[dict] = []
+        self.lines_added = 0
+        self.lines_deleted = 0
+        self._buffer = b""
+        self._position = 0
+        self._file: Optional[dict] = None
+        self._hunk: Optional[list] = None
+        self._old_remaining = 0
+        self._new_remaining = 0
+        self._closed = False
+
+    @property
+    def files_changed(self) -> int:
+        return len(self.files)
+
+    def feed(self, chunk: bytes):
+        """喂入一块数据，跨块的半行留到下一块处理"""
+        if not chunk:
+            return
+        lines = (self._buffer + chunk).split(b"\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            self._feed_line(line, len(line) + 1)
+
+    def close(self):
+        """处理末尾没有换行符的最后一行并结束最后一个文件"""
+        if self._closed:
+            return
+        if self._buffer:
+            self._feed_line(self._buffer, len(self._buffer))
+            self._buffer = b""
+        self._finish_file(self._position)
+        self._closed = True
+
+    def _finish_hunk(self, end: int):
+        """结束当前差异块，end为下一个头部行的起点（不含该行）"""
+        if self._hunk is not None:
+            self._hunk[1] = end - self._hunk[0]
+            self._hunk = None
+
+    def _finish_file(self, end: int):
+        """结束当前文件，end为下一个文件头部行的起点（不含该行）"""
+        self._finish_hunk(end)
+        if self._file is not None:
+            self._file["length"] = end - self._file["offset"]
+            self._file = None
+        self._old_remaining = self._new_remaining = 0
+
+    def _start_file(self, offset: int) -> dict:
+        self._finish_file(offset)
+        self._file = {
+            "path": "",
+            "old_path": None,
+            "new_path": None,
+            "offset": offset,
+            "length": 0,
+            "added": 0,
+            "deleted": 0,
+            "is_binary": False,
+            "hunks": []
+        }
+        self.files.append(self._file)
+        return self._file
+
+    @staticmethod
+    def _decode_path(raw: bytes) -> str:
+        return _strip_prefix(raw.decode("utf-8", errors="replace"))
+
+    def _feed_line(self, line: bytes, size: int):
+        offset = self._position
+        self._position += size
+        if line.endswith(b"\r"):
+            line = line[:-1]
+
+        # 与parse_unified_diff一致：差异块内按头部声明的行数消费
+        if self._old_remaining > 0 or self._new_remaining > 0:
+            tag = line[:1]
+            if tag == b'-':
+                self._count(deleted=1)
+                self._old_remaining -= 1
+            elif tag == b'+':
+                self._count(added=1)
+                self._new_remaining -= 1
+            elif tag != b'\\':
+                self._old_remaining -= 1
+                self._new_remaining -= 1
+            return
+
+        if line.startswith(b'\\'):
+            # "\ No newline at end of file"
+            return
+
+        if line.startswith(b'diff --git '):
+            entry = self._start_file(offset)
+            parts = line[len(b'diff --git '):].split(b' b/', 1)
+            if len(parts) == 2:
+                entry["old_path"] = self._decode_path(parts[0])
+                entry["new_path"] = parts[1].decode("utf-8", errors="replace")
+            self._update_path(entry)
+            return
+
+        match = HUNK_HEADER_BYTES_RE.match(line)
+        if match and self._file is not None:
+            self._finish_hunk(offset)
+            old_lines = int(match.group(2)) if match.group(2) is not None else 1
+            new_lines = int(match.group(4)) if match.group(4) is not None else 1
+            self._hunk = [offset, 0, int(match.group(1)), old_lines, int(match.group(3)), new_lines, 0, 0]
+            self._file["hunks"].append(self._hunk)
+            self._old_remaining, self._new_remaining = old_lines, new_lines
+            return
+
+        if line.startswith(b'--- '):
+            # 非git格式的差异没有diff --git行，以---开始新文件
+            if self._file is None or self._file["hunks"]:
+                self._start_file(offset)
+            self._file["old_path"] = self._decode_path(line[4:])
+            self._update_path(self._file)
+            return
+
+        if self._file is None:
+            return
+
+        if line.startswith(b'+++ '):
+            self._file["new_path"] = self._decode_path(line[4:])
+            self._update_path(self._file)
+        elif line.startswith(b'Binary files ') or line.startswith(b'GIT binary patch'):
+            self._file["is_binary"] = True
+
+    @staticmethod
+    def _update_path(entry: dict):
+        if entry["new_path"] and entry["new_path"] != "/dev/null":
+            entry["path"] = entry["new_path"]
+        else:
+            entry["path"] = entry["old_path"] or ""
+
+    def _count(self, added: int = 0, deleted: int = 0):
+        self.lines_added += added
+        self.lines_deleted += deleted
+        self._file["added"] += added
+        self._file["deleted"] += deleted
+        self._hunk[6] += added
+        self._hunk[7] += deleted
+
+    def stats(self) -> dict:
+        """获取统计结果"""
+        return {
+            'files_changed': self.files_changed,
+            'lines_added': self.lines_added,
+            'lines_deleted': self.lines_deleted
+        }
+
+    def index(self) -> dict:
+        """获取完整索引（会先结束解析）"""
+        self.close()
+        return {
+            "version": DIFF_INDEX_VERSION,
+            "total_bytes": self._position,
+            **self.stats(),
+            "files": self.files
+        }
+
+
+def diff_index_path(diff_path: str) -> str:
+    """差异文件对应的索引文件路径"""
+    return f"{diff_path}{DIFF_INDEX_SUFFIX}"
+
+
+def build_diff_index(diff_path: str, chunk_size: int = 65536) -> dict:
+    """
+    流式扫描差异文件构建索引
+
+    Args:
+        diff_path: 差异文件路径
+        chunk_size: 每次读取的字节数
+
+    Returns:
+        差异索引
+    """
+    builder = DiffIndexBuilder()
+    with open(diff_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            builder.feed(chunk)
+    return builder.index()
+
+
+def save_diff_index(index: dict, diff_path: str) -> str:
+    """
+    将索引保存为差异文件旁的JSON文件
+
+    Returns:
+        索引文件路径
+    """
+    path = diff_index_path(diff_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_diff_index(diff_path: str, rebuild: bool = True) -> Optional[dict]:
+    """
+    读取差异索引
+
+    索引不存在、版本不符或已落后于差异文件时按需重新构建并保存。
+
+    Args:
+        diff_path: 差异文件路径
+        rebuild: 索引不可用时是否重新构建
+
+    Returns:
+        差异索引，不可用返回None
+    """
+    path = diff_index_path(diff_path)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(diff_path):
+            with open(path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("version") == DIFF_INDEX_VERSION:
+                return index
+    except (OSError, ValueError):
+        pass
+
+    if not rebuild or not os.path.exists(diff_path):
+        return None
+    index = build_diff_index(diff_path)
+    try:
+        save_diff_index(index, diff_path)
+    except OSError as e:
+        print(f"保存差异索引失败: {e}")
+    return index
+
+
+def read_diff_range(diff_path: str, offset: int, length: int) -> str:
+    """按索引中的字节偏移读取差异片段"""
+    with open(diff_path, "rb") as f:
+        f.seek(offset)
+        return f.read(length).decode("utf-8", errors="replace")
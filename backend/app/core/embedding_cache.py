@@ -0,0 +1,193 @@
+"""
+向量缓存
+SQLite持久化，按(嵌入模型, 切片内容哈希)寻址，向量以float32字节存储，
+跨文档、跨知识库复用相同内容的向量
+"""
+import os
+import time
+import sqlite3
+import threading
+from array import array
+from typing import Dict, Any, List, Optional, Tuple
+
+
+class EmbeddingCache:
+    """向量缓存"""
+
+    # 每写入多少条执行一次磁盘淘汰
+    EVICT_INTERVAL = 1000
+
+    # 单条SQL中IN参数的数量上限（SQLite默认变量上限为999）
+    QUERY_BATCH_SIZE = 500
+
+    def __init__(self, db_path: str, max_disk_bytes: int = 2048 * 1024 * 1024):
+        """
+        初始化缓存
+
+        Args:
+            db_path: SQLite缓存文件路径
+            max_disk_bytes: 磁盘缓存最大字节数
+        """
+        self.db_path = db_path
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+
+        # 命中统计（按切片计）
+        self.hits = 0
+        self.misses = 0
+
+    def _get_conn(self) -> sqlite3.Connection:
+        """懒加载SQLite连接"""
+        if self._conn is None:
+            cache_dir = os.path.dirname(self.db_path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5.0)
+            # WAL模式支持API进程与多个Celery进程并发读写
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (model, content_hash)
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_access ON embedding_cache (last_access)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _encode(vector: List[float]) -> bytes:
+        return array('f', vector).tobytes()
+
+    @staticmethod
+    def _decode(data: bytes) -> List[float]:
+        vector = array('f')
+        vector.frombytes(data)
+        return vector.tolist()
+
+    def get_many(self, model: str, content_hashes: List[str]) -> Dict[str, List[float]]:
+        """
+        批量读取缓存
+
+        Args:
+            model: 嵌入模型标识
+            content_hashes: 内容哈希列表
+
+        Returns:
+            命中的 内容哈希 -> 向量
+        """
+        unique_hashes = list(dict.fromkeys(content_hashes))
+        found: Dict[str, List[float]] = {}
+        if not unique_hashes:
+            return found
+
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._get_conn()
+                for i in range(0, len(unique_hashes), self.QUERY_BATCH_SIZE):
+                    batch = unique_hashes[i:i + self.QUERY_BATCH_SIZE]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = conn.execute(
+                        f"SELECT content_hash, vector FROM embedding_cache "
+                        f"WHERE model = ? AND content_hash IN ({placeholders})",
+                        [model, *batch]
+                    ).fetchall()
+                    for content_hash, data in rows:
+                        found[content_hash] = self._decode(data)
+
+                if found:
+                    conn.executemany(
+                        "UPDATE embedding_cache SET last_access = ? WHERE model = ? AND content_hash = ?",
+                        [(now, model, content_hash) for content_hash in found]
+                    )
+                    conn.commit()
+            except Exception as e:
+                print(f"读取向量缓存失败: {e}")
+
+            self.hits += len(found)
+            self.misses += len(unique_hashes) - len(found)
+        return found
+
+    def set_many(self, model: str, items: List[Tuple[str, List[float]]]):
+        """
+        批量写入缓存
+
+        Args:
+            model: 嵌入模型标识
+            items: (内容哈希, 向量) 列表
+        """
+        if not items:
+            return
+
+        now = time.time()
+        rows = [(model, content_hash, self._encode(vector), now) for content_hash, vector in items]
+        with self._lock:
+            try:
+                conn = self._get_conn()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embedding_cache (model, content_hash, vector, last_access) "
+                    "VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                conn.commit()
+
+                previous = self._writes
+                self._writes += len(rows)
+                if self._writes // self.EVICT_INTERVAL != previous // self.EVICT_INTERVAL:
+                    self._evict_disk(conn)
+            except Exception as e:
+                print(f"写入向量缓存失败: {e}")
+
+    def _evict_disk(self, conn: sqlite3.Connection):
+        """按最近访问时间淘汰超出容量的条目"""
+        total_size = conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache"
+        ).fetchone()[0]
+        if total_size <= self.max_disk_bytes:
+            return
+
+        # 淘汰到容量的90%，避免每次写入都触发淘汰
+        target = int(self.max_disk_bytes * 0.9)
+        rows = conn.execute(
+            "SELECT model, content_hash, LENGTH(vector) FROM embedding_cache ORDER BY last_access ASC"
+        )
+        evict_keys = []
+        for model, content_hash, size in rows:
+            if total_size <= target:
+                break
+            evict_keys.append((model, content_hash))
+            total_size -= size
+        conn.executemany("DELETE FROM embedding_cache WHERE model = ? AND content_hash = ?", evict_keys)
+        conn.commit()
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            try:
+                conn = self._get_conn()
+                conn.execute("DELETE FROM embedding_cache")
+                conn.commit()
+            except Exception as e:
+                print(f"清空向量缓存失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取命中统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
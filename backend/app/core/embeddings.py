@@ -0,0 +1,328 @@
+"""
+文本向量化
+按知识库的embedding_model选择嵌入后端，分批并发计算向量后再写入ChromaDB，
+向量化开销不再隐式发生在ChromaDB内部
+"""
+import re
+import math
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import httpx
+from app.core.config import settings
+from app.core.llm_limiter import backoff_delay, parse_retry_after, RETRYABLE_STATUS_CODES
+from app.core.vector_store import chroma_manager
+from app.core.embedding_cache import EmbeddingCache
+
+
+# 哈希嵌入的默认维度
+HASHING_DEFAULT_DIM = 384
+
+# ChromaDB内置默认嵌入模型（onnx版all-MiniLM-L6-v2）
+CHROMA_DEFAULT_MODEL = "chroma-default"
+
+# 集合元数据中记录向量由平台计算的后端名，没有该字段的集合由ChromaDB默认模型向量化
+COLLECTION_BACKEND_KEY = "embedding_backend"
+
+# CJK单字、英文单词、数字
+_HASH_TOKEN_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]|[a-z]+|\d+')
+
+
+class BaseEmbedder:
+    """嵌入后端基类"""
+
+    backend = "base"
+
+    # 计算代价低于缓存读写的后端不使用向量缓存
+    cacheable = True
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @property
+    def identity(self) -> str:
+        """向量缓存中的模型标识"""
+        return f"{self.backend}:{self.model}"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """计算一批文本的向量"""
+        raise NotImplementedError
+
+
+class HashingEmbedder(BaseEmbedder):
+    """
+    哈希嵌入
+
+    词（CJK按单字及相邻二元组）经哈希映射到固定维度并做L2归一化，
+    结果确定、无需模型文件，适用于测试和离线环境，语义效果有限。
+    """
+
+    backend = "hashing"
+    cacheable = False
+
+    def __init__(self, model: str, dim: int = HASHING_DEFAULT_DIM):
+        super().__init__(model)
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        tokens = _HASH_TOKEN_RE.findall(text.lower())
+        features = list(tokens)
+        features.extend(f"{a}{b}" for a, b in zip(tokens, tokens[1:]) if len(a) == 1 and len(b) == 1)
+        return features
+
+    def _embed_one(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dim] += 1.0 if (value >> 63) & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector))
+        if norm:
+            vector = [x / norm for x in vector]
+        return vector
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed_one(text) for text in texts]
+
+
+class ChromaDefaultEmbedder(BaseEmbedder):
+    """ChromaDB内置默认嵌入（本地CPU运行的onnx模型，兼容此前未显式向量化的集合）"""
+
+    backend = "chroma"
+
+    def __init__(self, model: str):
+        super().__init__(model)
+        from chromadb.utils import embedding_functions
+        self._function = embedding_functions.DefaultEmbeddingFunction()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [[float(x) for x in vector] for vector in self._function(texts)]
+
+
+class SentenceTransformerEmbedder(BaseEmbedder):
+    """sentence-transformers本地模型"""
+
+    backend = "sentence-transformers"
+
+    def __init__(self, model: str):
+        super().__init__(model)
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ValueError(f"嵌入模型 {model} 需要安装sentence-transformers")
+        name = model.split(":", 1)[1] if model.startswith("local:") else model
+        self._model = SentenceTransformer(name, device=settings.EMBEDDING_DEVICE)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = self._model.encode(
+            texts,
+            batch_size=len(texts),
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return vectors.tolist()
+
+
+class OpenAIEmbedder(BaseEmbedder):
+    """OpenAI兼容的 /embeddings 接口"""
+
+    backend = "openai"
+
+    def __init__(self, model: str):
+        super().__init__(model)
+        api_key = settings.EMBEDDING_API_KEY or settings.LLM_API_KEY
+        if not api_key:
+            raise ValueError(f"嵌入模型 {model} 需要配置EMBEDDING_API_KEY或LLM_API_KEY")
+        base_url = (settings.EMBEDDING_BASE_URL or settings.LLM_BASE_URL).rstrip("/")
+        self.base_url = base_url
+        self._client = httpx.Client(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=httpx.Timeout(settings.LLM_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT)
+        )
+
+    @property
+    def identity(self) -> str:
+        # 不同提供商的同名模型向量不通用
+        return f"{self.backend}:{self.base_url}:{self.model}"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        max_retries = settings.LLM_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            try:
+                response = self._client.post("/embeddings", json={"model": self.model, "input": texts})
+            except httpx.TransportError:
+                if attempt >= max_retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+
+            if response.status_code in RETRYABLE_STATUS_CODES and attempt < max_retries:
+                delay = parse_retry_after(response.headers.get("retry-after"))
+                time.sleep(delay if delay is not None else backoff_delay(attempt))
+                continue
+
+            response.raise_for_status()
+            data = sorted(response.json()["data"], key=lambda item: item["index"])
+            return [item["embedding"] for item in data]
+
+
+class EmbeddingService:
+    """
+    向量化服务
+
+    embedding_model到后端的映射：
+    - hashing / hashing-<维度>：哈希嵌入
+    - chroma-default：ChromaDB内置默认模型
+    - text-embedding-*：OpenAI兼容接口
+    - 其他（可加local:前缀）：sentence-transformers本地模型
+
+    文本按EMBEDDING_BATCH_SIZE分批，多批时在线程池中并发计算（模型推理和HTTP请求都会释放GIL）。
+    提供内容哈希时先查向量缓存，只计算未缓存的切片。
+    """
+
+    def __init__(self):
+        self._embedders: Dict[str, BaseEmbedder] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.cache: Optional[EmbeddingCache] = None
+        if settings.EMBEDDING_CACHE_ENABLED:
+            self.cache = EmbeddingCache(
+                db_path=settings.EMBEDDING_CACHE_PATH,
+                max_disk_bytes=settings.EMBEDDING_CACHE_MAX_DISK_MB * 1024 * 1024
+            )
+
+    @staticmethod
+    def backend_for(model: str) -> str:
+        """嵌入模型对应的后端名"""
+        name = (model or "").lower()
+        if name == "hashing" or name.startswith("hashing-"):
+            return HashingEmbedder.backend
+        if name == CHROMA_DEFAULT_MODEL:
+            return ChromaDefaultEmbedder.backend
+        if name.startswith("text-embedding-"):
+            return OpenAIEmbedder.backend
+        return SentenceTransformerEmbedder.backend
+
+    def _create_embedder(self, model: str) -> BaseEmbedder:
+        backend = self.backend_for(model)
+        if backend == HashingEmbedder.backend:
+            _, _, dim = model.partition("-")
+            if dim and not dim.isdigit():
+                raise ValueError(f"无效的哈希嵌入维度: {model}")
+            return HashingEmbedder(model, dim=int(dim) if dim else HASHING_DEFAULT_DIM)
+        if backend == ChromaDefaultEmbedder.backend:
+            return ChromaDefaultEmbedder(model)
+        if backend == OpenAIEmbedder.backend:
+            return OpenAIEmbedder(model)
+        return SentenceTransformerEmbedder(model)
+
+    def get_embedder(self, model: str) -> BaseEmbedder:
+        """获取嵌入后端（按模型名缓存，本地模型只加载一次）"""
+        with self._lock:
+            embedder = self._embedders.get(model)
+            if embedder is None:
+                embedder = self._create_embedder(model)
+                self._embedders[model] = embedder
+            return embedder
+
+    @staticmethod
+    def resolve_model(embedding_model: Optional[str], collection_metadata: Optional[Dict] = None) -> str:
+        """
+        确定集合实际使用的嵌入模型
+
+        以创建集合时记录的模型为准，保证同一集合内向量空间一致；
+        元数据中没有embedding_backend的集合由ChromaDB默认模型向量化，继续使用该模型。
+
+        Args:
+            embedding_model: 知识库配置的嵌入模型
+            collection_metadata: 集合元数据
+
+        Returns:
+            嵌入模型
+        """
+        if collection_metadata is None:
+            return embedding_model
+        if COLLECTION_BACKEND_KEY not in collection_metadata:
+            return CHROMA_DEFAULT_MODEL
+        return collection_metadata.get("embedding_model") or embedding_model
+
+    def model_for_collection(self, collection_name: str, embedding_model: Optional[str] = None) -> str:
+        """获取向量集合使用的嵌入模型"""
+        metadata = chroma_manager.get_collection_metadata(collection_name)
+        if metadata is None:
+            raise Exception(f"向量集合不存在: {collection_name}")
+        return self.resolve_model(embedding_model, metadata)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.EMBEDDING_WORKERS,
+                    thread_name_prefix="embedding"
+                )
+            return self._executor
+
+    def _embed_batched(self, embedder: BaseEmbedder, texts: List[str]) -> List[List[float]]:
+        """分批计算向量，多批时并发"""
+        batch_size = max(1, settings.EMBEDDING_BATCH_SIZE)
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        if len(batches) == 1 or settings.EMBEDDING_WORKERS <= 1:
+            results = [embedder.embed(batch) for batch in batches]
+        else:
+            results = list(self._get_executor().map(embedder.embed, batches))
+
+        vectors = [vector for result in results for vector in result]
+        if len(vectors) != len(texts):
+            raise Exception(f"向量数量与文本数量不一致: {len(vectors)} != {len(texts)}")
+        return vectors
+
+    def embed_documents(
+        self,
+        model: str,
+        texts: List[str],
+        content_hashes: Optional[List[str]] = None
+    ) -> List[List[float]]:
+        """
+        批量计算文本向量
+
+        Args:
+            model: 嵌入模型
+            texts: 文本列表
+            content_hashes: 与texts对应的内容哈希，提供时使用向量缓存
+
+        Returns:
+            与texts顺序一致的向量列表
+        """
+        if not texts:
+            return []
+
+        embedder = self.get_embedder(model)
+        if not (self.cache and embedder.cacheable and content_hashes):
+            return self._embed_batched(embedder, texts)
+
+        vectors = self.cache.get_many(embedder.identity, content_hashes)
+
+        # 未命中的内容去重后计算
+        missing: Dict[str, str] = {}
+        for text, content_hash in zip(texts, content_hashes):
+            if content_hash not in vectors and content_hash not in missing:
+                missing[content_hash] = text
+        if missing:
+            computed: List[Tuple[str, List[float]]] = list(zip(
+                missing.keys(), self._embed_batched(embedder, list(missing.values()))
+            ))
+            self.cache.set_many(embedder.identity, computed)
+            vectors.update(computed)
+
+        return [vectors[content_hash] for content_hash in content_hashes]
+
+    def embed_query(self, model: str, text: str) -> List[float]:
+        """计算查询文本向量"""
+        return self.get_embedder(model).embed([text])[0]
+
+
+# 创建全局向量化服务实例
+embedding_service = EmbeddingService()
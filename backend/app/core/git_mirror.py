@@ -0,0 +1,540 @@
+"""
+Git裸仓库镜像缓存
+每个远程仓库在本地维护一个裸仓库，通过增量fetch更新，差异和日志直接在本地镜像上计算
+"""
+import os
+import time
+import base64
+import asyncio
+import shutil
+import hashlib
+import threading
+import subprocess
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.git_runner import async_git_runner, GitResult
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class GitMirrorError(Exception):
+    """镜像操作失败"""
+    pass
+
+
+class GitMirrorManager:
+    """
+    Git镜像管理器
+
+    - 镜像目录按仓库URL哈希命名，remote中只保存不含凭据的URL
+    - 认证通过一次性的 http.extraHeader 传入，不落盘
+    - 同一仓库的fetch通过asyncio锁 + 文件锁（跨Celery进程）串行化
+    - 读取镜像期间持有共享读锁（reading），淘汰和删除镜像需要排他锁，正在读取的镜像不会被删除
+    - 镜像同步和读取基于asyncio子进程（以_async结尾的方法），供异步接口和后台任务使用
+    - 部分克隆模式（partial）使用独立的浅层镜像，只按需获取差异两端的提交和树，
+      文件内容（blob）在git diff时按需从promisor远端拉取
+    - 总大小超过上限时按最近使用时间淘汰
+    """
+
+    LAST_USED_FILE = "mirror_last_used"
+    LAST_FETCH_FILE = "mirror_last_fetch"
+    SIZE_FILE = "mirror_size"
+    # 最近使用过的镜像不参与淘汰（实际取该值与GIT_TIMEOUT两倍中的较大者）；
+    # 正在读取的镜像由读锁保护，宽限期只是额外的保险
+    EVICT_GRACE_SECONDS = 600
+
+    def __init__(self):
+        self.root = settings.GIT_MIRROR_DIR
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._async_locks: Dict[str, asyncio.Lock] = {}
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @staticmethod
+    def _mirror_key(url: str) -> str:
+        return hashlib.sha1(url.strip().rstrip("/").encode("utf-8")).hexdigest()[:20]
+
+    def _lock_key(self, url: str, partial: bool = False) -> str:
+        key = self._mirror_key(url)
+        return f"{key}.partial" if partial else key
+
+    def mirror_path(self, url: str, partial: bool = False) -> str:
+        """获取仓库镜像路径（部分克隆镜像与完整镜像分开存放）"""
+        return os.path.join(self.root, f"{self._lock_key(url, partial)}.git")
+
+    @staticmethod
+    def auth_args(username: Optional[str], token: Optional[str]) -> List[str]:
+        """构建一次性认证参数"""
+        args = ["-c", "credential.helper="]
+        if token:
+            credentials = base64.b64encode(f"{username or ''}:{token}".encode("utf-8")).decode("ascii")
+            args += ["-c", f"http.extraHeader=Authorization: Basic {credentials}"]
+        return args
+
+    @staticmethod
+    def git_env() -> Dict[str, str]:
+        """禁止git交互式提示"""
+        env = dict(os.environ)
+        env["GIT_TERMINAL_PROMPT"] = "0"
+        return env
+
+    @staticmethod
+    def _command(args: List[str], git_dir: Optional[str], auth: Optional[List[str]]) -> List[str]:
+        command = ["git"] + (auth or [])
+        if git_dir:
+            command += ["--git-dir", git_dir]
+        return command + args
+
+    def run_git(
+        self,
+        args: List[str],
+        git_dir: Optional[str] = None,
+        timeout: Optional[float] = None,
+        auth: Optional[List[str]] = None
+    ) -> subprocess.CompletedProcess:
+        """
+        执行git命令
+
+        Args:
+            args: git子命令及参数
+            git_dir: 仓库目录
+            timeout: 超时时间（秒）
+            auth: 认证参数
+
+        Returns:
+            执行结果
+        """
+        return subprocess.run(
+            self._command(args, git_dir, auth),
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            timeout=timeout or settings.GIT_TIMEOUT,
+            env=self.git_env()
+        )
+
+    async def run_git_async(
+        self,
+        args: List[str],
+        git_dir: Optional[str] = None,
+        timeout: Optional[float] = None,
+        auth: Optional[List[str]] = None
+    ) -> GitResult:
+        """执行git命令（异步，受全局git并发上限约束）"""
+        return await async_git_runner.run(args, git_dir=git_dir, timeout=timeout, auth=auth)
+
+    def _thread_lock(self, key: str) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = threading.Lock()
+                self._locks[key] = lock
+            return lock
+
+    def _read_lock_path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.read.lock")
+
+    @contextmanager
+    def _try_locked(self, key: str):
+        """
+        非阻塞地独占镜像，返回是否获取成功
+
+        同时获取写锁（fetch持有）和读锁文件的排他锁（读取镜像时以共享方式持有），
+        镜像正在fetch或被读取时立即返回False，不等待。
+        """
+        thread_lock = self._thread_lock(key)
+        if not thread_lock.acquire(blocking=False):
+            yield False
+            return
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, f"{key}.lock"), "w") as lock_file, \
+                    open(self._read_lock_path(key), "w") as read_lock_file:
+                locked = []
+                try:
+                    if fcntl:
+                        for f in (lock_file, read_lock_file):
+                            try:
+                                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                            except BlockingIOError:
+                                yield False
+                                return
+                            locked.append(f)
+                    yield True
+                finally:
+                    for f in locked:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            thread_lock.release()
+
+    @asynccontextmanager
+    async def reading(self, url: str, partial: bool = False):
+        """
+        读取镜像期间持有的共享锁
+
+        同步镜像和在镜像上执行git命令（diff、log等）都应在此上下文中进行：
+        多个读取方（跨进程）可同时持有，淘汰和删除镜像需要排他锁，因此不会删除正在读取的镜像。
+        共享锁以非阻塞方式轮询获取，只有淘汰/删除瞬间持有排他锁时才需要等待。
+        """
+        key = self._lock_key(url, partial)
+        os.makedirs(self.root, exist_ok=True)
+        read_lock_file = open(self._read_lock_path(key), "w")
+        try:
+            if fcntl:
+                while True:
+                    try:
+                        fcntl.flock(read_lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        await asyncio.sleep(0.1)
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(read_lock_file, fcntl.LOCK_UN)
+            read_lock_file.close()
+
+    def _async_lock(self, key: str) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if loop is not self._async_loop:
+            # asyncio原语绑定事件循环，循环切换后重新创建
+            self._async_locks = {}
+            self._async_loop = loop
+        lock = self._async_locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._async_locks[key] = lock
+        return lock
+
+    @asynccontextmanager
+    async def _alocked(self, url: str, partial: bool = False):
+        """
+        同一仓库的镜像读写互斥（异步，进程内asyncio锁 + 跨进程文件锁）
+
+        文件锁以非阻塞方式轮询获取，等待期间不占用事件循环和线程池；
+        flock按打开的文件描述符生效，因此与同进程内_try_locked持有的锁同样互斥。
+        """
+        key = self._lock_key(url, partial)
+        os.makedirs(self.root, exist_ok=True)
+        async with self._async_lock(key):
+            lock_file = open(os.path.join(self.root, f"{key}.lock"), "w")
+            try:
+                if fcntl:
+                    while True:
+                        try:
+                            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                            break
+                        except BlockingIOError:
+                            await asyncio.sleep(0.1)
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    @staticmethod
+    def _touch(path: str):
+        with open(path, "w") as f:
+            f.write(str(time.time()))
+
+    @staticmethod
+    def _read_float(path: str) -> float:
+        try:
+            with open(path, "r") as f:
+                return float(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0.0
+
+    def _init_mirror(self, path: str, url: str, partial: bool = False):
+        """
+        初始化裸仓库，只同步分支和标签（不拉取PR等额外引用）
+
+        partial为True时将origin配置为promisor远端（blob:none），
+        缺失的文件内容在需要时由git自动按需获取。
+        """
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+        commands = [
+            ["init", "--bare", tmp_path],
+            ["--git-dir", tmp_path, "remote", "add", "origin", url],
+            ["--git-dir", tmp_path, "config", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"],
+            ["--git-dir", tmp_path, "config", "--add", "remote.origin.fetch", "+refs/tags/*:refs/tags/*"],
+            ["--git-dir", tmp_path, "config", "gc.auto", "0"],
+        ]
+        if partial:
+            commands += [
+                ["--git-dir", tmp_path, "config", "core.repositoryformatversion", "1"],
+                ["--git-dir", tmp_path, "config", "extensions.partialClone", "origin"],
+                ["--git-dir", tmp_path, "config", "remote.origin.promisor", "true"],
+                ["--git-dir", tmp_path, "config", "remote.origin.partialclonefilter", "blob:none"],
+            ]
+
+        for args in commands:
+            result = self.run_git(args, timeout=30)
+            if result.returncode != 0:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise GitMirrorError(f"初始化镜像失败: {result.stderr.strip()}")
+
+        os.replace(tmp_path, path)
+
+    async def _fetch_async(self, path: str, auth: List[str], refspecs: Optional[List[str]] = None):
+        """增量fetch；指定refspecs时只获取对应对象（如不在分支上的提交）"""
+        if refspecs:
+            args = ["fetch", "--no-tags", "origin"] + refspecs
+        else:
+            args = ["fetch", "--prune", "origin"]
+        result = await self.run_git_async(args, git_dir=path, auth=auth)
+        if result.returncode != 0:
+            raise GitMirrorError(f"同步仓库失败: {result.stderr.strip()}")
+        self._touch(os.path.join(path, self.LAST_FETCH_FILE))
+
+    @staticmethod
+    def _fetched_ref(ref: str) -> str:
+        """部分克隆镜像中保存远端引用的本地引用名"""
+        return f"refs/fetched/{hashlib.sha1(ref.encode('utf-8')).hexdigest()[:16]}"
+
+    def _partial_fetch_args(self, refs: List[str]) -> List[str]:
+        """
+        构建部分克隆fetch参数
+
+        两点diff只比较两端的树，不需要历史和合并基，因此每个引用只获取深度为1的提交，
+        并且不获取任何文件内容。
+        """
+        return [
+            "fetch", "--no-tags", "--filter=blob:none", "--depth=1", "origin"
+        ] + [f"+{ref}:{self._fetched_ref(ref)}" for ref in refs]
+
+    def _partial_path(self, url: str) -> str:
+        if not url.startswith("https://"):
+            raise GitMirrorError("仅支持HTTPS协议的仓库URL")
+        return self.mirror_path(url, partial=True)
+
+    async def ensure_partial_refs_async(
+        self,
+        url: str,
+        refs: List[str],
+        username: Optional[str] = None,
+        token: Optional[str] = None
+    ) -> Tuple[str, Dict[str, str]]:
+        """
+        在部分克隆镜像中获取指定引用（浅层、无blob）
+
+        Args:
+            url: 仓库URL
+            refs: 引用列表（分支、标签或提交SHA）
+            username: 用户名
+            token: 访问令牌
+
+        Returns:
+            (镜像路径, 引用到提交SHA的映射)
+        """
+        path = self._partial_path(url)
+        auth = self.auth_args(username, token)
+        loop = asyncio.get_running_loop()
+
+        async with self._alocked(url, partial=True):
+            if not os.path.isdir(path):
+                await loop.run_in_executor(None, self._init_mirror, path, url, True)
+            result = await self.run_git_async(self._partial_fetch_args(refs), git_dir=path, auth=auth)
+            if result.returncode != 0:
+                raise GitMirrorError(f"同步仓库失败: {result.stderr.strip()}")
+            self._touch(os.path.join(path, self.LAST_FETCH_FILE))
+            self._touch(os.path.join(path, self.LAST_USED_FILE))
+            await loop.run_in_executor(None, self._record_size, path)
+
+            resolved = {}
+            for ref in refs:
+                resolved[ref] = await self.resolve_ref_async(path, self._fetched_ref(ref))
+
+        missing = [ref for ref, sha in resolved.items() if not sha]
+        if missing:
+            raise GitMirrorError(f"引用不存在: {', '.join(missing)}")
+        await loop.run_in_executor(None, self.evict, path)
+        return path, resolved
+
+    async def ensure_mirror_async(
+        self,
+        url: str,
+        username: Optional[str] = None,
+        token: Optional[str] = None,
+        force_fetch: bool = False
+    ) -> str:
+        """
+        确保镜像存在且足够新
+
+        首次使用时初始化并完整fetch；之后距上次fetch超过GIT_MIRROR_FETCH_TTL
+        或force_fetch时增量fetch，fetch期间不阻塞事件循环。
+
+        Args:
+            url: 仓库URL（不含凭据）
+            username: 用户名
+            token: 访问令牌
+            force_fetch: 是否强制fetch
+
+        Returns:
+            镜像路径
+        """
+        if not url.startswith("https://"):
+            raise GitMirrorError("仅支持HTTPS协议的仓库URL")
+
+        path = self.mirror_path(url)
+        auth = self.auth_args(username, token)
+        loop = asyncio.get_running_loop()
+
+        async with self._alocked(url):
+            fetched = False
+            if not os.path.isdir(path):
+                # 初始化只涉及本地小文件操作，放到线程池执行即可
+                await loop.run_in_executor(None, self._init_mirror, path, url)
+                await self._fetch_async(path, auth)
+                fetched = True
+            else:
+                last_fetch = self._read_float(os.path.join(path, self.LAST_FETCH_FILE))
+                if force_fetch or time.time() - last_fetch > settings.GIT_MIRROR_FETCH_TTL:
+                    await self._fetch_async(path, auth)
+                    fetched = True
+
+            self._touch(os.path.join(path, self.LAST_USED_FILE))
+            if fetched:
+                await loop.run_in_executor(None, self._record_size, path)
+
+        if fetched:
+            await loop.run_in_executor(None, self.evict, path)
+        return path
+
+    async def resolve_ref_async(self, path: str, ref: str) -> Optional[str]:
+        """解析引用为提交SHA，不存在返回None"""
+        result = await self.run_git_async(
+            ["rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"], git_dir=path, timeout=30
+        )
+        if result.returncode != 0:
+            return None
+        return result.stdout.strip()
+
+    async def _missing_refs_async(self, path: str, refs: List[str]) -> List[str]:
+        return [ref for ref in refs if not await self.resolve_ref_async(path, ref)]
+
+    async def ensure_refs_async(
+        self,
+        url: str,
+        refs: List[str],
+        username: Optional[str] = None,
+        token: Optional[str] = None,
+        force_fetch: bool = False
+    ) -> str:
+        """
+        确保镜像中包含指定引用
+
+        引用不存在时（如分支刚推送、或不在任何分支上的提交）强制fetch，
+        仍不存在时按提交SHA单独fetch。
+
+        Args:
+            url: 仓库URL
+            refs: 引用列表（分支、标签或提交SHA）
+            username: 用户名
+            token: 访问令牌
+            force_fetch: 是否先强制fetch，用于需要分支最新状态的场景
+
+        Returns:
+            镜像路径
+        """
+        path = await self.ensure_mirror_async(url, username, token, force_fetch=force_fetch)
+        missing = await self._missing_refs_async(path, refs)
+        if not missing:
+            return path
+
+        if not force_fetch:
+            path = await self.ensure_mirror_async(url, username, token, force_fetch=True)
+            missing = await self._missing_refs_async(path, missing)
+        if missing:
+            async with self._alocked(url):
+                try:
+                    await self._fetch_async(path, self.auth_args(username, token), refspecs=missing)
+                except GitMirrorError:
+                    pass
+            missing = await self._missing_refs_async(path, missing)
+            if missing:
+                raise GitMirrorError(f"引用不存在: {', '.join(missing)}")
+        return path
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, filename))
+                except OSError:
+                    pass
+        return total
+
+    def _record_size(self, path: str):
+        with open(os.path.join(path, self.SIZE_FILE), "w") as f:
+            f.write(str(self._dir_size(path)))
+
+    def evict(self, keep: Optional[str] = None):
+        """
+        按最近使用时间淘汰镜像，直到总大小不超过GIT_MIRROR_MAX_SIZE_MB
+
+        删除前以非阻塞方式获取该镜像的写锁和读锁，正在fetch或在reading()中被读取的镜像不会被删除。
+        """
+        if not os.path.isdir(self.root):
+            return
+
+        max_bytes = settings.GIT_MIRROR_MAX_SIZE_MB * 1024 * 1024
+        mirrors = []
+        total = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.endswith(".git") or not os.path.isdir(path):
+                continue
+            size = int(self._read_float(os.path.join(path, self.SIZE_FILE)))
+            last_used = self._read_float(os.path.join(path, self.LAST_USED_FILE))
+            mirrors.append((last_used, size, path))
+            total += size
+
+        if total <= max_bytes:
+            return
+
+        now = time.time()
+        grace_seconds = max(self.EVICT_GRACE_SECONDS, settings.GIT_TIMEOUT * 2)
+        for last_used, size, path in sorted(mirrors):
+            if total <= max_bytes:
+                break
+            if path == keep or now - last_used < grace_seconds:
+                continue
+            key = os.path.basename(path)[:-len(".git")]
+            with self._try_locked(key) as acquired:
+                # 正在被其他线程或进程使用的镜像跳过，下次淘汰时再处理
+                if not acquired:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def remove_mirror(self, url: str) -> bool:
+        """
+        删除仓库镜像（如仓库配置被删除），包括部分克隆镜像
+
+        不阻塞等待：镜像正在fetch或被读取时跳过，留给之后的按大小淘汰清理。
+
+        Returns:
+            是否全部删除
+        """
+        removed = True
+        for partial in (False, True):
+            with self._try_locked(self._lock_key(url, partial)) as acquired:
+                if not acquired:
+                    print(f"仓库镜像正在使用，暂不删除: {self.mirror_path(url, partial=partial)}")
+                    removed = False
+                    continue
+                shutil.rmtree(self.mirror_path(url, partial=partial), ignore_errors=True)
+        return removed
+
+
+# 创建全局镜像管理器实例
+git_mirror = GitMirrorManager()
@@ -0,0 +1,180 @@
+"""
+异步git命令执行
+基于asyncio子进程，支持超时、取消、全局并发上限和stdout流式读取
+"""
+import os
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional
+from app.core.config import settings
+
+
+class GitCommandError(Exception):
+    """git命令执行失败"""
+
+    def __init__(self, message: str, returncode: Optional[int] = None, stderr: str = ""):
+        super().__init__(message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class GitResult:
+    """git命令执行结果"""
+
+    def __init__(self, returncode: int, stdout: str, stderr: str):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class AsyncGitRunner:
+    """
+    异步git命令执行器
+
+    所有命令共享一个全局并发上限，避免大量并发fetch/diff占满CPU和磁盘IO。
+    超时或调用方取消时终止子进程，不遗留孤儿git进程。
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None):
+        self.max_concurrency = max_concurrency or settings.GIT_MAX_CONCURRENCY
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # asyncio原语绑定事件循环，循环切换后（如Celery任务中的asyncio.run）重新创建
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    @staticmethod
+    def _build_command(args: List[str], git_dir: Optional[str], auth: Optional[List[str]]) -> List[str]:
+        command = ["git"] + (auth or [])
+        if git_dir:
+            command += ["--git-dir", git_dir]
+        return command + args
+
+    @staticmethod
+    def _env() -> Dict[str, str]:
+        env = dict(os.environ)
+        env["GIT_TERMINAL_PROMPT"] = "0"
+        return env
+
+    @staticmethod
+    async def _terminate(process: asyncio.subprocess.Process):
+        """终止子进程并回收"""
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+    async def run(
+        self,
+        args: List[str],
+        git_dir: Optional[str] = None,
+        timeout: Optional[float] = None,
+        auth: Optional[List[str]] = None
+    ) -> GitResult:
+        """
+        执行git命令并收集输出（适用于输出较小的命令）
+
+        Args:
+            args: git子命令及参数
+            git_dir: 仓库目录
+            timeout: 超时时间（秒）
+            auth: 认证参数
+
+        Returns:
+            执行结果
+
+        Raises:
+            asyncio.TimeoutError: 超时（子进程已终止）
+        """
+        async with self._get_semaphore():
+            process = await asyncio.create_subprocess_exec(
+                *self._build_command(args, git_dir, auth),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=self._env()
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    process.communicate(),
+                    timeout=timeout or settings.GIT_TIMEOUT
+                )
+            except BaseException:
+                # 超时或取消（CancelledError）时终止git进程
+                await asyncio.shield(self._terminate(process))
+                raise
+
+        return GitResult(
+            returncode=process.returncode,
+            stdout=stdout.decode("utf-8", errors="replace"),
+            stderr=stderr.decode("utf-8", errors="replace")
+        )
+
+    async def stream(
+        self,
+        args: List[str],
+        git_dir: Optional[str] = None,
+        timeout: Optional[float] = None,
+        auth: Optional[List[str]] = None,
+        chunk_size: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        执行git命令并按块产出stdout（适用于diff等大输出命令）
+
+        调用方停止迭代或取消时子进程被终止；命令失败时在迭代结束后抛出GitCommandError。
+
+        Args:
+            args: git子命令及参数
+            git_dir: 仓库目录
+            timeout: 整体超时时间（秒）
+            auth: 认证参数
+            chunk_size: 每次读取的字节数
+
+        Yields:
+            stdout数据块
+        """
+        chunk_size = chunk_size or settings.GIT_STREAM_CHUNK_SIZE
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or settings.GIT_TIMEOUT)
+
+        async with self._get_semaphore():
+            process = await asyncio.create_subprocess_exec(
+                *self._build_command(args, git_dir, auth),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=self._env()
+            )
+            # 并发读取stderr，避免stderr管道写满导致git阻塞
+            stderr_task = asyncio.ensure_future(process.stderr.read())
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    chunk = await asyncio.wait_for(process.stdout.read(chunk_size), timeout=remaining)
+                    if not chunk:
+                        break
+                    yield chunk
+
+                returncode = await asyncio.wait_for(process.wait(), timeout=max(deadline - loop.time(), 1))
+                stderr = (await stderr_task).decode("utf-8", errors="replace")
+                if returncode != 0:
+                    raise GitCommandError(
+                        f"git {args[0] if args else ''} 执行失败: {stderr.strip()}",
+                        returncode=returncode,
+                        stderr=stderr
+                    )
+            finally:
+                if process.returncode is None:
+                    await asyncio.shield(self._terminate(process))
+                if not stderr_task.done():
+                    stderr_task.cancel()
+
+
+# 创建全局异步git执行器实例
+async_git_runner = AsyncGitRunner()
@@ -1,16 +1,58 @@
 """
 Git操作工具函数
 """
-import subprocess
-import tempfile
+import asyncio
 import os
 from typing import List, Optional, Tuple
 from app.schemas.git import BranchInfo, CommitInfo
+from app.core.config import settings
+from app.core.git_mirror import git_mirror, GitMirrorError
+from app.core.git_runner import async_git_runner, GitCommandError
+from app.core.diff_utils import DiffIndexBuilder, save_diff_index
 
 
-def test_git_connection(url: str, username: str, token: str) -> Tuple[bool, str]:
+def _parse_commit_log(output: str) -> List[CommitInfo]:
+    """解析 git log --pretty=format:%H|%an|%s|%ai 的输出"""
+    commits = []
+    for line in output.strip().split('\n'):
+        if line:
+            parts = line.split('|')
+            if len(parts) >= 4:
+                commits.append(CommitInfo(
+                    hash=parts[0],
+                    author=parts[1],
+                    # 提交信息中可能包含分隔符
+                    message='|'.join(parts[2:-1]),
+                    date=parts[-1]
+                ))
+    return commits
+
+
+DIFF_MODES = ("mirror", "partial")
+
+
+def _diff_args(base: str, head: str, path_filters: Optional[List[str]] = None) -> List[str]:
+    """构建git diff参数，路径过滤以pathspec形式放在--之后"""
+    return ["diff", base, head, "--"] + [path for path in (path_filters or []) if path]
+
+
+def _write_chunk(f, builder: DiffIndexBuilder, chunk: bytes):
+    """写入一块差异内容并更新索引"""
+    f.write(chunk)
+    builder.feed(chunk)
+
+
+def _remove_quietly(path: str):
+    """删除文件，不存在时忽略"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def test_git_connection_async(url: str, username: str, token: str) -> Tuple[bool, str]:
     """
-    测试Git连接
+    测试Git连接（异步）
     
     Args:
         url: 仓库URL
@@ -21,17 +63,12 @@ def test_git_connection(url: str, username: str, token: str) -> Tuple[bool, str]
         (是否成功, 消息)
     """
     try:
-        # 构建带认证的URL
-        if url.startswith("https://"):
-            auth_url = url.replace("https://", f"https://{username}:{token}@")
-        else:
+        if not url.startswith("https://"):
             return False, "仅支持HTTPS协议的仓库URL"
-        
-        # 执行git ls-remote命令测试连接
-        result = subprocess.run(
-            ["git", "ls-remote", auth_url],
-            capture_output=True,
-            text=True,
+            
+        result = await git_mirror.run_git_async(
+            ["ls-remote", "--heads", url],
+            auth=git_mirror.auth_args(username, token),
             timeout=30
         )
         
@@ -40,7 +77,7 @@ def test_git_connection(url: str, username: str, token: str) -> Tuple[bool, str]
         else:
             return False, f"连接失败: {result.stderr}"
             
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         return False, "连接超时"
     except FileNotFoundError:
         return False, "Git命令未找到，请确保已安装Git"
@@ -48,9 +85,9 @@ def test_git_connection(url: str, username: str, token: str) -> Tuple[bool, str]
         return False, f"连接测试失败: {str(e)}"
 
 
-def get_remote_branches(url: str, username: str, token: str) -> List[str]:
+async def get_remote_branches_async(url: str, username: str, token: str) -> List[str]:
     """
-    获取远程分支列表
+    获取远程分支列表（异步）
     
     Args:
         url: 仓库URL
@@ -61,30 +98,16 @@ def get_remote_branches(url: str, username: str, token: str) -> List[str]:
         分支名称列表
     """
     try:
-        # 构建带认证的URL
-        if url.startswith("https://"):
-            auth_url = url.replace("https://", f"https://{username}:{token}@")
-        else:
-            return []
-        
-        # 执行git ls-remote命令获取分支
-        result = subprocess.run(
-            ["git", "ls-remote", "--heads", auth_url],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
+        async with git_mirror.reading(url):
+            mirror_path = await git_mirror.ensure_mirror_async(url, username, token)
+            result = await git_mirror.run_git_async(
+                ["for-each-ref", "--format=%(refname:short)", "refs/heads/"],
+                git_dir=mirror_path,
+                timeout=30
+            )
         
         if result.returncode == 0:
-            branches = []
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    # 格式: commit_hash refs/heads/branch_name
-                    parts = line.split('\t')
-                    if len(parts) == 2 and parts[1].startswith('refs/heads/'):
-                        branch_name = parts[1].replace('refs/heads/', '')
-                        branches.append(branch_name)
-            return branches
+            return [line for line in result.stdout.strip().split('\n') if line]
         else:
             return []
             
@@ -92,11 +115,11 @@ def get_remote_branches(url: str, username: str, token: str) -> List[str]:
         return []
 
 
-def get_recent_commits(
+async def get_recent_commits_async(
     url: str, username: str, token: str, branch: str = "main", limit: int = 10
 ) -> List[CommitInfo]:
     """
-    获取最近的提交记录
+    获取最近的提交记录（异步）
     
     Args:
         url: 仓库URL
@@ -109,66 +132,39 @@ def get_recent_commits(
         提交信息列表
     """
     try:
-        # 构建带认证的URL
-        if url.startswith("https://"):
-            auth_url = url.replace("https://", f"https://{username}:{token}@")
-        else:
-            return []
-        
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # 克隆仓库（仅获取指定分支的最近提交）
-            clone_result = subprocess.run(
+        async with git_mirror.reading(url):
+            mirror_path = await git_mirror.ensure_refs_async(url, [branch], username, token)
+            log_result = await git_mirror.run_git_async(
                 [
-                    "git", "clone", "--depth", str(limit), 
-                    "--branch", branch, auth_url, temp_dir
+                    "log", f"--max-count={limit}",
+                    "--pretty=format:%H|%an|%s|%ai",
+                    branch, "--"
                 ],
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
-            
-            if clone_result.returncode != 0:
-                return []
-            
-            # 获取提交历史
-            log_result = subprocess.run(
-                [
-                    "git", "log", f"--max-count={limit}",
-                    "--pretty=format:%H|%an|%s|%ai"
-                ],
-                cwd=temp_dir,
-                capture_output=True,
-                text=True,
+                git_dir=mirror_path,
                 timeout=30
             )
+        
+        if log_result.returncode == 0:
+            return _parse_commit_log(log_result.stdout)
+        else:
+            return []
             
-            if log_result.returncode == 0:
-                commits = []
-                for line in log_result.stdout.strip().split('\n'):
-                    if line:
-                        parts = line.split('|')
-                        if len(parts) == 4:
-                            commits.append(CommitInfo(
-                                hash=parts[0],
-                                author=parts[1],
-                                message=parts[2],
-                                date=parts[3]
-                            ))
-                return commits
-            else:
-                return []
-                
     except Exception:
         return []
 
 
-def generate_diff(
-    url: str, username: str, token: str, 
-    base_ref: str, head_ref: str, output_path: str
-) -> Tuple[bool, str]:
+async def generate_diff_async(
+    url: str, username: str, token: str,
+    base_ref: str, head_ref: str, output_path: str,
+    path_filters: Optional[List[str]] = None,
+    mode: Optional[str] = None
+) -> Tuple[bool, str, Optional[dict]]:
     """
-    生成代码差异文件
+    生成代码差异文件（异步）
+    
+    git diff的stdout按固定大小的块直接写入文件，同时流式统计增删行数并构建
+    逐文件索引，峰值内存与差异大小无关。写文件、解析和保存索引在线程池中执行，
+    大差异不会阻塞事件循环。
     
     Args:
         url: 仓库URL
@@ -177,50 +173,61 @@ def generate_diff(
         base_ref: 基准引用（分支或提交）
         head_ref: 目标引用（分支或提交）
         output_path: 输出文件路径
+        path_filters: 只比较这些路径（git pathspec）
+        mode: 差异模式，mirror为完整镜像，partial为浅层部分克隆，默认GIT_DIFF_MODE
         
     Returns:
-        (是否成功, 消息)
+        (是否成功, 消息, 差异统计)
     """
     try:
-        # 构建带认证的URL
-        if url.startswith("https://"):
-            auth_url = url.replace("https://", f"https://{username}:{token}@")
-        else:
-            return False, "仅支持HTTPS协议的仓库URL"
-        
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # 克隆仓库
-            clone_result = subprocess.run(
-                ["git", "clone", auth_url, temp_dir],
-                capture_output=True,
-                text=True,
-                timeout=120
-            )
+        if not url.startswith("https://"):
+            return False, "仅支持HTTPS协议的仓库URL", None
             
-            if clone_result.returncode != 0:
-                return False, f"克隆仓库失败: {clone_result.stderr}"
+        mode = mode or settings.GIT_DIFF_MODE
+        if mode not in DIFF_MODES:
+            return False, f"不支持的差异模式: {mode}", None
             
-            # 生成diff
-            diff_result = subprocess.run(
-                ["git", "diff", base_ref, head_ref],
-                cwd=temp_dir,
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
+        # 同步镜像到差异输出完成期间持有读锁，镜像不会被淘汰
+        async with git_mirror.reading(url, partial=mode == "partial"):
+            try:
+                if mode == "partial":
+                    mirror_path, shas = await git_mirror.ensure_partial_refs_async(
+                        url, [base_ref, head_ref], username, token
+                    )
+                    diff_args = _diff_args(shas[base_ref], shas[head_ref], path_filters)
+                    diff_auth = git_mirror.auth_args(username, token)
+                else:
+                    mirror_path = await git_mirror.ensure_refs_async(
+                        url, [base_ref, head_ref], username, token, force_fetch=True
+                    )
+                    diff_args = _diff_args(base_ref, head_ref, path_filters)
+                    diff_auth = None
+            except GitMirrorError as e:
+                return False, f"同步仓库失败: {str(e)}", None
             
-            if diff_result.returncode == 0:
-                # 确保输出目录存在
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                
-                # 写入diff文件
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    f.write(diff_result.stdout)
-                
-                return True, f"差异文件已生成: {output_path}"
-            else:
-                return False, f"生成差异失败: {diff_result.stderr}"
-                
+            # 确保输出目录存在
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        
+            # 先写临时文件，完成后再替换，失败时不留下半截差异文件
+            builder = DiffIndexBuilder()
+            tmp_path = f"{output_path}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    async for chunk in async_git_runner.stream(diff_args, git_dir=mirror_path, auth=diff_auth):
+                        await asyncio.to_thread(_write_chunk, f, builder, chunk)
+                index = await asyncio.to_thread(builder.index)
+                os.replace(tmp_path, output_path)
+            except asyncio.TimeoutError:
+                _remove_quietly(tmp_path)
+                return False, "生成差异超时", None
+            except GitCommandError as e:
+                _remove_quietly(tmp_path)
+                return False, f"生成差异失败: {e.stderr or str(e)}", None
+            
+        # 逐文件索引写入差异文件旁，便于按文件定位而无需重新解析
+        stats = builder.stats()
+        stats["index_path"] = await asyncio.to_thread(save_diff_index, index, output_path)
+        return True, f"差异文件已生成: {output_path}", stats
+        
     except Exception as e:
-        return False, f"生成差异失败: {str(e)}"
+        return False, f"生成差异失败: {str(e)}", None
@@ -0,0 +1,229 @@
+"""
+LLM响应缓存
+内存LRU + SQLite持久化的两级缓存，按请求内容哈希寻址
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List
+
+
+class LLMResponseCache:
+    """LLM响应缓存"""
+
+    # 每写入多少次执行一次磁盘淘汰
+    EVICT_INTERVAL = 100
+
+    def __init__(
+        self,
+        db_path: str,
+        ttl: int = 86400,
+        max_memory_entries: int = 1024,
+        max_disk_bytes: int = 512 * 1024 * 1024
+    ):
+        """
+        初始化缓存
+
+        Args:
+            db_path: SQLite缓存文件路径
+            ttl: 过期时间（秒）
+            max_memory_entries: 内存LRU最大条目数
+            max_disk_bytes: 磁盘缓存最大字节数
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+
+        # key -> (过期时间戳, 响应数据)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+
+        # 命中统计
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: Optional[int],
+        extra_params: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        计算缓存键
+
+        Args:
+            model: 模型标识（包含base_url，避免不同提供商同名模型冲突）
+            messages: 消息列表
+            temperature: 温度参数
+            max_tokens: 最大token数
+            extra_params: 其他影响输出的请求参数
+
+        Returns:
+            SHA256哈希值
+        """
+        payload = json.dumps(
+            {
+                "model": model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "extra": extra_params or {}
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _get_conn(self) -> sqlite3.Connection:
+        """懒加载SQLite连接"""
+        if self._conn is None:
+            cache_dir = os.path.dirname(self.db_path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5.0)
+            # WAL模式支持API进程与Celery进程并发读写
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: str, expires_at: float, payload: Dict[str, Any]):
+        """写入内存LRU（调用方持有锁）"""
+        self._memory[key] = (expires_at, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            响应数据，未命中或已过期返回None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[1]
+                del self._memory[key]
+
+            try:
+                conn = self._get_conn()
+                row = conn.execute(
+                    "SELECT payload, expires_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                    conn.commit()
+                    payload = json.loads(row[0])
+                    self._remember(key, row[1], payload)
+                    self.disk_hits += 1
+                    return payload
+            except Exception as e:
+                print(f"读取LLM缓存失败: {e}")
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, payload: Dict[str, Any]):
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            payload: 响应数据
+        """
+        now = time.time()
+        expires_at = now + self.ttl
+        data = json.dumps(payload, ensure_ascii=False)
+
+        with self._lock:
+            self._remember(key, expires_at, payload)
+            try:
+                conn = self._get_conn()
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, payload, size, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, data, len(data.encode('utf-8')), expires_at, now)
+                )
+                conn.commit()
+
+                self._writes += 1
+                if self._writes % self.EVICT_INTERVAL == 0:
+                    self._evict_disk(conn, now)
+            except Exception as e:
+                print(f"写入LLM缓存失败: {e}")
+
+    def _evict_disk(self, conn: sqlite3.Connection, now: float):
+        """删除过期条目，并按最近访问时间淘汰超出容量的条目"""
+        conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+
+        total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total_size > self.max_disk_bytes:
+            # 淘汰到容量的90%，避免每次写入都触发淘汰
+            target = int(self.max_disk_bytes * 0.9)
+            rows = conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access ASC").fetchall()
+            evict_keys = []
+            for key, size in rows:
+                if total_size <= target:
+                    break
+                evict_keys.append((key,))
+                total_size -= size
+            conn.executemany("DELETE FROM llm_cache WHERE key = ?", evict_keys)
+
+        conn.commit()
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._memory.clear()
+            try:
+                conn = self._get_conn()
+                conn.execute("DELETE FROM llm_cache")
+                conn.commit()
+            except Exception as e:
+                print(f"清空LLM缓存失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取命中统计"""
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "memory_entries": len(self._memory)
+        }
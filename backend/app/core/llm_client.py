@@ -3,10 +3,24 @@ LLM客户端封装，支持多种LLM API
 """
 import json
 import time
-from typing import Dict, Any, Optional, List
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, List, AsyncIterator, Tuple, Set
 from abc import ABC, abstractmethod
 import httpx
 from app.core.config import settings
+from app.core.llm_cache import LLMResponseCache
+from app.core.tokenizer import count_tokens, count_message_tokens
+from app.core.llm_limiter import (
+    llm_limiters, ProviderLimiter, backoff_delay, parse_retry_after, estimate_request_tokens,
+    RETRYABLE_STATUS_CODES, THROTTLE_STATUS_CODES
+)
+
+try:
+    import h2  # noqa: F401  httpx的HTTP/2支持依赖h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 
 class LLMResponse:
@@ -19,7 +33,8 @@ class LLMResponse:
         tokens_used: int = 0,
         processing_time: float = 0.0,
         success: bool = True,
-        error_message: str = None
+        error_message: str = None,
+        cached: bool = False
     ):
         self.content = content
         self.model = model
@@ -27,6 +42,8 @@ class LLMResponse:
         self.processing_time = processing_time
         self.success = success
         self.error_message = error_message
+        # 是否命中响应缓存
+        self.cached = cached
     
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典"""
@@ -36,17 +53,231 @@ class LLMResponse:
             "tokens_used": self.tokens_used,
             "processing_time": self.processing_time,
             "success": self.success,
-            "error_message": self.error_message
+            "error_message": self.error_message,
+            "cached": self.cached
         }
 
 
+class LLMStreamChunk:
+    """LLM流式响应片段"""
+    
+    def __init__(self, delta: str = "", done: bool = False, response: LLMResponse = None):
+        self.delta = delta
+        self.done = done
+        # 流结束时携带汇总后的完整响应
+        self.response = response
+
+
+class HTTPClientPool:
+    """
+    按base_url复用的HTTP连接池
+    
+    每个base_url对应一个长连接的httpx.AsyncClient（keep-alive + HTTP/2），
+    避免每次LLM调用都重新进行TCP/TLS握手。
+    """
+    
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 正在后台关闭的旧客户端任务（保持引用，避免任务被回收）
+        self._closing: Set[asyncio.Task] = set()
+    
+    def get(self, base_url: str) -> httpx.AsyncClient:
+        """
+        获取base_url对应的HTTP客户端
+        
+        Args:
+            base_url: API基础URL
+            
+        Returns:
+            复用的httpx.AsyncClient
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # httpx连接绑定事件循环，循环切换后（如Celery任务中的asyncio.run）需要重建连接池
+            self._release_clients(loop)
+            self._loop = loop
+        
+        key = base_url.rstrip("/")
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=settings.LLM_HTTP2 and HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=settings.LLM_POOL_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(settings.LLM_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT)
+            )
+            self._clients[key] = client
+        return client
+    
+    def _release_clients(self, loop: asyncio.AbstractEventLoop):
+        """
+        释放旧事件循环上创建的客户端
+        
+        旧循环仍在运行（其他线程）时在旧循环上关闭；旧循环已结束时在当前循环上尽力关闭，
+        关闭失败的连接随客户端对象回收时由asyncio传输层关闭套接字。
+        """
+        clients = list(self._clients.values())
+        self._clients = {}
+        if not clients:
+            return
+        
+        old_loop = self._loop
+        if old_loop is not None and old_loop.is_running() and not old_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self._close_clients(clients, quiet=True), old_loop)
+        else:
+            task = loop.create_task(self._close_clients(clients, quiet=True))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+    
+    @staticmethod
+    async def _close_clients(clients: List[httpx.AsyncClient], quiet: bool = False):
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                # 旧循环已关闭时连接无法正常关闭，属预期情况
+                if not quiet:
+                    print(f"关闭HTTP连接失败: {e}")
+    
+    async def aclose(self):
+        """关闭所有连接"""
+        clients = list(self._clients.values())
+        self._clients = {}
+        await self._close_clients(clients)
+
+
 class BaseLLMClient(ABC):
     """LLM客户端基类"""
     
-    def __init__(self, api_key: str, base_url: str, model: str):
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str,
+        model: str,
+        http_pool: HTTPClientPool = None,
+        timeout: Optional[float] = None,
+        default_params: Optional[Dict[str, Any]] = None
+    ):
         self.api_key = api_key
         self.base_url = base_url
         self.model = model
+        self.http_pool = http_pool or HTTPClientPool()
+        self.timeout = timeout
+        # 模型级默认请求参数（如top_p），调用时传入的参数优先
+        self.default_params = default_params or {}
+    
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """获取当前base_url的复用HTTP客户端"""
+        return self.http_pool.get(self.base_url)
+    
+    def _request_timeout(self, default: float) -> httpx.Timeout:
+        """单次请求超时：读写使用模型配置的超时（未配置时使用default），连接超时保持全局配置"""
+        return httpx.Timeout(self.timeout or default, connect=settings.LLM_CONNECT_TIMEOUT)
+    
+    def _get_limiter(self) -> ProviderLimiter:
+        """获取当前提供商的限流器"""
+        return llm_limiters.get(self.base_url)
+    
+    def _retry_delay(self, attempt: int, response: httpx.Response = None) -> Optional[float]:
+        """
+        计算重试等待时间
+        
+        Args:
+            attempt: 已重试次数
+            response: 失败的响应，为None表示网络错误
+            
+        Returns:
+            等待秒数，不可重试时返回None
+        """
+        if attempt >= settings.LLM_MAX_RETRIES:
+            return None
+        
+        retry_after = None
+        if response is not None:
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                return None
+            if response.status_code in THROTTLE_STATUS_CODES:
+                self._get_limiter().on_throttle()
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        
+        return backoff_delay(attempt, retry_after=retry_after)
+    
+    async def _post(self, url: str, estimated_tokens: int = 0, **request_kwargs) -> httpx.Response:
+        """
+        在提供商限流下发送POST请求，429/5xx及网络错误按退避策略重试
+        
+        Args:
+            url: 请求地址
+            estimated_tokens: 预估token数，用于TPM限流
+            
+        Returns:
+            成功的响应
+        """
+        limiter = self._get_limiter()
+        client = self._get_http_client()
+        attempt = 0
+        
+        while True:
+            start_time = time.time()
+            async with limiter.slot(estimated_tokens):
+                try:
+                    response = await client.post(url, **request_kwargs)
+                except httpx.TransportError:
+                    delay = self._retry_delay(attempt)
+                    if delay is None:
+                        raise
+                else:
+                    delay = None
+                    if response.status_code in RETRYABLE_STATUS_CODES:
+                        delay = self._retry_delay(attempt, response)
+                    if delay is None:
+                        response.raise_for_status()
+                        limiter.on_success(time.time() - start_time)
+                        return response
+            
+            await asyncio.sleep(delay)
+            attempt += 1
+    
+    @asynccontextmanager
+    async def _stream(self, url: str, estimated_tokens: int = 0, **request_kwargs):
+        """
+        在提供商限流下发起流式POST请求
+        
+        仅在开始读取响应前重试，已产出内容后的错误直接抛出。
+        """
+        limiter = self._get_limiter()
+        client = self._get_http_client()
+        attempt = 0
+        started = False
+        
+        while True:
+            delay = None
+            start_time = time.time()
+            async with limiter.slot(estimated_tokens):
+                try:
+                    async with client.stream("POST", url, **request_kwargs) as response:
+                        if response.status_code in RETRYABLE_STATUS_CODES:
+                            delay = self._retry_delay(attempt, response)
+                        if delay is None:
+                            response.raise_for_status()
+                            # 流式请求以首包延迟作为并发调节依据
+                            limiter.on_success(time.time() - start_time)
+                            started = True
+                            yield response
+                            return
+                except httpx.TransportError:
+                    if started:
+                        raise
+                    delay = self._retry_delay(attempt)
+                    if delay is None:
+                        raise
+            
+            await asyncio.sleep(delay)
+            attempt += 1
     
     @abstractmethod
     async def chat_completion(
@@ -65,13 +296,37 @@ class BaseLLMClient(ABC):
     ) -> LLMResponse:
         """文本完成接口"""
         pass
+    
+    async def stream_chat_completion(
+        self, 
+        messages: List[Dict[str, str]], 
+        **kwargs
+    ) -> AsyncIterator[LLMStreamChunk]:
+        """
+        流式聊天完成接口
+        
+        逐段产出增量内容，最后产出一个done=True的片段携带完整响应。
+        默认实现退化为一次性返回，子类可覆盖为真正的流式实现。
+        """
+        response = await self.chat_completion(messages, **kwargs)
+        if response.success and response.content:
+            yield LLMStreamChunk(delta=response.content)
+        yield LLMStreamChunk(done=True, response=response)
 
 
 class OpenAIClient(BaseLLMClient):
     """OpenAI API客户端"""
     
-    def __init__(self, api_key: str, base_url: str = "https://api.openai.com/v1", model: str = "gpt-3.5-turbo"):
-        super().__init__(api_key, base_url, model)
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = "https://api.openai.com/v1",
+        model: str = "gpt-3.5-turbo",
+        http_pool: HTTPClientPool = None,
+        timeout: Optional[float] = None,
+        default_params: Optional[Dict[str, Any]] = None
+    ):
+        super().__init__(api_key, base_url, model, http_pool, timeout, default_params)
     
     async def chat_completion(
         self, 
@@ -93,31 +348,38 @@ class OpenAIClient(BaseLLMClient):
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
+            **self.default_params,
             **kwargs
         }
         
+        estimated_tokens = estimate_request_tokens(messages, max_tokens, self.model)
+        
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=data
-                )
-                response.raise_for_status()
-                
-                result = response.json()
-                processing_time = time.time() - start_time
-                
-                content = result["choices"][0]["message"]["content"]
-                tokens_used = result.get("usage", {}).get("total_tokens", 0)
-                
-                return LLMResponse(
-                    content=content,
-                    model=self.model,
-                    tokens_used=tokens_used,
-                    processing_time=processing_time,
-                    success=True
-                )
+            response = await self._post(
+                f"{self.base_url}/chat/completions",
+                estimated_tokens=estimated_tokens,
+                headers=headers,
+                json=data,
+                timeout=self._request_timeout(settings.LLM_TIMEOUT)
+            )
+            
+            result = response.json()
+            processing_time = time.time() - start_time
+            
+            content = result["choices"][0]["message"]["content"]
+            tokens_used = (result.get("usage") or {}).get("total_tokens") or (
+                # 部分OpenAI兼容接口不返回usage，按本地分词结果计数
+                count_message_tokens(messages, self.model) + count_tokens(content, self.model)
+            )
+            self._get_limiter().record_tokens(estimated_tokens, tokens_used)
+            
+            return LLMResponse(
+                content=content,
+                model=self.model,
+                tokens_used=tokens_used,
+                processing_time=processing_time,
+                success=True
+            )
         
         except Exception as e:
             processing_time = time.time() - start_time
@@ -140,13 +402,100 @@ class OpenAIClient(BaseLLMClient):
         """OpenAI文本完成（通过聊天接口实现）"""
         messages = [{"role": "user", "content": prompt}]
         return await self.chat_completion(messages, temperature, max_tokens, **kwargs)
+    
+    async def stream_chat_completion(
+        self, 
+        messages: List[Dict[str, str]], 
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        **kwargs
+    ) -> AsyncIterator[LLMStreamChunk]:
+        """OpenAI流式聊天完成（SSE，stream=true）"""
+        start_time = time.time()
+        
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        data = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+            **self.default_params,
+            **kwargs
+        }
+        
+        content_parts = []
+        tokens_used = 0
+        estimated_tokens = estimate_request_tokens(messages, max_tokens, self.model)
+        
+        try:
+            async with self._stream(
+                f"{self.base_url}/chat/completions",
+                estimated_tokens=estimated_tokens,
+                headers=headers,
+                json=data,
+                timeout=self._request_timeout(settings.LLM_TIMEOUT)
+            ) as response:
+                async for line in response.aiter_lines():
+                    # SSE格式: "data: {...}"，以"data: [DONE]"结束
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == "[DONE]":
+                        break
+                    if not payload:
+                        continue
+                    
+                    event = json.loads(payload)
+                    if event.get("usage"):
+                        tokens_used = event["usage"].get("total_tokens", tokens_used)
+                    
+                    for choice in event.get("choices") or []:
+                        delta = (choice.get("delta") or {}).get("content")
+                        if delta:
+                            content_parts.append(delta)
+                            yield LLMStreamChunk(delta=delta)
+            
+            if not tokens_used:
+                tokens_used = count_message_tokens(messages, self.model) + count_tokens("".join(content_parts), self.model)
+            self._get_limiter().record_tokens(estimated_tokens, tokens_used)
+            yield LLMStreamChunk(done=True, response=LLMResponse(
+                content="".join(content_parts),
+                model=self.model,
+                tokens_used=tokens_used,
+                processing_time=time.time() - start_time,
+                success=True
+            ))
+        
+        except Exception as e:
+            yield LLMStreamChunk(done=True, response=LLMResponse(
+                content="".join(content_parts),
+                model=self.model,
+                tokens_used=tokens_used,
+                processing_time=time.time() - start_time,
+                success=False,
+                error_message=str(e)
+            ))
 
 
 class LocalLLMClient(BaseLLMClient):
     """本地LLM客户端（如Ollama）"""
     
-    def __init__(self, api_key: str = "", base_url: str = "http://localhost:11434", model: str = "llama2"):
-        super().__init__(api_key, base_url, model)
+    def __init__(
+        self,
+        api_key: str = "",
+        base_url: str = "http://localhost:11434",
+        model: str = "llama2",
+        http_pool: HTTPClientPool = None,
+        timeout: Optional[float] = None,
+        default_params: Optional[Dict[str, Any]] = None
+    ):
+        super().__init__(api_key, base_url, model, http_pool, timeout, default_params)
     
     async def chat_completion(
         self, 
@@ -166,30 +515,39 @@ class LocalLLMClient(BaseLLMClient):
             "stream": False,
             "options": {
                 "temperature": temperature,
+                **self.default_params,
                 **kwargs
             }
         }
         
+        # Ollama通过options.num_predict限制输出长度，未设置时只按输入估算
+        estimated_tokens = estimate_request_tokens(messages, data["options"].get("num_predict"), self.model)
+        
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/api/generate",
-                    json=data
-                )
-                response.raise_for_status()
-                
-                result = response.json()
-                processing_time = time.time() - start_time
-                
-                content = result.get("response", "")
-                
-                return LLMResponse(
-                    content=content,
-                    model=self.model,
-                    tokens_used=0,  # 本地模型通常不返回token数
-                    processing_time=processing_time,
-                    success=True
-                )
+            response = await self._post(
+                f"{self.base_url}/api/generate",
+                estimated_tokens=estimated_tokens,
+                json=data,
+                timeout=self._request_timeout(120.0)
+            )
+            
+            result = response.json()
+            processing_time = time.time() - start_time
+            
+            content = result.get("response", "")
+            # Ollama返回prompt_eval_count/eval_count，缺失时按本地分词结果计数
+            tokens_used = (result.get("prompt_eval_count") or count_tokens(prompt, self.model)) + (
+                result.get("eval_count") or count_tokens(content, self.model)
+            )
+            self._get_limiter().record_tokens(estimated_tokens, tokens_used)
+            
+            return LLMResponse(
+                content=content,
+                model=self.model,
+                tokens_used=tokens_used,
+                processing_time=processing_time,
+                success=True
+            )
         
         except Exception as e:
             processing_time = time.time() - start_time
@@ -211,6 +569,80 @@ class LocalLLMClient(BaseLLMClient):
         """本地LLM文本完成"""
         messages = [{"role": "user", "content": prompt}]
         return await self.chat_completion(messages, temperature, **kwargs)
+    
+    async def stream_chat_completion(
+        self, 
+        messages: List[Dict[str, str]], 
+        temperature: float = 0.7,
+        **kwargs
+    ) -> AsyncIterator[LLMStreamChunk]:
+        """本地LLM流式聊天完成（Ollama NDJSON）"""
+        start_time = time.time()
+        
+        # 将消息转换为单个prompt
+        prompt = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
+        
+        data = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": True,
+            "options": {
+                "temperature": temperature,
+                **self.default_params,
+                **kwargs
+            }
+        }
+        
+        content_parts = []
+        tokens_used = 0
+        estimated_tokens = estimate_request_tokens(messages, data["options"].get("num_predict"), self.model)
+        
+        try:
+            async with self._stream(
+                f"{self.base_url}/api/generate",
+                estimated_tokens=estimated_tokens,
+                json=data,
+                timeout=self._request_timeout(120.0)
+            ) as response:
+                # 每行一个JSON对象，最后一行done=true并携带统计信息
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    
+                    delta = event.get("response")
+                    if delta:
+                        content_parts.append(delta)
+                        yield LLMStreamChunk(delta=delta)
+                    
+                    if event.get("done"):
+                        tokens_used = (event.get("prompt_eval_count") or count_tokens(prompt, self.model)) + (
+                            event.get("eval_count") or count_tokens("".join(content_parts), self.model)
+                        )
+                        break
+            
+            self._get_limiter().record_tokens(estimated_tokens, tokens_used)
+            yield LLMStreamChunk(done=True, response=LLMResponse(
+                content="".join(content_parts),
+                model=self.model,
+                tokens_used=tokens_used,
+                processing_time=time.time() - start_time,
+                success=True
+            ))
+        
+        except Exception as e:
+            yield LLMStreamChunk(done=True, response=LLMResponse(
+                content="".join(content_parts),
+                model=self.model,
+                tokens_used=tokens_used,
+                processing_time=time.time() - start_time,
+                success=False,
+                error_message=str(e)
+            ))
+
+
+# 使用Ollama接口的本地模型提供商，其余提供商按OpenAI兼容接口处理
+LOCAL_PROVIDERS = {"local", "ollama"}
 
 
 class LLMClientManager:
@@ -219,6 +651,17 @@ class LLMClientManager:
     def __init__(self):
         self._clients = {}
         self._default_client = None
+        self.http_pool = HTTPClientPool()
+        # AIModelConfig.id -> (配置指纹, 客户端)
+        self._model_clients: Dict[int, Tuple[tuple, BaseLLMClient]] = {}
+        self.response_cache: Optional[LLMResponseCache] = None
+        if settings.LLM_CACHE_ENABLED:
+            self.response_cache = LLMResponseCache(
+                db_path=settings.LLM_CACHE_PATH,
+                ttl=settings.LLM_CACHE_TTL,
+                max_memory_entries=settings.LLM_CACHE_MAX_MEMORY_ENTRIES,
+                max_disk_bytes=settings.LLM_CACHE_MAX_DISK_MB * 1024 * 1024
+            )
         self._initialize_clients()
     
     def _initialize_clients(self):
@@ -228,14 +671,15 @@ class LLMClientManager:
             openai_client = OpenAIClient(
                 api_key=settings.LLM_API_KEY,
                 base_url=settings.LLM_BASE_URL,
-                model=settings.LLM_MODEL
+                model=settings.LLM_MODEL,
+                http_pool=self.http_pool
             )
             self._clients["openai"] = openai_client
             if not self._default_client:
                 self._default_client = openai_client
         
         # 本地LLM客户端
-        local_client = LocalLLMClient()
+        local_client = LocalLLMClient(http_pool=self.http_pool)
         self._clients["local"] = local_client
         if not self._default_client:
             self._default_client = local_client
@@ -246,14 +690,94 @@ class LLMClientManager:
             return self._clients[client_type]
         return self._default_client
     
+    @staticmethod
+    def _model_fingerprint(model_config) -> tuple:
+        """模型配置中影响客户端构建的字段"""
+        return (
+            model_config.provider,
+            model_config.base_url,
+            model_config.api_key,
+            model_config.model,
+            model_config.timeout,
+            model_config.top_p,
+            model_config.frequency_penalty,
+            model_config.presence_penalty
+        )
+    
+    def _build_model_client(self, model_config) -> BaseLLMClient:
+        """根据AIModelConfig构建客户端"""
+        default_params = {
+            key: value for key, value in {
+                "top_p": model_config.top_p,
+                "frequency_penalty": model_config.frequency_penalty,
+                "presence_penalty": model_config.presence_penalty
+            }.items() if value is not None
+        }
+        
+        client_class = LocalLLMClient if (model_config.provider or "").lower() in LOCAL_PROVIDERS else OpenAIClient
+        return client_class(
+            api_key=model_config.api_key or "",
+            base_url=model_config.base_url,
+            model=model_config.model,
+            http_pool=self.http_pool,
+            timeout=model_config.timeout,
+            default_params=default_params
+        )
+    
+    def get_model_client(self, model_config) -> BaseLLMClient:
+        """
+        获取AIModelConfig对应的客户端
+        
+        按模型ID懒加载并缓存，同一base_url的客户端共享连接池。
+        配置指纹变化时（如其他进程更新了模型配置）自动重建。
+        
+        Args:
+            model_config: AIModelConfig对象
+            
+        Returns:
+            LLM客户端
+        """
+        fingerprint = self._model_fingerprint(model_config)
+        cached = self._model_clients.get(model_config.id)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+        
+        client = self._build_model_client(model_config)
+        self._model_clients[model_config.id] = (fingerprint, client)
+        return client
+    
+    def invalidate_model_client(self, model_id: int):
+        """模型配置更新或删除后移除缓存的客户端"""
+        self._model_clients.pop(model_id, None)
+    
+    def _resolve_client(self, client_type: str = None, model_config=None) -> Optional[BaseLLMClient]:
+        """优先使用模型配置对应的客户端，否则按类型获取"""
+        if model_config is not None:
+            return self.get_model_client(model_config)
+        return self.get_client(client_type)
+    
+    async def aclose(self):
+        """关闭所有HTTP连接（应用关闭时调用）"""
+        await self.http_pool.aclose()
+    
     async def chat_completion(
         self, 
         messages: List[Dict[str, str]], 
         client_type: str = None,
+        model_config=None,
+        use_cache: Optional[bool] = None,
         **kwargs
     ) -> LLMResponse:
-        """聊天完成"""
-        client = self.get_client(client_type)
+        """
+        聊天完成
+        
+        Args:
+            messages: 消息列表
+            client_type: 客户端类型
+            model_config: AIModelConfig对象，优先于client_type
+            use_cache: 是否使用响应缓存，None时仅缓存temperature为0的请求
+        """
+        client = self._resolve_client(client_type, model_config)
         if not client:
             return LLMResponse(
                 content="",
@@ -262,25 +786,198 @@ class LLMClientManager:
                 error_message="没有可用的LLM客户端"
             )
         
-        return await client.chat_completion(messages, **kwargs)
+        cache_key = None
+        if self._should_cache(kwargs, use_cache):
+            cache_key = self._cache_key(client, messages, kwargs)
+            # 缓存读写涉及SQLite磁盘I/O，放到线程池执行，不阻塞事件循环
+            cached = await asyncio.to_thread(self.response_cache.get, cache_key)
+            if cached is not None:
+                return LLMResponse(
+                    content=cached["content"],
+                    model=cached["model"],
+                    tokens_used=0,
+                    processing_time=0.0,
+                    success=True,
+                    cached=True
+                )
+        
+        response = await client.chat_completion(messages, **kwargs)
+        
+        if cache_key and response.success and response.content:
+            await asyncio.to_thread(self.response_cache.set, cache_key, {
+                "content": response.content,
+                "model": response.model,
+                "tokens_used": response.tokens_used
+            })
+        
+        return response
     
-    async def text_completion(
+    def _should_cache(self, kwargs: Dict[str, Any], use_cache: Optional[bool]) -> bool:
+        """判断请求是否走缓存：显式指定优先，否则仅缓存temperature为0的确定性请求"""
+        if self.response_cache is None:
+            return False
+        if use_cache is not None:
+            return use_cache
+        return kwargs.get("temperature", 0.7) == 0
+    
+    def get_model_identity(self, client_type: str = None, model_config=None) -> str:
+        """获取实际使用的模型标识（base_url|model），用于缓存等场景区分模型"""
+        client = self._resolve_client(client_type, model_config)
+        if not client:
+            return "unknown"
+        return f"{client.base_url.rstrip('/')}|{client.model}"
+    
+    @staticmethod
+    def _cache_key(client: BaseLLMClient, messages: List[Dict[str, str]], kwargs: Dict[str, Any]) -> str:
+        """按(模型, 消息, temperature, max_tokens, 其他参数)计算缓存键"""
+        extra_params = {
+            **client.default_params,
+            **{key: value for key, value in kwargs.items() if key not in ("temperature", "max_tokens")}
+        }
+        return LLMResponseCache.make_key(
+            model=f"{client.base_url.rstrip('/')}|{client.model}",
+            messages=messages,
+            temperature=kwargs.get("temperature", 0.7),
+            max_tokens=kwargs.get("max_tokens"),
+            extra_params=extra_params
+        )
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """获取响应缓存统计"""
+        if self.response_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.response_cache.stats()}
+    
+    async def stream_chat_completion(
         self, 
-        prompt: str, 
+        messages: List[Dict[str, str]], 
         client_type: str = None,
+        model_config=None,
         **kwargs
-    ) -> LLMResponse:
-        """文本完成"""
-        client = self.get_client(client_type)
+    ) -> AsyncIterator[LLMStreamChunk]:
+        """流式聊天完成"""
+        client = self._resolve_client(client_type, model_config)
         if not client:
-            return LLMResponse(
+            yield LLMStreamChunk(done=True, response=LLMResponse(
                 content="",
                 model="unknown",
                 success=False,
                 error_message="没有可用的LLM客户端"
-            )
+            ))
+            return
+        
+        async for chunk in client.stream_chat_completion(messages, **kwargs):
+            yield chunk
+    
+    async def text_completion(
+        self, 
+        prompt: str, 
+        client_type: str = None,
+        model_config=None,
+        use_cache: Optional[bool] = None,
+        **kwargs
+    ) -> LLMResponse:
+        """文本完成（通过聊天接口实现，共享响应缓存）"""
+        messages = [{"role": "user", "content": prompt}]
+        return await self.chat_completion(
+            messages,
+            client_type=client_type,
+            model_config=model_config,
+            use_cache=use_cache,
+            **kwargs
+        )
+    
+    async def batch_completion(
+        self, 
+        prompts: List[Any], 
+        client_type: str = None,
+        model_config=None,
+        deadline: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        **kwargs
+    ) -> List[LLMResponse]:
+        """
+        批量并发执行多个请求
+        
+        各请求在提供商限流器下并发执行，结果按输入顺序返回。
+        单个请求失败或超过截止时间时，对应位置返回success=False的响应，不影响其他请求。
+        
+        Args:
+            prompts: 提示词列表，元素为字符串或消息列表
+            client_type: 客户端类型
+            model_config: AIModelConfig对象，优先于client_type
+            deadline: 整批请求的截止时间（秒），None表示不限制
+            max_concurrency: 本批次的最大并发数，None时仅受提供商限流器约束
+            
+        Returns:
+            与prompts顺序一致的响应列表
+        """
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        
+        async def run_one(prompt: Any) -> LLMResponse:
+            messages = [{"role": "user", "content": prompt}] if isinstance(prompt, str) else prompt
+            if semaphore is None:
+                return await self.chat_completion(
+                    messages, client_type=client_type, model_config=model_config, **kwargs
+                )
+            async with semaphore:
+                return await self.chat_completion(
+                    messages, client_type=client_type, model_config=model_config, **kwargs
+                )
         
-        return await client.text_completion(prompt, **kwargs)
+        tasks = [asyncio.ensure_future(run_one(prompt)) for prompt in prompts]
+        if not tasks:
+            return []
+        
+        start_time = time.time()
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=deadline)
+        finally:
+            # 超过截止时间或调用方被取消时，取消尚未完成的请求，不留下孤立任务
+            unfinished = [task for task in tasks if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                await asyncio.gather(*unfinished, return_exceptions=True)
+        
+        model_name = "unknown"
+        if model_config is not None:
+            model_name = model_config.model
+        else:
+            client = self.get_client(client_type)
+            if client:
+                model_name = client.model
+        
+        results = []
+        for task in tasks:
+            if task in pending:
+                results.append(LLMResponse(
+                    content="",
+                    model=model_name,
+                    processing_time=time.time() - start_time,
+                    success=False,
+                    error_message=f"批量请求超过截止时间({deadline}秒)"
+                ))
+            elif task.cancelled():
+                results.append(LLMResponse(
+                    content="",
+                    model=model_name,
+                    processing_time=time.time() - start_time,
+                    success=False,
+                    error_message="请求已取消"
+                ))
+            elif task.exception() is not None:
+                results.append(LLMResponse(
+                    content="",
+                    model=model_name,
+                    processing_time=time.time() - start_time,
+                    success=False,
+                    error_message=str(task.exception())
+                ))
+            else:
+                results.append(task.result())
+        
+        return results
     
     async def parse_requirements(
         self, 
@@ -322,6 +1019,16 @@ class LLMClientManager:
         **kwargs
     ) -> LLMResponse:
         """代码评审"""
+        prompt = self.build_review_prompt(code_diff, requirements, focus_areas)
+        return await self.text_completion(prompt, **kwargs)
+    
+    @staticmethod
+    def build_review_prompt(
+        code_diff: str, 
+        requirements: str = "",
+        focus_areas: List[str] = None
+    ) -> str:
+        """构建代码评审prompt"""
         focus_text = ""
         if focus_areas:
             focus_text = f"请特别关注以下方面：{', '.join(focus_areas)}"
@@ -365,7 +1072,7 @@ class LLMClientManager:
 请确保返回有效的JSON格式。
 """
         
-        return await self.text_completion(prompt, **kwargs)
+        return prompt
 
 
 # 创建全局LLM客户端管理器实例
@@ -0,0 +1,247 @@
+"""
+LLM调用限流与重试
+按提供商（base_url）的自适应并发控制（AIMD）、RPM/TPM令牌桶，以及带抖动的指数退避
+"""
+import time
+import random
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.core.tokenizer import count_message_tokens
+
+
+# 可重试的HTTP状态码
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# 表示提供商过载、需要降低并发的状态码
+THROTTLE_STATUS_CODES = {429, 503}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    解析Retry-After响应头
+
+    Args:
+        value: 秒数或HTTP日期
+
+    Returns:
+        等待秒数，无法解析返回None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(
+    attempt: int,
+    base: Optional[float] = None,
+    cap: Optional[float] = None,
+    retry_after: Optional[float] = None
+) -> float:
+    """
+    计算重试等待时间（full jitter指数退避）
+
+    Args:
+        attempt: 已重试次数（从0开始）
+        base: 基础等待秒数
+        cap: 最大等待秒数
+        retry_after: 服务端要求的等待秒数，存在时优先使用（不超过cap）
+
+    Returns:
+        等待秒数
+    """
+    base = settings.LLM_RETRY_BASE_DELAY if base is None else base
+    cap = settings.LLM_RETRY_MAX_DELAY if cap is None else cap
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        # 遵循服务端要求（异常大的Retry-After按cap截断），再加少量抖动避免所有请求同时恢复
+        delay = min(retry_after, cap) + random.uniform(0, base)
+    return delay
+
+
+def estimate_request_tokens(
+    messages: List[Dict[str, str]],
+    max_tokens: Optional[int] = None,
+    model: Optional[str] = None
+) -> int:
+    """估算一次请求消耗的token数（输入token数加上最大输出）"""
+    return count_message_tokens(messages, model) + (max_tokens or 0)
+
+
+class TokenBucket:
+    """
+    令牌桶
+
+    容量为每分钟配额，按秒匀速补充。允许余额为负（预占），
+    调用方按欠额等待，无需加锁即可在单个事件循环内公平排队。
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        """获取令牌，不足时等待"""
+        self._refill()
+        # 单次请求超过桶容量时按容量计，避免永久等待
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    def adjust(self, amount: float):
+        """按实际消耗修正预占（正数退还，负数补扣）"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD自适应并发限制
+
+    请求成功且延迟低于目标时加性增加并发上限，
+    遇到限流或延迟超标时乘性减少。
+    """
+
+    # 两次乘性减少的最小间隔（秒），避免同一波429把并发直接压到最低
+    DECREASE_INTERVAL = 1.0
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, latency_target: float):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # asyncio原语绑定事件循环，循环切换后（如Celery任务中的asyncio.run）重新创建
+            self._condition = asyncio.Condition()
+            self._in_flight = 0
+            self._loop = loop
+        return self._condition
+
+    async def acquire(self):
+        """获取并发槽位"""
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self._in_flight < max(1, int(self.limit)))
+            self._in_flight += 1
+
+    async def release(self):
+        """释放并发槽位"""
+        condition = self._get_condition()
+        async with condition:
+            self._in_flight = max(0, self._in_flight - 1)
+            condition.notify_all()
+
+    def on_success(self, latency: float):
+        """记录成功请求"""
+        if latency > self.latency_target:
+            self._decrease(0.9)
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+    def on_throttle(self):
+        """记录限流响应"""
+        self._decrease(0.5)
+
+    def _decrease(self, factor: float):
+        now = time.monotonic()
+        if now - self._last_decrease < self.DECREASE_INTERVAL:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * factor)
+
+
+class ProviderLimiter:
+    """单个提供商的限流器"""
+
+    def __init__(self):
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            initial=settings.LLM_INITIAL_CONCURRENCY,
+            min_limit=settings.LLM_MIN_CONCURRENCY,
+            max_limit=settings.LLM_MAX_CONCURRENCY,
+            latency_target=settings.LLM_LATENCY_TARGET
+        )
+        self.rpm_bucket = TokenBucket(settings.LLM_RPM_LIMIT) if settings.LLM_RPM_LIMIT > 0 else None
+        self.tpm_bucket = TokenBucket(settings.LLM_TPM_LIMIT) if settings.LLM_TPM_LIMIT > 0 else None
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int = 0):
+        """
+        获取一次请求的执行许可
+
+        Args:
+            estimated_tokens: 预估token数，用于TPM限流
+        """
+        if self.rpm_bucket:
+            await self.rpm_bucket.acquire(1)
+        if self.tpm_bucket and estimated_tokens:
+            await self.tpm_bucket.acquire(estimated_tokens)
+
+        await self.concurrency.acquire()
+        try:
+            yield
+        finally:
+            await self.concurrency.release()
+
+    def record_tokens(self, estimated_tokens: int, actual_tokens: int):
+        """按实际token用量修正TPM预占"""
+        if self.tpm_bucket and actual_tokens:
+            self.tpm_bucket.adjust(estimated_tokens - actual_tokens)
+
+    def on_success(self, latency: float):
+        self.concurrency.on_success(latency)
+
+    def on_throttle(self):
+        self.concurrency.on_throttle()
+
+    def stats(self) -> Dict[str, float]:
+        """获取当前限流状态"""
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency._in_flight
+        }
+
+
+class LLMLimiterRegistry:
+    """按base_url管理提供商限流器"""
+
+    def __init__(self):
+        self._limiters: Dict[str, ProviderLimiter] = {}
+
+    def get(self, base_url: str) -> ProviderLimiter:
+        key = base_url.rstrip("/")
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = ProviderLimiter()
+            self._limiters[key] = limiter
+        return limiter
+
+
+# 创建全局限流器注册表
+llm_limiters = LLMLimiterRegistry()
@@ -0,0 +1,179 @@
+"""
+文本切分
+与langchain RecursiveCharacterTextSplitter（keep_separator=True, strip_whitespace=True）
+语义一致的递归切分器：切分过程只记录原文中的起止偏移，最终切片才做一次切片复制；
+切分器实例按参数缓存，支持按字符或按token计算长度
+"""
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence, Tuple
+from app.core.tokenizer import get_tokenizer
+
+
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+
+LENGTH_UNITS = ("char", "token")
+
+# 片段在原文中的 [起点, 终点)
+Span = Tuple[int, int]
+
+
+class TextSplitter:
+    """
+    递归文本切分器
+
+    依次尝试分隔符，将文本切成片段（分隔符保留在后一个片段开头，片段在原文中首尾相连），
+    长度不小于chunk_size的片段用下一级分隔符继续切分，其余片段按chunk_size合并并保留
+    chunk_overlap的重叠。
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        separators: Sequence[str] = DEFAULT_SEPARATORS,
+        length_function: Optional[Callable[[str], int]] = None
+    ):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"切片重叠({chunk_overlap})不能大于切片大小({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = tuple(separators)
+        # 为None时按字符计长度，直接用偏移相减
+        self.length_function = length_function
+
+    def _length(self, text: str, start: int, end: int) -> int:
+        if self.length_function is None:
+            return end - start
+        return self.length_function(text[start:end])
+
+    @staticmethod
+    def _split_spans(text: str, start: int, end: int, separator: str) -> List[Span]:
+        """按分隔符切成首尾相连的片段，分隔符归入后一个片段"""
+        if not separator:
+            return [(i, i + 1) for i in range(start, end)]
+
+        spans = []
+        piece_start = start
+        position = text.find(separator, start, end)
+        while position != -1:
+            if position > piece_start:
+                spans.append((piece_start, position))
+                piece_start = position
+            position = text.find(separator, position + len(separator), end)
+        if piece_start < end:
+            spans.append((piece_start, end))
+        return spans
+
+    @staticmethod
+    def _strip_span(text: str, start: int, end: int) -> Optional[Span]:
+        """去掉首尾空白后的片段，全为空白时返回None"""
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return (start, end) if start < end else None
+
+    def _merge(self, text: str, splits: List[Tuple[int, int, int]], output: List[Span]):
+        """
+        合并相邻片段
+
+        splits中每项为(起点, 终点, 长度)，相邻片段在原文中连续，合并结果就是原文的一段。
+        """
+        window_start = 0
+        total = 0
+        for index, (_, _, length) in enumerate(splits):
+            if total + length > self.chunk_size and index > window_start:
+                span = self._strip_span(text, splits[window_start][0], splits[index - 1][1])
+                if span:
+                    output.append(span)
+                # 从窗口头部移出片段，直到剩余部分不超过重叠大小且能放下当前片段
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    total -= splits[window_start][2]
+                    window_start += 1
+            total += length
+
+        if window_start < len(splits):
+            span = self._strip_span(text, splits[window_start][0], splits[-1][1])
+            if span:
+                output.append(span)
+
+    def _split(self, text: str, start: int, end: int, separators: Sequence[str], output: List[Span]):
+        separator = separators[-1]
+        remaining: Sequence[str] = ()
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator = candidate
+                remaining = separators[i + 1:]
+                break
+
+        good: List[Tuple[int, int, int]] = []
+        for span_start, span_end in self._split_spans(text, start, end, separator):
+            length = self._length(text, span_start, span_end)
+            if length < self.chunk_size:
+                good.append((span_start, span_end, length))
+                continue
+            if good:
+                self._merge(text, good, output)
+                good = []
+            if not remaining:
+                # 无法继续切分的超长片段原样保留（与langchain一致，不去除空白）
+                output.append((span_start, span_end))
+            else:
+                self._split(text, span_start, span_end, remaining, output)
+        if good:
+            self._merge(text, good, output)
+
+    def split_spans(self, text: str) -> List[Span]:
+        """
+        切分文本，返回各切片在原文中的偏移
+
+        Args:
+            text: 文本
+
+        Returns:
+            [(起点, 终点)]，text[起点:终点]即切片内容
+        """
+        output: List[Span] = []
+        if text:
+            self._split(text, 0, len(text), self.separators, output)
+        return output
+
+    def split_text(self, text: str) -> List[str]:
+        """
+        切分文本
+
+        Args:
+            text: 文本
+
+        Returns:
+            切片列表
+        """
+        return [text[start:end] for start, end in self.split_spans(text)]
+
+
+@lru_cache(maxsize=32)
+def get_text_splitter(
+    chunk_size: int,
+    chunk_overlap: int,
+    length_unit: str = "char",
+    model: Optional[str] = None
+) -> TextSplitter:
+    """
+    获取切分器（按参数缓存实例）
+
+    Args:
+        chunk_size: 切片大小
+        chunk_overlap: 重叠大小
+        length_unit: 长度单位，char按字符，token按模型分词器的token数
+        model: 按token计算长度时使用的模型
+
+    Returns:
+        切分器
+    """
+    if length_unit not in LENGTH_UNITS:
+        raise ValueError(f"不支持的切片长度单位: {length_unit}")
+    length_function = get_tokenizer(model).count if length_unit == "token" else None
+    return TextSplitter(chunk_size, chunk_overlap, length_function=length_function)
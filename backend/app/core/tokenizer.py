@@ -0,0 +1,303 @@
+"""
+Token计数与上下文预算
+优先使用tiktoken的BPE编码（编码表缓存在本地目录，可离线使用），不可用时退化为启发式估算
+"""
+import os
+import re
+import hashlib
+import tempfile
+from functools import lru_cache
+from typing import Dict, List, Optional
+from app.core.config import settings
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+
+# 常见模型的上下文窗口（token），按前缀匹配，更具体的前缀排在前面
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-3.5-turbo": 16385,
+    "o1": 128000,
+    "claude": 200000,
+    "deepseek": 64000,
+    "qwen": 32768,
+    "glm-4": 128000,
+    "moonshot-v1-128k": 128000,
+    "moonshot-v1-32k": 32768,
+    "moonshot-v1-8k": 8192,
+    "llama3": 8192,
+    "llama2": 4096,
+    "mistral": 32768,
+}
+
+# tiktoken编码表的下载地址，本地缓存文件以地址的sha1命名（与tiktoken的缓存规则一致）
+TIKTOKEN_ENCODING_URLS: Dict[str, str] = {
+    "cl100k_base": "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken",
+    "o200k_base": "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken",
+}
+
+# 聊天消息格式的固定开销（参照OpenAI的计数方式）
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# CJK字符、英文单词/数字、其他非空白字符
+_HEURISTIC_TOKEN_RE = re.compile(
+    r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]|[A-Za-z]+|\d+|[^\sA-Za-z\d]'
+)
+
+
+class BaseTokenizer:
+    """分词器基类"""
+
+    name = "base"
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截断文本到指定token数"""
+        raise NotImplementedError
+
+
+class HeuristicTokenizer(BaseTokenizer):
+    """
+    启发式分词器
+
+    CJK字符按1个token计；英文单词按每4个字母1个token计；数字按每3位1个token计；
+    标点符号各计1个token。与cl100k编码的误差通常在10%-15%以内。
+    """
+
+    name = "heuristic"
+
+    @staticmethod
+    def _token_cost(piece: str) -> int:
+        if piece.isascii() and piece.isalpha():
+            return (len(piece) + 3) // 4
+        if piece.isdigit():
+            return (len(piece) + 2) // 3
+        return 1
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return sum(self._token_cost(piece) for piece in _HEURISTIC_TOKEN_RE.findall(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        used = 0
+        for match in _HEURISTIC_TOKEN_RE.finditer(text):
+            used += self._token_cost(match.group())
+            if used > max_tokens:
+                return text[:match.start()]
+        return text
+
+
+class TiktokenTokenizer(BaseTokenizer):
+    """基于tiktoken的BPE分词器"""
+
+    name = "tiktoken"
+
+    def __init__(self, encoding_name: str):
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.name = f"tiktoken:{encoding_name}"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max_tokens])
+
+
+def _encoding_for_model(model: Optional[str]) -> str:
+    """根据模型名选择BPE编码"""
+    name = (model or "").lower()
+    if name.startswith(("gpt-4o", "o1", "o3", "o4")):
+        return "o200k_base"
+    return "cl100k_base"
+
+
+def _encoding_cached(encoding_name: str) -> bool:
+    """编码表是否已在tiktoken缓存目录中（不存在时加载会触发联网下载）"""
+    url = TIKTOKEN_ENCODING_URLS.get(encoding_name)
+    if url is None:
+        return False
+    if "TIKTOKEN_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["TIKTOKEN_CACHE_DIR"]
+    elif "DATA_GYM_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["DATA_GYM_CACHE_DIR"]
+    else:
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    # 缓存目录为空字符串时tiktoken不使用缓存，每次都会下载
+    return bool(cache_dir) and os.path.exists(os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest()))
+
+
+@lru_cache(maxsize=8)
+def _load_tokenizer(encoding_name: str) -> BaseTokenizer:
+    """
+    加载分词器，tiktoken不可用或编码表无法获取时退化为启发式
+
+    auto模式下只使用本地已缓存的编码表，不会在请求路径上联网下载；
+    TOKENIZER_BACKEND=tiktoken时允许tiktoken自行下载编码表。
+    """
+    if settings.TOKENIZER_BACKEND != "heuristic" and TIKTOKEN_AVAILABLE:
+        if settings.TOKENIZER_CACHE_DIR:
+            # tiktoken从该目录读取/缓存编码表，预先放入后可完全离线
+            os.makedirs(settings.TOKENIZER_CACHE_DIR, exist_ok=True)
+            os.environ.setdefault("TIKTOKEN_CACHE_DIR", settings.TOKENIZER_CACHE_DIR)
+        if settings.TOKENIZER_BACKEND == "auto" and not _encoding_cached(encoding_name):
+            print(f"tiktoken编码表{encoding_name}未缓存，使用启发式分词（可将编码表放入TOKENIZER_CACHE_DIR）")
+            return HeuristicTokenizer()
+        try:
+            return TiktokenTokenizer(encoding_name)
+        except Exception as e:
+            print(f"加载tiktoken编码表失败，使用启发式分词: {e}")
+    return HeuristicTokenizer()
+
+
+def get_tokenizer(model: Optional[str] = None) -> BaseTokenizer:
+    """获取模型对应的分词器"""
+    return _load_tokenizer(_encoding_for_model(model))
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """计算文本token数"""
+    return get_tokenizer(model).count(text or "")
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: Optional[str] = None) -> int:
+    """计算聊天消息列表的token数（含消息格式开销）"""
+    tokenizer = get_tokenizer(model)
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        total += TOKENS_PER_MESSAGE
+        total += tokenizer.count(message.get("content") or "")
+        total += tokenizer.count(message.get("role") or "")
+    return total
+
+
+def get_context_window(model: Optional[str] = None) -> int:
+    """获取模型上下文窗口大小"""
+    name = (model or "").lower()
+    # 去掉provider前缀，如 openai/gpt-4o
+    name = name.rsplit("/", 1)[-1]
+    for prefix, window in MODEL_CONTEXT_WINDOWS.items():
+        if name.startswith(prefix):
+            return window
+    return settings.LLM_DEFAULT_CONTEXT_WINDOW
+
+
+class ContextBudgeter:
+    """
+    上下文预算
+
+    在模型上下文窗口内，扣除输出预留和固定prompt后，
+    按顺序填充可选内容（知识库片段、对话历史等）。
+    """
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        max_output_tokens: int = 0,
+        context_window: Optional[int] = None,
+        safety_margin: float = 0.05
+    ):
+        self.model = model
+        self.tokenizer = get_tokenizer(model)
+        self.context_window = context_window or get_context_window(model)
+        self.max_output_tokens = max_output_tokens or 0
+        # 不同分词方式存在误差，保留一定余量
+        self.safety_margin = safety_margin
+
+    @property
+    def input_budget(self) -> int:
+        """可用于输入的token数"""
+        usable = int(self.context_window * (1 - self.safety_margin))
+        return max(usable - self.max_output_tokens, 0)
+
+    def count(self, text: str) -> int:
+        return self.tokenizer.count(text or "")
+
+    def remaining(self, *fixed_texts: str) -> int:
+        """扣除固定内容后的剩余预算"""
+        used = sum(self.count(text) for text in fixed_texts)
+        return max(self.input_budget - used, 0)
+
+    def fit_texts(
+        self,
+        texts: List[str],
+        budget: int,
+        separator: str = "\n\n",
+        truncate_last: bool = True
+    ) -> List[str]:
+        """
+        按顺序选取不超过预算的文本片段
+
+        Args:
+            texts: 候选文本（按优先级排序）
+            budget: token预算
+            separator: 片段之间的分隔符
+            truncate_last: 放不下的第一个片段是否截断后放入
+
+        Returns:
+            选中的文本列表
+        """
+        selected = []
+        used = 0
+        separator_tokens = self.count(separator)
+
+        for text in texts:
+            cost = self.count(text) + (separator_tokens if selected else 0)
+            if used + cost <= budget:
+                selected.append(text)
+                used += cost
+                continue
+
+            if truncate_last:
+                left = budget - used - (separator_tokens if selected else 0)
+                if left > 0:
+                    truncated = self.tokenizer.truncate(text, left)
+                    if truncated:
+                        selected.append(truncated)
+            break
+
+        return selected
+
+    def fit_messages(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        裁剪对话消息以适配上下文窗口
+
+        始终保留system消息和最后一条消息，从最早的历史消息开始丢弃。
+        """
+        if count_message_tokens(messages, self.model) <= self.input_budget:
+            return messages
+
+        system = [msg for msg in messages[:-1] if msg.get("role") == "system"]
+        history = [msg for msg in messages[:-1] if msg.get("role") != "system"]
+        last = messages[-1:]
+
+        budget = self.input_budget - count_message_tokens(system + last, self.model)
+        kept: List[Dict[str, str]] = []
+        for message in reversed(history):
+            cost = TOKENS_PER_MESSAGE + self.count(message.get("content") or "") + self.count(message.get("role") or "")
+            if cost > budget:
+                break
+            kept.insert(0, message)
+            budget -= cost
+
+        return system + kept + last
@@ -3,14 +3,41 @@ ChromaDB向量存储封装
 """
 import os
 import hashlib
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Callable
 import chromadb
+import chromadb.errors as chroma_errors
 from chromadb.config import Settings
 from app.core.config import settings
 
 
+# 集合不存在时ChromaDB抛出的异常（新版本）
+NOT_FOUND_ERRORS = tuple(
+    getattr(chroma_errors, name) for name in ("NotFoundError",) if hasattr(chroma_errors, name)
+)
+
+# 旧版本以这些异常报告集合不存在，同类异常也用于其他错误，需结合消息判断
+MAYBE_NOT_FOUND_ERRORS = (ValueError,) + tuple(
+    getattr(chroma_errors, name) for name in ("InvalidCollectionException",) if hasattr(chroma_errors, name)
+)
+
+
+def is_stale_collection_error(error: Exception) -> bool:
+    """判断异常是否由集合不存在（被删除或重建）引起"""
+    if NOT_FOUND_ERRORS and isinstance(error, NOT_FOUND_ERRORS):
+        return True
+    # 消息形如 "Collection xxx does not exist"
+    return isinstance(error, MAYBE_NOT_FOUND_ERRORS) and "does not exist" in str(error).lower()
+
+
 class ChromaDBManager:
-    """ChromaDB管理器"""
+    """
+    ChromaDB管理器
+    
+    集合句柄按名称缓存，读写操作不再每次先查询一次集合；创建、删除集合时使缓存失效。
+    其他进程（API/Celery）删除或重建同名集合后缓存的句柄会失效，
+    操作因集合不存在失败时丢弃缓存句柄并重新获取后重试一次。
+    """
     
     def __init__(self):
         """初始化ChromaDB客户端"""
@@ -25,6 +52,18 @@ class ChromaDBManager:
                 allow_reset=True
             )
         )
+        
+        self._collections: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+    
+    def _cache_collection(self, collection_name: str, collection):
+        with self._lock:
+            self._collections[collection_name] = collection
+    
+    def invalidate_collection(self, collection_name: str):
+        """丢弃缓存的集合句柄"""
+        with self._lock:
+            self._collections.pop(collection_name, None)
     
     def create_collection(self, collection_name: str, metadata: Optional[Dict] = None) -> bool:
         """
@@ -37,37 +76,118 @@ class ChromaDBManager:
         Returns:
             是否创建成功
         """
+        self.invalidate_collection(collection_name)
         try:
-            # 检查集合是否已存在
-            existing_collections = [col.name for col in self.client.list_collections()]
-            if collection_name in existing_collections:
-                return False
-            
-            # 创建集合
-            self.client.create_collection(
+            collection = self.client.create_collection(
                 name=collection_name,
                 metadata=metadata or {}
             )
-            return True
         except Exception as e:
-            print(f"创建集合失败: {e}")
+            # 直接创建，已存在时由ChromaDB报错，不再先列出全部集合检查
+            if self.get_collection(collection_name, log_errors=False) is None:
+                print(f"创建集合失败: {e}")
             return False
+        
+        self._cache_collection(collection_name, collection)
+        return True
     
-    def get_collection(self, collection_name: str):
+    def get_or_create_collection(self, collection_name: str, metadata: Optional[Dict] = None):
         """
-        获取集合
+        获取集合，不存在时创建（优先使用缓存的句柄）
         
         Args:
             collection_name: 集合名称
+            metadata: 创建集合时使用的元数据（集合已存在时不修改）
+            
+        Returns:
+            ChromaDB集合对象，失败时返回None
+        """
+        collection = self.get_collection(collection_name, log_errors=False)
+        if collection is not None:
+            return collection
+        
+        try:
+            collection = self.client.get_or_create_collection(
+                name=collection_name,
+                metadata=metadata or {}
+            )
+        except Exception as e:
+            print(f"获取或创建集合失败: {e}")
+            return None
+        
+        self._cache_collection(collection_name, collection)
+        return collection
+    
+    def get_collection(self, collection_name: str, log_errors: bool = True):
+        """
+        获取集合（优先使用缓存的句柄）
+        
+        Args:
+            collection_name: 集合名称
+            log_errors: 获取失败（如集合不存在）时是否打印错误
             
         Returns:
             ChromaDB集合对象
         """
+        with self._lock:
+            collection = self._collections.get(collection_name)
+        if collection is not None:
+            return collection
+        
         try:
-            return self.client.get_collection(name=collection_name)
+            collection = self.client.get_collection(name=collection_name)
         except Exception as e:
-            print(f"获取集合失败: {e}")
+            if log_errors:
+                print(f"获取集合失败: {e}")
             return None
+        
+        self._cache_collection(collection_name, collection)
+        return collection
+    
+    def _with_collection(self, collection_name: str, operation: Callable[[Any], Any], default=None):
+        """
+        在集合上执行操作
+        
+        操作因集合不存在失败时句柄可能已失效（集合被其他进程删除或重建），丢弃缓存后重试一次；
+        其他异常（如参数错误、维度不匹配）和重试仍失败的异常交给调用方处理。
+        
+        Args:
+            collection_name: 集合名称
+            operation: 接收集合对象的操作
+            default: 集合不存在时的返回值
+            
+        Returns:
+            操作结果
+        """
+        collection = self.get_collection(collection_name)
+        if collection is None:
+            return default
+        
+        try:
+            return operation(collection)
+        except Exception as e:
+            if not is_stale_collection_error(e):
+                raise
+            self.invalidate_collection(collection_name)
+            collection = self.get_collection(collection_name)
+            if collection is None:
+                return default
+            return operation(collection)
+    
+    def get_collection_metadata(self, collection_name: str) -> Optional[Dict]:
+        """
+        获取集合元数据
+        
+        Args:
+            collection_name: 集合名称
+            
+        Returns:
+            元数据字典，集合不存在时返回None
+        """
+        collection = self.get_collection(collection_name)
+        if not collection:
+            return None
+        return collection.metadata or {}
     
     def delete_collection(self, collection_name: str) -> bool:
         """
@@ -79,6 +199,7 @@ class ChromaDBManager:
         Returns:
             是否删除成功
         """
+        self.invalidate_collection(collection_name)
         try:
             self.client.delete_collection(name=collection_name)
             return True
@@ -91,7 +212,8 @@ class ChromaDBManager:
         collection_name: str, 
         documents: List[str], 
         metadatas: List[Dict[str, Any]], 
-        ids: List[str]
+        ids: List[str],
+        embeddings: Optional[List[List[float]]] = None
     ) -> bool:
         """
         添加文档到集合
@@ -101,60 +223,97 @@ class ChromaDBManager:
             documents: 文档内容列表
             metadatas: 元数据列表
             ids: 文档ID列表
+            embeddings: 预先计算的向量，为空时由集合的默认嵌入函数计算
             
         Returns:
             是否添加成功
         """
         try:
-            collection = self.get_collection(collection_name)
-            if not collection:
-                return False
+            def add(collection):
+                # 批量添加文档
+                collection.add(
+                    documents=documents,
+                    metadatas=metadatas,
+                    ids=ids,
+                    embeddings=embeddings
+                )
+                return True
             
-            # 批量添加文档
-            collection.add(
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
-            return True
+            return self._with_collection(collection_name, add, default=False)
         except Exception as e:
             print(f"添加文档失败: {e}")
             return False
     
+    def upsert_documents(
+        self, 
+        collection_name: str, 
+        documents: List[str], 
+        metadatas: List[Dict[str, Any]], 
+        ids: List[str],
+        embeddings: Optional[List[List[float]]] = None
+    ) -> bool:
+        """
+        添加或覆盖文档（ID已存在时更新），用于可重试的写入
+        
+        Args:
+            collection_name: 集合名称
+            documents: 文档内容列表
+            metadatas: 元数据列表
+            ids: 文档ID列表
+            embeddings: 预先计算的向量，为空时由集合的默认嵌入函数计算
+            
+        Returns:
+            是否写入成功
+        """
+        try:
+            def upsert(collection):
+                collection.upsert(
+                    documents=documents,
+                    metadatas=metadatas,
+                    ids=ids,
+                    embeddings=embeddings
+                )
+                return True
+            
+            return self._with_collection(collection_name, upsert, default=False)
+        except Exception as e:
+            print(f"写入文档失败: {e}")
+            return False
+    
     def search_documents(
         self, 
         collection_name: str, 
-        query_texts: List[str], 
+        query_texts: Optional[List[str]] = None, 
         n_results: int = 5,
         where: Optional[Dict] = None,
-        where_document: Optional[Dict] = None
+        where_document: Optional[Dict] = None,
+        query_embeddings: Optional[List[List[float]]] = None
     ) -> Optional[Dict]:
         """
         搜索文档
         
         Args:
             collection_name: 集合名称
-            query_texts: 查询文本列表
+            query_texts: 查询文本列表（未提供query_embeddings时由集合的默认嵌入函数向量化）
             n_results: 返回结果数量
             where: 元数据过滤条件
             where_document: 文档内容过滤条件
+            query_embeddings: 预先计算的查询向量
             
         Returns:
             搜索结果
         """
         try:
-            collection = self.get_collection(collection_name)
-            if not collection:
-                return None
-            
-            results = collection.query(
+            if query_embeddings is not None:
+                query_texts = None
+            return self._with_collection(collection_name, lambda collection: collection.query(
                 query_texts=query_texts,
+                query_embeddings=query_embeddings,
                 n_results=n_results,
                 where=where,
                 where_document=where_document,
                 include=["documents", "metadatas", "distances"]
-            )
-            return results
+            ))
         except Exception as e:
             print(f"搜索文档失败: {e}")
             return None
@@ -179,38 +338,42 @@ class ChromaDBManager:
             是否更新成功
         """
         try:
-            collection = self.get_collection(collection_name)
-            if not collection:
-                return False
+            def update(collection):
+                collection.update(
+                    ids=ids,
+                    documents=documents,
+                    metadatas=metadatas
+                )
+                return True
             
-            collection.update(
-                ids=ids,
-                documents=documents,
-                metadatas=metadatas
-            )
-            return True
+            return self._with_collection(collection_name, update, default=False)
         except Exception as e:
             print(f"更新文档失败: {e}")
             return False
     
-    def delete_documents(self, collection_name: str, ids: List[str]) -> bool:
+    def delete_documents(
+        self, 
+        collection_name: str, 
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict] = None
+    ) -> bool:
         """
         删除文档
         
         Args:
             collection_name: 集合名称
             ids: 要删除的文档ID列表
+            where: 元数据过滤条件（按条件删除，如某个文档的全部切片）
             
         Returns:
             是否删除成功
         """
         try:
-            collection = self.get_collection(collection_name)
-            if not collection:
-                return False
+            def delete(collection):
+                collection.delete(ids=ids, where=where)
+                return True
             
-            collection.delete(ids=ids)
-            return True
+            return self._with_collection(collection_name, delete, default=False)
         except Exception as e:
             print(f"删除文档失败: {e}")
             return False
@@ -226,16 +389,11 @@ class ChromaDBManager:
             统计信息字典
         """
         try:
-            collection = self.get_collection(collection_name)
-            if not collection:
-                return None
-            
-            count = collection.count()
-            return {
+            return self._with_collection(collection_name, lambda collection: {
                 "name": collection_name,
-                "count": count,
+                "count": collection.count(),
                 "metadata": collection.metadata
-            }
+            })
         except Exception as e:
             print(f"获取集合统计失败: {e}")
             return None
@@ -269,6 +427,23 @@ def generate_chunk_id(document_id: int, chunk_index: int) -> str:
     return f"doc_{document_id}_chunk_{chunk_index}"
 
 
+def generate_content_chunk_id(document_id: int, content_hash: str, occurrence: int = 0) -> str:
+    """
+    基于内容生成切片ID
+    
+    切片位置变化时ID不变，增量重建索引时未变化的切片可以保留原向量。
+    
+    Args:
+        document_id: 文档ID
+        content_hash: 切片内容哈希
+        occurrence: 相同内容在文档中第几次出现（从0开始）
+        
+    Returns:
+        切片ID
+    """
+    return f"doc_{document_id}_{content_hash[:16]}_{occurrence}"
+
+
 def calculate_content_hash(content: str) -> str:
     """
     计算内容哈希
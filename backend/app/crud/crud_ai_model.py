@@ -2,8 +2,9 @@
 AI模型配置相关CRUD操作
 """
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Dict, Optional, List, Union
 from sqlmodel import Session, select, func
+from app.core.llm_client import llm_manager
 from app.crud.base import CRUDBase
 from app.models.ai_model import AIModelConfig, AIModelTestResult
 from app.schemas.ai_model import AIModelConfigCreate, AIModelConfigUpdate
@@ -12,6 +13,24 @@ from app.schemas.ai_model import AIModelConfigCreate, AIModelConfigUpdate
 class CRUDAIModelConfig(CRUDBase[AIModelConfig, AIModelConfigCreate, AIModelConfigUpdate]):
     """AI模型配置CRUD操作"""
     
+    def update(
+        self,
+        db: Session,
+        *,
+        db_obj: AIModelConfig,
+        obj_in: Union[AIModelConfigUpdate, Dict[str, Any]]
+    ) -> AIModelConfig:
+        """更新模型配置，并失效对应的LLM客户端缓存"""
+        model = super().update(db, db_obj=db_obj, obj_in=obj_in)
+        llm_manager.invalidate_model_client(model.id)
+        return model
+    
+    def remove(self, db: Session, *, id: int) -> AIModelConfig:
+        """删除模型配置，并失效对应的LLM客户端缓存"""
+        model = super().remove(db, id=id)
+        llm_manager.invalidate_model_client(id)
+        return model
+    
     def get_by_provider(self, db: Session, *, provider: str) -> List[AIModelConfig]:
         """根据提供商获取模型配置"""
         statement = select(AIModelConfig).where(AIModelConfig.provider == provider)
@@ -2,12 +2,19 @@
 知识库相关CRUD操作
 """
 import os
-from typing import Optional, List
+from datetime import datetime
+from itertools import islice
+from typing import Optional, List, Dict, Any, Set, Iterable
+from sqlalchemy import insert, update, delete
 from sqlmodel import Session, select, func
 from app.crud.base import CRUDBase
-from app.models.knowledge_base import KnowledgeBase, Document, DocumentChunk
+from app.models.knowledge_base import KnowledgeBase, Document, DocumentChunk, IngestionBatch
 from app.schemas.knowledge_base import KnowledgeBaseCreate, KnowledgeBaseUpdate
 from app.core.vector_store import chroma_manager
+from app.core.embeddings import embedding_service, COLLECTION_BACKEND_KEY
+
+# 文档入库流水线中尚未结束的状态
+DOCUMENT_PROCESSING_STATUSES = ["pending", "processing", "loading", "splitting", "embedding", "persisting"]
 
 
 class CRUDKnowledgeBase(CRUDBase[KnowledgeBase, KnowledgeBaseCreate, KnowledgeBaseUpdate]):
@@ -36,21 +43,29 @@ class CRUDKnowledgeBase(CRUDBase[KnowledgeBase, KnowledgeBaseCreate, KnowledgeBa
         metadata = {
             "knowledge_base_id": db_obj.id,
             "embedding_model": obj_in.embedding_model,
+            COLLECTION_BACKEND_KEY: embedding_service.backend_for(obj_in.embedding_model),
             "chunk_size": obj_in.chunk_size,
             "chunk_overlap": obj_in.chunk_overlap
         }
         
-        success = chroma_manager.create_collection(
+        # 同名集合可能已存在（如之前删除知识库时集合删除失败），直接复用并更新元数据
+        collection = chroma_manager.get_or_create_collection(
             collection_name=collection_name,
             metadata=metadata
         )
         
-        if not success:
+        if collection is None:
             # 如果ChromaDB集合创建失败，删除数据库记录
             db.delete(db_obj)
             db.commit()
             raise Exception("创建向量存储集合失败")
         
+        if (collection.metadata or {}) != metadata:
+            try:
+                collection.modify(metadata=metadata)
+            except Exception as e:
+                print(f"更新向量存储集合元数据失败: {e}")
+        
         return db_obj
     
     def get_by_name(self, db: Session, *, name: str) -> Optional[KnowledgeBase]:
@@ -105,6 +120,28 @@ class CRUDDocument(CRUDBase[Document, dict, dict]):
         statement = select(Document).where(Document.status == status)
         return db.exec(statement).all()
     
+    def get_existing_hashes(self, db: Session, *, content_hashes: List[str]) -> Set[str]:
+        """批量查询已存在的内容哈希"""
+        existing = set()
+        # 分批查询，避免IN参数过多
+        for start in range(0, len(content_hashes), 500):
+            statement = select(Document.content_hash).where(
+                Document.content_hash.in_(content_hashes[start:start + 500])
+            )
+            existing.update(db.exec(statement).all())
+        return existing
+    
+    def count_by_status(self, db: Session, *, document_ids: List[int]) -> Dict[str, int]:
+        """按状态统计指定文档的数量"""
+        counts: Dict[str, int] = {}
+        for start in range(0, len(document_ids), 500):
+            statement = select(Document.status, func.count(Document.id)).where(
+                Document.id.in_(document_ids[start:start + 500])
+            ).group_by(Document.status)
+            for status, count in db.exec(statement).all():
+                counts[status] = counts.get(status, 0) + count
+        return counts
+    
     def update_status(
         self, db: Session, *, document_id: int, status: str, error_message: str = None
     ) -> Optional[Document]:
@@ -112,6 +149,7 @@ class CRUDDocument(CRUDBase[Document, dict, dict]):
         document = self.get(db, document_id)
         if document:
             document.status = status
+            document.updated_at = datetime.utcnow()
             if error_message:
                 document.error_message = error_message
             db.add(document)
@@ -119,6 +157,57 @@ class CRUDDocument(CRUDBase[Document, dict, dict]):
             db.refresh(document)
         return document
     
+    def touch(self, db: Session, *, document_ids: List[int]) -> None:
+        """刷新文档的更新时间（提交入库流水线时调用，作为超时判断的起点）"""
+        now = datetime.utcnow()
+        for start in range(0, len(document_ids), 500):
+            db.exec(
+                update(Document)
+                .where(Document.id.in_(document_ids[start:start + 500]))
+                .values(updated_at=now)
+            )
+        db.commit()
+    
+    def fail_stale(
+        self, db: Session, *, document_ids: List[int], before: datetime, error_message: str
+    ) -> int:
+        """
+        将超过时间仍未推进的处理中文档标记为失败
+        
+        Args:
+            db: 数据库会话
+            document_ids: 文档ID列表
+            before: 更新时间早于该时间的处理中文档视为卡住
+            error_message: 错误信息
+            
+        Returns:
+            标记为失败的文档数
+        """
+        count = 0
+        for start in range(0, len(document_ids), 500):
+            result = db.exec(
+                update(Document)
+                .where(
+                    Document.id.in_(document_ids[start:start + 500]),
+                    Document.status.in_(DOCUMENT_PROCESSING_STATUSES),
+                    func.coalesce(Document.updated_at, Document.created_at) < before
+                )
+                .values(status="failed", error_message=error_message, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            count += result.rowcount
+        db.commit()
+        return count
+    
+    def delete_by_ids(self, db: Session, *, document_ids: List[int]) -> int:
+        """批量删除文档记录（仅用于尚未入库、没有切片的文档）"""
+        count = 0
+        for start in range(0, len(document_ids), 500):
+            result = db.exec(delete(Document).where(Document.id.in_(document_ids[start:start + 500])))
+            count += result.rowcount
+        db.commit()
+        return count
+    
     def get_stats_by_kb(self, db: Session, *, kb_id: int) -> dict:
         """获取知识库文档统计"""
         # 总文档数
@@ -130,7 +219,7 @@ class CRUDDocument(CRUDBase[Document, dict, dict]):
         processing_docs = db.exec(
             select(func.count(Document.id)).where(
                 Document.knowledge_base_id == kb_id,
-                Document.status.in_(["pending", "processing"])
+                Document.status.in_(DOCUMENT_PROCESSING_STATUSES)
             )
         ).first()
         
@@ -158,6 +247,9 @@ class CRUDDocument(CRUDBase[Document, dict, dict]):
 class CRUDDocumentChunk(CRUDBase[DocumentChunk, dict, dict]):
     """文档切片CRUD操作"""
     
+    # 批量插入时每次executemany的行数
+    INSERT_BATCH_SIZE = 1000
+    
     def get_by_document(self, db: Session, *, document_id: int) -> List[DocumentChunk]:
         """获取文档的所有切片"""
         statement = select(DocumentChunk).where(
@@ -165,37 +257,109 @@ class CRUDDocumentChunk(CRUDBase[DocumentChunk, dict, dict]):
         ).order_by(DocumentChunk.chunk_index)
         return db.exec(statement).all()
     
+    def get_index_by_document(self, db: Session, *, document_id: int) -> List[Any]:
+        """
+        获取文档所有切片的比对字段（不含切片内容，增量重建索引使用）
+        
+        Returns:
+            按位置排序的行，包含id、chunk_index、content_hash、embedding_id、chunk_metadata
+        """
+        statement = select(
+            DocumentChunk.id,
+            DocumentChunk.chunk_index,
+            DocumentChunk.content_hash,
+            DocumentChunk.embedding_id,
+            DocumentChunk.chunk_metadata
+        ).where(
+            DocumentChunk.document_id == document_id
+        ).order_by(DocumentChunk.chunk_index)
+        return db.exec(statement).all()
+    
     def get_by_embedding_id(self, db: Session, *, embedding_id: str) -> Optional[DocumentChunk]:
         """根据嵌入ID获取切片"""
         statement = select(DocumentChunk).where(DocumentChunk.embedding_id == embedding_id)
         return db.exec(statement).first()
     
-    def create_chunks(self, db: Session, *, chunks_data: List[dict]) -> List[DocumentChunk]:
-        """批量创建文档切片"""
-        chunks = []
-        for chunk_data in chunks_data:
-            chunk = DocumentChunk(**chunk_data)
-            db.add(chunk)
-            chunks.append(chunk)
-        
-        db.commit()
-        for chunk in chunks:
-            db.refresh(chunk)
+    def _insert_chunks(self, db: Session, chunks_data: List[dict]) -> int:
+        """
+        分批批量插入切片（不提交）
         
-        return chunks
+        使用executemany，不逐行构造ORM对象、不回查；
+        created_at由模型的default_factory生成，批量插入时不会自动填充，这里统一补上。
+        """
+        now = datetime.utcnow()
+        for i in range(0, len(chunks_data), self.INSERT_BATCH_SIZE):
+            rows = [{"created_at": now, **chunk_data} for chunk_data in chunks_data[i:i + self.INSERT_BATCH_SIZE]]
+            db.exec(insert(DocumentChunk), params=rows)
+        return len(chunks_data)
     
-    def delete_by_document(self, db: Session, *, document_id: int) -> int:
-        """删除文档的所有切片"""
-        statement = select(DocumentChunk).where(DocumentChunk.document_id == document_id)
-        chunks = db.exec(statement).all()
+    def create_chunks(self, db: Session, *, chunks_data: List[dict]) -> int:
+        """
+        批量创建文档切片
         
-        count = len(chunks)
-        for chunk in chunks:
-            db.delete(chunk)
+        Args:
+            db: 数据库会话
+            chunks_data: 切片数据（各条字段需一致）
+            
+        Returns:
+            创建的切片数
+        """
+        if not chunks_data:
+            return 0
         
+        count = self._insert_chunks(db, chunks_data)
         db.commit()
         return count
     
+    def apply_changes(
+        self,
+        db: Session,
+        *,
+        document_id: int,
+        created: Iterable[dict],
+        updated: Iterable[dict],
+        deleted_ids: List[int]
+    ) -> None:
+        """
+        在一个事务中应用增量重建索引的切片变更
+        
+        新增和更新的切片可以是逐条读取的迭代器，按INSERT_BATCH_SIZE分批执行，
+        内存占用与切片总数无关；全部执行完后统一提交。
+        
+        Args:
+            db: 数据库会话
+            document_id: 文档ID
+            created: 新增切片数据
+            updated: 需要更新的切片字段（包含切片id）
+            deleted_ids: 需要删除的切片ID
+        """
+        updated = iter(updated)
+        while True:
+            batch = list(islice(updated, self.INSERT_BATCH_SIZE))
+            if not batch:
+                break
+            # 按主键批量更新
+            db.exec(update(DocumentChunk), params=batch)
+        
+        for i in range(0, len(deleted_ids), self.INSERT_BATCH_SIZE):
+            batch_ids = deleted_ids[i:i + self.INSERT_BATCH_SIZE]
+            db.exec(delete(DocumentChunk).where(DocumentChunk.id.in_(batch_ids)))
+        
+        created = iter(created)
+        while True:
+            batch = list(islice(created, self.INSERT_BATCH_SIZE))
+            if not batch:
+                break
+            self._insert_chunks(db, [{"document_id": document_id, **chunk_data} for chunk_data in batch])
+        
+        db.commit()
+    
+    def delete_by_document(self, db: Session, *, document_id: int) -> int:
+        """删除文档的所有切片（单条DELETE，返回删除的行数）"""
+        result = db.exec(delete(DocumentChunk).where(DocumentChunk.document_id == document_id))
+        db.commit()
+        return result.rowcount
+    
     def get_stats_by_kb(self, db: Session, *, kb_id: int) -> dict:
         """获取知识库切片统计"""
         # 通过JOIN查询获取知识库的切片统计
@@ -211,7 +375,30 @@ class CRUDDocumentChunk(CRUDBase[DocumentChunk, dict, dict]):
         }
 
 
+class CRUDIngestionBatch(CRUDBase[IngestionBatch, dict, dict]):
+    """批量入库任务CRUD操作"""
+    
+    def get_by_knowledge_base(self, db: Session, *, kb_id: int) -> List[IngestionBatch]:
+        """获取知识库下的批量入库任务（最新的在前）"""
+        statement = select(IngestionBatch).where(
+            IngestionBatch.knowledge_base_id == kb_id
+        ).order_by(IngestionBatch.id.desc())
+        return db.exec(statement).all()
+    
+    def update_batch(self, db: Session, *, batch_id: int, **fields) -> Optional[IngestionBatch]:
+        """更新批次字段"""
+        batch = self.get(db, batch_id)
+        if batch:
+            for key, value in fields.items():
+                setattr(batch, key, value)
+            db.add(batch)
+            db.commit()
+            db.refresh(batch)
+        return batch
+
+
 # 创建CRUD实例
 knowledge_base = CRUDKnowledgeBase(KnowledgeBase)
 document = CRUDDocument(Document)
 document_chunk = CRUDDocumentChunk(DocumentChunk)
+ingestion_batch = CRUDIngestionBatch(IngestionBatch)
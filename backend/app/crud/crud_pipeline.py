@@ -32,7 +32,8 @@ class CRUDCodeDiff(CRUDBase[CodeDiff, CodeDiffCreate, dict]):
         diff_id: int, 
         status: str, 
         diff_file_path: str = None,
-        error_message: str = None
+        error_message: str = None,
+        diff_metadata: dict = None
     ) -> Optional[CodeDiff]:
         """更新代码差异状态"""
         diff = self.get(db, diff_id)
@@ -42,6 +43,8 @@ class CRUDCodeDiff(CRUDBase[CodeDiff, CodeDiffCreate, dict]):
                 diff.diff_file_path = diff_file_path
             if error_message:
                 diff.error_message = error_message
+            if diff_metadata is not None:
+                diff.diff_metadata = {**(diff.diff_metadata or {}), **diff_metadata}
             db.add(diff)
             db.commit()
             db.refresh(diff)
@@ -6,7 +6,7 @@ from datetime import datetime
 from typing import Optional, List, Dict, Any
 from sqlmodel import Session, select, func
 from app.crud.base import CRUDBase
-from app.models.task import CodeDiffTask, RequirementParseTask, PipelineTask, TaskExecution
+from app.models.task import CodeDiffTask, RequirementParseTask, PipelineTask, TaskExecution, ReviewHunkResult
 from app.schemas.task import (
     CodeDiffTaskCreate, CodeDiffTaskUpdate,
     RequirementParseTaskCreate, RequirementParseTaskUpdate,
@@ -54,7 +54,8 @@ class CRUDCodeDiffTask(CRUDBase[CodeDiffTask, CodeDiffTaskCreate, CodeDiffTaskUp
         files_changed: int = None,
         lines_added: int = None,
         lines_deleted: int = None,
-        error_message: str = None
+        error_message: str = None,
+        task_metadata: dict = None
     ) -> Optional[CodeDiffTask]:
         """更新代码差异任务状态"""
         task = self.get(db, task_id)
@@ -72,6 +73,8 @@ class CRUDCodeDiffTask(CRUDBase[CodeDiffTask, CodeDiffTaskCreate, CodeDiffTaskUp
                 task.lines_deleted = lines_deleted
             if error_message:
                 task.error_message = error_message
+            if task_metadata is not None:
+                task.task_metadata = {**(task.task_metadata or {}), **task_metadata}
             db.add(task)
             db.commit()
             db.refresh(task)
@@ -370,8 +373,70 @@ class CRUDTaskExecution(CRUDBase[TaskExecution, dict, dict]):
         return execution
 
 
+class CRUDReviewHunkResult(CRUDBase[ReviewHunkResult, dict, dict]):
+    """差异块评审结果CRUD操作"""
+    
+    def get_by_hashes(
+        self, 
+        db: Session, 
+        *, 
+        repository_id: Optional[int],
+        context_hash: str,
+        hunk_hashes: List[str]
+    ) -> Dict[str, ReviewHunkResult]:
+        """按差异块哈希批量获取评审结果"""
+        if not hunk_hashes:
+            return {}
+        statement = select(ReviewHunkResult).where(
+            ReviewHunkResult.repository_id == repository_id,
+            ReviewHunkResult.context_hash == context_hash,
+            ReviewHunkResult.hunk_hash.in_(hunk_hashes)
+        )
+        return {row.hunk_hash: row for row in db.exec(statement).all()}
+    
+    def save_results(
+        self, 
+        db: Session, 
+        *, 
+        repository_id: Optional[int],
+        context_hash: str,
+        results: List[Dict[str, Any]]
+    ) -> int:
+        """
+        批量保存差异块评审结果，已存在的哈希覆盖更新
+        
+        Args:
+            results: 包含hunk_hash、file_path、new_start、tokens、findings等字段的字典列表
+            
+        Returns:
+            保存的记录数
+        """
+        if not results:
+            return 0
+        
+        existing = self.get_by_hashes(
+            db,
+            repository_id=repository_id,
+            context_hash=context_hash,
+            hunk_hashes=[item["hunk_hash"] for item in results]
+        )
+        for item in results:
+            row = existing.get(item["hunk_hash"])
+            if row is None:
+                row = ReviewHunkResult(repository_id=repository_id, context_hash=context_hash, **item)
+                existing[item["hunk_hash"]] = row
+            else:
+                for field, value in item.items():
+                    setattr(row, field, value)
+                row.updated_at = datetime.utcnow()
+            db.add(row)
+        db.commit()
+        return len(results)
+
+
 # 创建CRUD实例
 code_diff_task = CRUDCodeDiffTask(CodeDiffTask)
 requirement_parse_task = CRUDRequirementParseTask(RequirementParseTask)
 pipeline_task = CRUDPipelineTask(PipelineTask)
 task_execution = CRUDTaskExecution(TaskExecution)
+review_hunk_result = CRUDReviewHunkResult(ReviewHunkResult)
@@ -1,13 +1,23 @@
 """
 FastAPI应用主入口
 """
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.core.database import create_db_and_tables
+from app.core.llm_client import llm_manager
 from app.api.v1.api import api_router
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期管理"""
+    yield
+    # 关闭LLM长连接池
+    await llm_manager.aclose()
+
+
 def create_application() -> FastAPI:
     """创建FastAPI应用实例"""
     
@@ -17,6 +27,7 @@ def create_application() -> FastAPI:
         openapi_url=f"{settings.API_V1_STR}/openapi.json",
         docs_url=f"{settings.API_V1_STR}/docs",
         redoc_url=f"{settings.API_V1_STR}/redoc",
+        lifespan=lifespan,
     )
     
     # 添加CORS中间件
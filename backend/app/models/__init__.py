@@ -4,9 +4,9 @@
 from .base import BaseModel
 from .git import GlobalGitCredential, Repository
 from .prompt import PromptTemplate
-from .knowledge_base import KnowledgeBase, Document, DocumentChunk
+from .knowledge_base import KnowledgeBase, Document, DocumentChunk, IngestionBatch
 from .pipeline import CodeDiff, RequirementText
-from .task import CodeDiffTask, RequirementParseTask, PipelineTask, TaskExecution
+from .task import CodeDiffTask, RequirementParseTask, PipelineTask, TaskExecution, ReviewHunkResult
 from .user import User, UserSession, UserLoginLog
 from .ai_model import AIModelConfig, AIModelTestResult
 from .conversation import Conversation, Message
@@ -19,12 +19,14 @@ __all__ = [
     "KnowledgeBase",
     "Document",
     "DocumentChunk",
+    "IngestionBatch",
     "CodeDiff",
     "RequirementText",
     "PipelineTask",
     "TaskExecution",
     "CodeDiffTask",
     "RequirementParseTask",
+    "ReviewHunkResult",
     "User",
     "UserSession",
     "UserLoginLog",
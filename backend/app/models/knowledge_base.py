@@ -14,7 +14,7 @@ class KnowledgeBase(BaseModel, table=True):
     name: str = Field(description="知识库名称")
     description: Optional[str] = Field(default=None, description="知识库描述")
     collection_name: str = Field(description="ChromaDB集合名称", unique=True, index=True)
-    embedding_model: str = Field(default="text-embedding-ada-002", description="嵌入模型")
+    embedding_model: str = Field(default="chroma-default", description="嵌入模型（默认chroma-default为本地内置模型；text-embedding-*走OpenAI兼容接口，需配置EMBEDDING_API_KEY或LLM_API_KEY）")
     chunk_size: int = Field(default=1000, description="文档切片大小")
     chunk_overlap: int = Field(default=200, description="切片重叠大小")
     is_active: bool = Field(default=True, description="是否激活")
@@ -26,7 +26,7 @@ class KnowledgeBase(BaseModel, table=True):
                     "name": "技术文档库",
                     "description": "存储技术文档和API文档",
                     "collection_name": "tech_docs_collection",
-                    "embedding_model": "text-embedding-ada-002",
+                    "embedding_model": "chroma-default",
                     "chunk_size": 1000,
                     "chunk_overlap": 200,
                     "is_active": True
@@ -48,7 +48,7 @@ class Document(BaseModel, table=True):
     file_size: int = Field(description="文件大小（字节）")
     file_type: str = Field(description="文件类型")
     content_hash: str = Field(description="文件内容哈希", index=True)
-    status: str = Field(default="pending", description="处理状态：pending, processing, completed, failed")
+    status: str = Field(default="pending", description="处理状态：pending, loading, splitting, embedding, persisting, completed, failed")
     error_message: Optional[str] = Field(default=None, description="错误信息")
     doc_metadata: Optional[dict] = Field(sa_column=Column(JSON), default=None, description="文档元数据")
     
@@ -106,3 +106,36 @@ class DocumentChunk(BaseModel, table=True):
             ]
         }
     }
+
+
+class IngestionBatch(BaseModel, table=True):
+    """批量入库任务模型"""
+    
+    __tablename__ = "ingestion_batches"
+    
+    knowledge_base_id: int = Field(foreign_key="knowledge_bases.id", description="所属知识库ID")
+    source_type: str = Field(description="来源类型：archive, directory")
+    source: str = Field(description="来源（压缩包文件名或服务器目录）")
+    status: str = Field(default="pending", description="状态：pending, preparing, running, completed, failed")
+    total_files: int = Field(default=0, description="待入库文件数（去重后）")
+    skipped_files: int = Field(default=0, description="跳过的文件数（重复或不支持的类型）")
+    dispatched: int = Field(default=0, description="已提交入库流水线的文件数")
+    document_ids: Optional[list] = Field(sa_column=Column(JSON), default=None, description="本批次创建的文档ID")
+    error_message: Optional[str] = Field(default=None, description="错误信息")
+    batch_metadata: Optional[dict] = Field(sa_column=Column(JSON), default=None, description="批次元数据")
+    
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "knowledge_base_id": 1,
+                    "source_type": "archive",
+                    "source": "docs.zip",
+                    "status": "running",
+                    "total_files": 1200,
+                    "skipped_files": 35,
+                    "dispatched": 64
+                }
+            ]
+        }
+    }
@@ -250,3 +250,27 @@ class TaskExecution(BaseModel, table=True):
             ]
         }
     }
+
+
+class ReviewHunkResult(BaseModel, table=True):
+    """差异块评审结果模型（用于增量代码评审）"""
+    
+    __tablename__ = "review_hunk_results"
+    
+    repository_id: Optional[int] = Field(default=None, index=True, description="仓库ID")
+    file_path: str = Field(description="文件路径")
+    
+    # 内容哈希：文件路径 + 差异块内容（不含@@行号），差异块平移后仍可命中
+    hunk_hash: str = Field(index=True, description="差异块内容哈希")
+    # 评审上下文哈希：需求、关注方面、模型等，任一变化都需要重新评审
+    context_hash: str = Field(index=True, description="评审上下文哈希")
+    
+    # 评审时差异块在新文件中的起始行，复用时据此平移问题行号
+    new_start: int = Field(default=0, description="新文件起始行号")
+    tokens: int = Field(default=0, description="差异块token数")
+    
+    # 归属于该差异块的评审结果
+    findings: Optional[dict] = Field(sa_column=Column(JSON), default=None, description="评审结果")
+    
+    pipeline_task_id: Optional[int] = Field(default=None, description="产生该结果的流水线任务ID")
+    llm_model: Optional[str] = Field(default=None, description="使用的LLM模型")
@@ -10,7 +10,7 @@ class KnowledgeBaseCreate(BaseModel):
     """创建知识库的请求模式"""
     name: str = Field(..., description="知识库名称")
     description: Optional[str] = Field(None, description="知识库描述")
-    embedding_model: str = Field("text-embedding-ada-002", description="嵌入模型")
+    embedding_model: str = Field("chroma-default", description="嵌入模型（默认chroma-default为本地内置模型；text-embedding-*走OpenAI兼容接口，需配置EMBEDDING_API_KEY或LLM_API_KEY）")
     chunk_size: int = Field(1000, description="文档切片大小", ge=100, le=4000)
     chunk_overlap: int = Field(200, description="切片重叠大小", ge=0, le=1000)
     
@@ -20,7 +20,7 @@ class KnowledgeBaseCreate(BaseModel):
                 {
                     "name": "技术文档库",
                     "description": "存储技术文档和API文档",
-                    "embedding_model": "text-embedding-ada-002",
+                    "embedding_model": "chroma-default",
                     "chunk_size": 1000,
                     "chunk_overlap": 200
                 }
@@ -175,6 +175,26 @@ class DocumentProcessingStatus(BaseModel):
     total_chunks: Optional[int] = Field(None, description="总切片数量")
 
 
+class IngestionBatchResponse(BaseModel):
+    """批量入库任务响应模式"""
+    id: int
+    knowledge_base_id: int
+    source_type: str
+    source: str
+    status: str
+    total_files: int
+    skipped_files: int
+    dispatched: int
+    completed_documents: int = Field(default=0, description="已完成的文档数")
+    failed_documents: int = Field(default=0, description="失败的文档数")
+    processing_documents: int = Field(default=0, description="等待或正在处理的文档数")
+    progress: float = Field(default=0.0, description="处理进度 0-100")
+    error_message: Optional[str] = None
+    batch_metadata: Optional[Dict[str, Any]] = None
+    created_at: datetime
+    updated_at: Optional[datetime]
+
+
 class KnowledgeBaseStats(BaseModel):
     """知识库统计信息"""
     knowledge_base_id: int
@@ -14,6 +14,8 @@ class CodeDiffTaskCreate(BaseModel):
     repository_id: int = Field(..., description="仓库ID")
     base_ref: str = Field(..., description="基准分支/提交")
     head_ref: str = Field(..., description="目标分支/提交")
+    path_filters: Optional[List[str]] = Field(None, description="只比较这些路径（git pathspec），保存在任务元数据中")
+    diff_mode: Optional[str] = Field(None, description="差异模式：mirror, partial，默认使用系统配置")
     task_metadata: Optional[Dict[str, Any]] = Field(None, description="任务元数据")
     
     model_config = {
@@ -24,6 +26,7 @@ class CodeDiffTaskCreate(BaseModel):
                     "repository_id": 1,
                     "base_ref": "main",
                     "head_ref": "feature/login-enhancement",
+                    "path_filters": ["src/auth/"],
                     "task_metadata": {
                         "description": "优化用户登录流程",
                         "reviewer": "张三"
@@ -0,0 +1,589 @@
+"""
+代码评审服务
+将大型差异按文件/差异块拆分为符合token预算的评审单元，并发评审后合并结果
+"""
+import re
+import json
+import time
+import hashlib
+from typing import List, Dict, Any, Optional, Tuple
+from sqlmodel import Session
+from app.core.config import settings
+from app.core.diff_utils import DiffHunk, FileDiff, parse_unified_diff
+from app.core.llm_client import llm_manager, LLMResponse
+from app.core.tokenizer import count_tokens
+from app.crud.crud_task import review_hunk_result
+from app.schemas.pipeline import CodeReviewResult
+
+
+SEVERITY_ORDER = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+
+# 评审prompt或结果结构变化时递增，使历史差异块结果失效
+REVIEW_PROMPT_VERSION = 1
+
+# 差异为空或只包含二进制文件改动时的评审摘要
+NO_REVIEWABLE_CHANGES = "无可评审的文本改动"
+
+
+class ReviewUnit:
+    """评审单元：一次LLM调用评审的若干文件差异块"""
+
+    def __init__(self):
+        # (文件差异, 差异块列表)
+        self.parts: List[Tuple[FileDiff, List[DiffHunk]]] = []
+        self.tokens = 0
+
+    @property
+    def files(self) -> List[str]:
+        return [file_diff.path for file_diff, _ in self.parts]
+
+    @property
+    def text(self) -> str:
+        return "\n".join(
+            "\n".join([file_diff.header] + [hunk.text for hunk in hunks])
+            for file_diff, hunks in self.parts
+        )
+
+    def add(self, file_diff: FileDiff, hunks: List[DiffHunk], tokens: int):
+        self.parts.append((file_diff, hunks))
+        self.tokens += tokens
+
+
+class ReviewOutcome:
+    """评审结果汇总"""
+
+    def __init__(
+        self,
+        result: Dict[str, Any],
+        model: str,
+        tokens_used: int,
+        processing_time: float,
+        units_total: int,
+        units_failed: int,
+        cache_hits: int,
+        errors: List[str],
+        hunks_reused: int = 0,
+        hunks_reviewed: int = 0
+    ):
+        self.result = result
+        self.model = model
+        self.tokens_used = tokens_used
+        self.processing_time = processing_time
+        self.units_total = units_total
+        self.units_failed = units_failed
+        self.cache_hits = cache_hits
+        self.errors = errors
+        self.hunks_reused = hunks_reused
+        self.hunks_reviewed = hunks_reviewed
+
+    @property
+    def success(self) -> bool:
+        return bool(self.result)
+
+    def stats(self) -> Dict[str, Any]:
+        """评审统计，写入resources_used"""
+        return {
+            "review_units": self.units_total,
+            "review_units_failed": self.units_failed,
+            "review_cache_hits": self.cache_hits,
+            "review_hunks_reused": self.hunks_reused,
+            "review_hunks_reviewed": self.hunks_reviewed
+        }
+
+    def to_llm_response(self) -> LLMResponse:
+        """转换为LLMResponse，兼容单次调用的处理流程"""
+        return LLMResponse(
+            content=json.dumps(self.result, ensure_ascii=False) if self.success else "",
+            model=self.model,
+            tokens_used=self.tokens_used,
+            processing_time=self.processing_time,
+            success=self.success,
+            error_message=None if self.success else "; ".join(self.errors) or "没有可评审的代码差异",
+            # 没有任何评审单元和复用结果（无可评审改动）时不算缓存命中
+            cached=self.success and bool(self.units_total or self.hunks_reused) and self.cache_hits == self.units_total
+        )
+
+
+class CodeReviewService:
+    """代码评审服务类"""
+
+    # 单个评审单元中prompt模板本身占用的token预留
+    PROMPT_OVERHEAD_TOKENS = 600
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """计算token数"""
+        return count_tokens(text) + 1
+
+    def build_review_units(self, files: List[FileDiff], token_budget: int) -> List[ReviewUnit]:
+        """
+        将文件差异打包为评审单元
+
+        小文件合并到同一单元；超出预算的文件按差异块拆分，
+        单个差异块仍超出预算时按行拆分。
+
+        Args:
+            files: 文件差异列表
+            token_budget: 每个评审单元的差异token预算
+
+        Returns:
+            评审单元列表
+        """
+        units: List[ReviewUnit] = []
+        current = ReviewUnit()
+
+        def flush():
+            nonlocal current
+            if current.parts:
+                units.append(current)
+                current = ReviewUnit()
+
+        for file_diff in files:
+            if file_diff.is_binary or not file_diff.hunks:
+                continue
+
+            file_tokens = self._estimate_tokens(file_diff.text)
+            if file_tokens <= token_budget:
+                if current.tokens + file_tokens > token_budget:
+                    flush()
+                current.add(file_diff, file_diff.hunks, file_tokens)
+                continue
+
+            # 大文件：按差异块拆分，每个单元携带文件头
+            flush()
+            header_tokens = self._estimate_tokens(file_diff.header)
+            hunk_budget = max(token_budget - header_tokens, 1)
+            hunks: List[DiffHunk] = []
+            hunks_tokens = 0
+
+            for hunk in file_diff.hunks:
+                for piece in self._split_hunk(hunk, hunk_budget):
+                    piece_tokens = self._estimate_tokens(piece.text)
+                    if hunks and hunks_tokens + piece_tokens > hunk_budget:
+                        current.add(file_diff, hunks, header_tokens + hunks_tokens)
+                        flush()
+                        hunks, hunks_tokens = [], 0
+                    hunks.append(piece)
+                    hunks_tokens += piece_tokens
+
+            if hunks:
+                current.add(file_diff, hunks, header_tokens + hunks_tokens)
+                flush()
+
+        flush()
+        return units
+
+    def _split_hunk(self, hunk: DiffHunk, token_budget: int) -> List[DiffHunk]:
+        """按token预算拆分超大差异块"""
+        hunk_tokens = self._estimate_tokens(hunk.text)
+        if hunk_tokens <= token_budget:
+            return [hunk]
+        average_line_tokens = max(hunk_tokens / max(len(hunk.lines), 1), 1)
+        max_lines = max(int(token_budget / average_line_tokens), 1)
+        return hunk.split(max_lines)
+
+    @staticmethod
+    def parse_review_json(content: str) -> Optional[Dict[str, Any]]:
+        """
+        从LLM输出中提取评审JSON
+
+        兼容```json代码块包裹以及JSON前后的说明文字。
+        """
+        if not content:
+            return None
+
+        text = content.strip()
+        fenced = re.search(r'```(?:json)?\s*(.*?)```', text, re.DOTALL)
+        if fenced:
+            text = fenced.group(1).strip()
+
+        try:
+            data = json.loads(text)
+            return data if isinstance(data, dict) else None
+        except json.JSONDecodeError:
+            pass
+
+        start, end = text.find('{'), text.rfind('}')
+        if start == -1 or end <= start:
+            return None
+        try:
+            data = json.loads(text[start:end + 1])
+            return data if isinstance(data, dict) else None
+        except json.JSONDecodeError:
+            return None
+
+    @staticmethod
+    def _to_number(value: Any) -> Optional[float]:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def merge_results(self, partials: List[Tuple[Dict[str, Any], int, List[str]]]) -> Dict[str, Any]:
+        """
+        合并各评审单元的结果
+
+        问题列表拼接去重；建议去重；安全评分取最低；质量评分按单元大小加权平均；
+        圈复杂度取最大、可维护性指数取最小。
+
+        Args:
+            partials: (评审结果, 单元token数, 单元文件列表)列表
+
+        Returns:
+            合并后的评审结果
+        """
+        issues: List[Dict[str, Any]] = []
+        seen_issues = set()
+        suggestions: List[str] = []
+        positive_aspects: List[str] = []
+        summaries: List[str] = []
+        security_scores: List[float] = []
+        quality_weighted = 0.0
+        quality_weight = 0
+        cyclomatic: List[float] = []
+        maintainability: List[float] = []
+
+        for data, weight, unit_files in partials:
+            for issue in data.get("issues") or []:
+                if not isinstance(issue, dict):
+                    continue
+                if not issue.get("file") and len(unit_files) == 1:
+                    issue["file"] = unit_files[0]
+                key = (issue.get("file"), issue.get("line"), issue.get("description"))
+                if key in seen_issues:
+                    continue
+                seen_issues.add(key)
+                issues.append(issue)
+
+            for item in data.get("suggestions") or []:
+                if item and item not in suggestions:
+                    suggestions.append(item)
+            for item in data.get("positive_aspects") or []:
+                if item and item not in positive_aspects:
+                    positive_aspects.append(item)
+
+            if data.get("summary") and str(data["summary"]) not in summaries:
+                summaries.append(str(data["summary"]))
+
+            security = self._to_number(data.get("security_score"))
+            if security is not None:
+                security_scores.append(security)
+            quality = self._to_number(data.get("quality_score"))
+            if quality is not None:
+                quality_weighted += quality * weight
+                quality_weight += weight
+
+            complexity = data.get("complexity_analysis") or {}
+            if isinstance(complexity, dict):
+                value = self._to_number(complexity.get("cyclomatic_complexity"))
+                if value is not None:
+                    cyclomatic.append(value)
+                value = self._to_number(complexity.get("maintainability_index"))
+                if value is not None:
+                    maintainability.append(value)
+
+        issues.sort(key=lambda item: SEVERITY_ORDER.get(str(item.get("severity", "")).lower(), len(SEVERITY_ORDER)))
+
+        if len(summaries) == 1:
+            summary = summaries[0]
+        else:
+            summary = f"共评审{len(partials)}个代码块，发现{len(issues)}个问题"
+            if summaries:
+                summary += "：\n" + "\n".join(f"- {item}" for item in summaries)
+
+        complexity_analysis = {}
+        if cyclomatic:
+            complexity_analysis["cyclomatic_complexity"] = max(cyclomatic)
+        if maintainability:
+            complexity_analysis["maintainability_index"] = min(maintainability)
+
+        result = CodeReviewResult(
+            summary=summary,
+            issues=issues,
+            suggestions=suggestions,
+            security_score=int(min(security_scores)) if security_scores else None,
+            quality_score=round(quality_weighted / quality_weight) if quality_weight else None,
+            complexity_analysis=complexity_analysis or None
+        ).model_dump()
+        result["positive_aspects"] = positive_aspects
+        return result
+
+    @staticmethod
+    def _context_hash(
+        requirements: str,
+        focus_areas: Optional[List[str]],
+        model_identity: str,
+        llm_params: Dict[str, Any]
+    ) -> str:
+        """评审上下文哈希：需求、关注方面、模型或参数变化时历史结果失效"""
+        payload = json.dumps(
+            {
+                "version": REVIEW_PROMPT_VERSION,
+                "requirements": requirements or "",
+                "focus_areas": focus_areas or [],
+                "model": model_identity,
+                "params": llm_params
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _prepare_files(self, files: List[FileDiff], token_budget: int) -> List[FileDiff]:
+        """预先拆分超大差异块，保证复用查找与评审单元使用相同的差异块划分"""
+        for file_diff in files:
+            hunk_budget = max(token_budget - self._estimate_tokens(file_diff.header), 1)
+            hunks = []
+            for hunk in file_diff.hunks:
+                hunks.extend(self._split_hunk(hunk, hunk_budget))
+            file_diff.hunks = hunks
+        return files
+
+    @staticmethod
+    def _shift_findings(findings: Dict[str, Any], offset: int) -> Dict[str, Any]:
+        """按差异块平移量修正历史问题的行号"""
+        data = dict(findings)
+        issues = []
+        for issue in findings.get("issues") or []:
+            issue = dict(issue)
+            if offset and isinstance(issue.get("line"), int):
+                issue["line"] += offset
+            issues.append(issue)
+        data["issues"] = issues
+        return data
+
+    def _reuse_findings(
+        self,
+        db: Session,
+        files: List[FileDiff],
+        repository_id: Optional[int],
+        context_hash: str
+    ) -> Tuple[List[FileDiff], List[Tuple[Dict[str, Any], int, List[str]]]]:
+        """
+        复用未变化差异块的历史评审结果
+
+        Returns:
+            (仍需评审的文件差异列表, 复用的评审结果列表)
+        """
+        hunk_hashes = [
+            hunk.content_hash(file_diff.path)
+            for file_diff in files
+            for hunk in file_diff.hunks
+        ]
+        rows = review_hunk_result.get_by_hashes(
+            db,
+            repository_id=repository_id,
+            context_hash=context_hash,
+            hunk_hashes=list(set(hunk_hashes))
+        )
+
+        remaining_files = []
+        reused = []
+        for file_diff in files:
+            pending = []
+            for hunk in file_diff.hunks:
+                row = rows.get(hunk.content_hash(file_diff.path))
+                if row is None or row.findings is None:
+                    pending.append(hunk)
+                    continue
+                reused.append((
+                    self._shift_findings(row.findings, hunk.new_start - row.new_start),
+                    row.tokens or 1,
+                    [file_diff.path]
+                ))
+
+            if pending:
+                remaining = FileDiff(file_diff.old_path, file_diff.new_path)
+                remaining.header_lines = file_diff.header_lines
+                remaining.is_binary = file_diff.is_binary
+                remaining.hunks = pending
+                remaining_files.append(remaining)
+
+        return remaining_files, reused
+
+    @staticmethod
+    def _locate_issue(issue: Dict[str, Any], hunks: List[Tuple[FileDiff, DiffHunk]]) -> int:
+        """按文件名和行号确定问题所属的差异块"""
+        issue_file = str(issue.get("file") or "")
+        candidates = [
+            index for index, (file_diff, _) in enumerate(hunks)
+            if issue_file and (file_diff.path == issue_file
+                               or file_diff.path.endswith(issue_file)
+                               or issue_file.endswith(file_diff.path))
+        ] or list(range(len(hunks)))
+
+        line = issue.get("line")
+        if not isinstance(line, int):
+            return candidates[0]
+
+        for index in candidates:
+            hunk = hunks[index][1]
+            if hunk.new_start <= line < hunk.new_start + max(hunk.new_lines, 1):
+                return index
+        return min(candidates, key=lambda index: abs(hunks[index][1].new_start - line))
+
+    def _hunk_records(
+        self,
+        unit: ReviewUnit,
+        data: Dict[str, Any],
+        llm_model: str,
+        pipeline_task_id: Optional[int]
+    ) -> List[Dict[str, Any]]:
+        """将评审单元的结果拆分到各差异块，用于持久化"""
+        hunks = [(file_diff, hunk) for file_diff, unit_hunks in unit.parts for hunk in unit_hunks]
+        issues_by_hunk: Dict[int, List[Dict[str, Any]]] = {index: [] for index in range(len(hunks))}
+        for issue in data.get("issues") or []:
+            if isinstance(issue, dict):
+                issues_by_hunk[self._locate_issue(issue, hunks)].append(issue)
+
+        # 摘要、建议和评分属于整个评审单元，每个差异块各保存一份，合并时去重
+        shared = {
+            key: data.get(key)
+            for key in ("summary", "suggestions", "positive_aspects",
+                        "security_score", "quality_score", "complexity_analysis")
+        }
+
+        return [
+            {
+                "hunk_hash": hunk.content_hash(file_diff.path),
+                "file_path": file_diff.path,
+                "new_start": hunk.new_start,
+                "tokens": self._estimate_tokens(hunk.text),
+                "findings": {**shared, "issues": issues_by_hunk[index]},
+                "pipeline_task_id": pipeline_task_id,
+                "llm_model": llm_model
+            }
+            for index, (file_diff, hunk) in enumerate(hunks)
+        ]
+
+    async def review_diff(
+        self,
+        code_diff: str,
+        requirements: str = "",
+        focus_areas: List[str] = None,
+        client_type: str = None,
+        model_config=None,
+        token_budget: Optional[int] = None,
+        deadline: Optional[float] = None,
+        db: Optional[Session] = None,
+        repository_id: Optional[int] = None,
+        pipeline_task_id: Optional[int] = None,
+        **kwargs
+    ) -> ReviewOutcome:
+        """
+        评审代码差异（map-reduce）
+
+        传入db时启用增量评审：内容未变化的差异块直接复用历史结果，
+        只有新增或变化的差异块发送给LLM，评审结果按差异块保存供后续复用。
+
+        Args:
+            code_diff: 统一差异格式文本
+            requirements: 相关需求
+            focus_areas: 关注方面
+            client_type: 客户端类型
+            model_config: AIModelConfig对象
+            token_budget: 每个评审单元的差异token预算
+            deadline: 整体截止时间（秒）
+            db: 数据库会话，为None时不启用增量评审
+            repository_id: 仓库ID，历史结果按仓库隔离
+            pipeline_task_id: 流水线任务ID
+
+        Returns:
+            评审结果汇总
+        """
+        start_time = time.time()
+        token_budget = token_budget or settings.CODE_REVIEW_CHUNK_TOKENS
+        diff_budget = max(token_budget - self.PROMPT_OVERHEAD_TOKENS - self._estimate_tokens(requirements or ""), 256)
+
+        files = [
+            file_diff for file_diff in parse_unified_diff(code_diff)
+            if file_diff.hunks and not file_diff.is_binary
+        ]
+        if not files:
+            # 空差异或只有二进制文件改动：没有需要LLM评审的内容，直接返回成功的空评审
+            result = CodeReviewResult(summary=NO_REVIEWABLE_CHANGES, issues=[], suggestions=[]).model_dump()
+            result["positive_aspects"] = []
+            return ReviewOutcome(
+                result=result,
+                model="unknown",
+                tokens_used=0,
+                processing_time=time.time() - start_time,
+                units_total=0,
+                units_failed=0,
+                cache_hits=0,
+                errors=[]
+            )
+        files = self._prepare_files(files, diff_budget)
+
+        reused: List[Tuple[Dict[str, Any], int, List[str]]] = []
+        context_hash = None
+        if db is not None:
+            context_hash = self._context_hash(
+                requirements, focus_areas,
+                llm_manager.get_model_identity(client_type, model_config),
+                kwargs
+            )
+            files, reused = self._reuse_findings(db, files, repository_id, context_hash)
+
+        units = self.build_review_units(files, diff_budget)
+        responses: List[LLMResponse] = []
+        if units:
+            prompts = [
+                llm_manager.build_review_prompt(unit.text, requirements, focus_areas)
+                for unit in units
+            ]
+            responses = await llm_manager.batch_completion(
+                prompts,
+                client_type=client_type,
+                model_config=model_config,
+                deadline=deadline,
+                **kwargs
+            )
+
+        partials = []
+        errors = []
+        records = []
+        for unit, response in zip(units, responses):
+            if not response.success:
+                errors.append(f"{', '.join(unit.files)}: {response.error_message}")
+                continue
+            data = self.parse_review_json(response.content)
+            if data is None:
+                errors.append(f"{', '.join(unit.files)}: 评审结果不是有效的JSON")
+                continue
+            partials.append((data, unit.tokens, unit.files))
+            if context_hash:
+                records.extend(self._hunk_records(unit, data, response.model, pipeline_task_id))
+
+        if records:
+            try:
+                review_hunk_result.save_results(
+                    db, repository_id=repository_id, context_hash=context_hash, results=records
+                )
+            except Exception as e:
+                db.rollback()
+                print(f"保存差异块评审结果失败: {e}")
+
+        partials = reused + partials
+        result = self.merge_results(partials) if partials else {}
+        if partials and errors:
+            # 部分单元失败时保留已完成的评审，并标注未覆盖的文件
+            result["review_errors"] = errors
+
+        return ReviewOutcome(
+            result=result,
+            model=next((response.model for response in responses if response.model), "unknown"),
+            tokens_used=sum(response.tokens_used for response in responses),
+            processing_time=time.time() - start_time,
+            units_total=len(units),
+            units_failed=len(errors),
+            cache_hits=sum(1 for response in responses if response.cached),
+            errors=errors,
+            hunks_reused=len(reused),
+            hunks_reviewed=sum(len(hunks) for unit in units for _, hunks in unit.parts)
+        )
+
+
+# 创建全局代码评审服务实例
+code_review_service = CodeReviewService()
@@ -0,0 +1,338 @@
+"""
+差异内容分页服务
+基于逐文件差异索引按文件分页读取，并为原始差异提供Range/ETag/gzip支持
+"""
+import os
+import re
+import zlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from fastapi import HTTPException, Request, status
+from fastapi.responses import Response, StreamingResponse
+from app.core.config import settings
+from app.core.diff_utils import load_diff_index, read_diff_range
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class DiffContentService:
+    """差异内容服务类"""
+
+    # 进程内缓存的已解析索引数量
+    INDEX_CACHE_SIZE = 32
+
+    def __init__(self):
+        self._index_cache: "OrderedDict[Tuple[str, float, int], dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def ensure_file(diff_path: Optional[str]):
+        """差异文件不存在时返回404"""
+        if not diff_path or not os.path.exists(diff_path):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="差异文件不存在"
+            )
+
+    @staticmethod
+    def etag(diff_path: str) -> str:
+        """基于文件大小和修改时间的ETag"""
+        stat = os.stat(diff_path)
+        return f'"{stat.st_size:x}-{int(stat.st_mtime * 1000):x}"'
+
+    def get_index(self, diff_path: str) -> dict:
+        """
+        获取差异索引（缺失时流式构建，解析结果按文件版本缓存）
+
+        Args:
+            diff_path: 差异文件路径
+
+        Returns:
+            差异索引
+        """
+        stat = os.stat(diff_path)
+        key = (diff_path, stat.st_mtime, stat.st_size)
+        with self._lock:
+            index = self._index_cache.get(key)
+            if index is not None:
+                self._index_cache.move_to_end(key)
+                return index
+
+        index = load_diff_index(diff_path)
+        with self._lock:
+            self._index_cache[key] = index
+            while len(self._index_cache) > self.INDEX_CACHE_SIZE:
+                self._index_cache.popitem(last=False)
+        return index
+
+    @staticmethod
+    def _file_summary(position: int, entry: dict) -> Dict[str, Any]:
+        return {
+            "index": position,
+            "path": entry["path"],
+            "old_path": entry["old_path"],
+            "new_path": entry["new_path"],
+            "offset": entry["offset"],
+            "length": entry["length"],
+            "lines_added": entry["added"],
+            "lines_deleted": entry["deleted"],
+            "hunks": len(entry["hunks"]),
+            "is_binary": entry["is_binary"]
+        }
+
+    def list_files(
+        self,
+        diff_path: str,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        path: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        分页列出差异中的文件
+
+        Args:
+            diff_path: 差异文件路径
+            offset: 起始文件序号
+            limit: 返回数量
+            path: 按路径子串过滤
+
+        Returns:
+            文件列表及分页信息
+        """
+        index = self.get_index(diff_path)
+        limit = limit or settings.DIFF_PAGE_SIZE
+        entries = [
+            (position, entry) for position, entry in enumerate(index["files"])
+            if not path or path in entry["path"]
+        ]
+        page = entries[offset:offset + limit]
+        next_offset = offset + len(page)
+
+        return {
+            "files": [self._file_summary(position, entry) for position, entry in page],
+            "total_files": len(entries),
+            "offset": offset,
+            "next_offset": next_offset if next_offset < len(entries) else None,
+            "stats": {
+                "files_changed": index["files_changed"],
+                "lines_added": index["lines_added"],
+                "lines_deleted": index["lines_deleted"]
+            },
+            "total_bytes": index["total_bytes"]
+        }
+
+    def get_file(self, diff_path: str, file_index: int) -> Dict[str, Any]:
+        """
+        读取单个文件的差异内容
+
+        Args:
+            diff_path: 差异文件路径
+            file_index: 文件在索引中的序号
+
+        Returns:
+            文件差异内容及差异块信息
+        """
+        index = self.get_index(diff_path)
+        if file_index < 0 or file_index >= len(index["files"]):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="差异文件中不存在该文件"
+            )
+
+        entry = index["files"][file_index]
+        result = self._file_summary(file_index, entry)
+        result["hunks"] = [
+            {
+                "offset": hunk[0],
+                "length": hunk[1],
+                "old_start": hunk[2],
+                "old_lines": hunk[3],
+                "new_start": hunk[4],
+                "new_lines": hunk[5],
+                "lines_added": hunk[6],
+                "lines_deleted": hunk[7]
+            }
+            for hunk in entry["hunks"]
+        ]
+        result["content"] = read_diff_range(diff_path, entry["offset"], entry["length"])
+        return result
+
+    def read_page(self, diff_path: str, offset: int = 0, limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        按文件分页读取差异内容
+
+        每页最多limit个文件，且内容不超过DIFF_PAGE_MAX_BYTES（至少包含一个文件），
+        超大单文件可通过原始差异接口按Range读取。
+
+        Args:
+            diff_path: 差异文件路径
+            offset: 起始文件序号
+            limit: 最多返回的文件数
+
+        Returns:
+            本页差异内容及分页信息
+        """
+        index = self.get_index(diff_path)
+        limit = limit or settings.DIFF_PAGE_SIZE
+        files = index["files"]
+
+        page: List[Tuple[int, dict]] = []
+        page_bytes = 0
+        for position in range(offset, min(len(files), offset + limit)):
+            entry = files[position]
+            if page and page_bytes + entry["length"] > settings.DIFF_PAGE_MAX_BYTES:
+                break
+            page.append((position, entry))
+            page_bytes += entry["length"]
+
+        content = ""
+        if page:
+            # 同一页的文件在差异中连续存放，一次读取即可；
+            # 首页从文件开头、末页到文件末尾读取，各页依次拼接与原始差异逐字节一致
+            start = 0 if page[0][0] == 0 else page[0][1]["offset"]
+            end = page[-1][1]["offset"] + page[-1][1]["length"]
+            if page[-1][0] == len(files) - 1:
+                end = index["total_bytes"]
+            content = read_diff_range(diff_path, start, end - start)
+
+        next_offset = offset + len(page)
+        return {
+            "content": content,
+            "files": [self._file_summary(position, entry) for position, entry in page],
+            "total_files": len(files),
+            "offset": offset,
+            "next_offset": next_offset if next_offset < len(files) else None,
+            "total_bytes": index["total_bytes"]
+        }
+
+    @staticmethod
+    def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+        """
+        解析单段Range请求头
+
+        Returns:
+            (起始字节, 结束字节)，闭区间；不支持的格式返回None（按完整内容响应）
+
+        Raises:
+            HTTPException: 范围无法满足（416）
+        """
+        match = RANGE_RE.match(header.strip())
+        if not match or (not match.group(1) and not match.group(2)):
+            return None
+
+        if not match.group(1):
+            # bytes=-N 表示最后N个字节
+            length = int(match.group(2))
+            if length == 0:
+                start, end = size, size - 1
+            else:
+                start, end = max(0, size - length), size - 1
+        else:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else size - 1
+            end = min(end, size - 1)
+
+        if start >= size or start > end:
+            raise HTTPException(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                detail="请求范围无效",
+                headers={"Content-Range": f"bytes */{size}"}
+            )
+        return start, end
+
+    @staticmethod
+    def _iter_file(diff_path: str, start: int, length: int) -> Iterator[bytes]:
+        chunk_size = settings.GIT_STREAM_CHUNK_SIZE
+        with open(diff_path, "rb") as f:
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    @classmethod
+    def _iter_gzip(cls, diff_path: str, size: int) -> Iterator[bytes]:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in cls._iter_file(diff_path, 0, size):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def raw_response(self, request: Request, diff_path: str, filename: str) -> Response:
+        """
+        返回原始差异内容
+
+        支持If-None-Match（304）、单段Range（206）以及对完整内容的gzip压缩，
+        内容按块从磁盘流式发送。
+
+        Args:
+            request: 请求对象
+            diff_path: 差异文件路径
+            filename: 下载文件名
+
+        Returns:
+            响应
+        """
+        size = os.path.getsize(diff_path)
+        etag = self.etag(diff_path)
+        headers = {
+            "ETag": etag,
+            "Accept-Ranges": "bytes",
+            "Cache-Control": "private, max-age=0, must-revalidate",
+            "Content-Disposition": f'inline; filename="{filename}"',
+            "Vary": "Accept-Encoding"
+        }
+
+        # gzip编码的表示使用不同的ETag，避免与未压缩内容的Range请求混用
+        gzip_etag = f'{etag[:-1]}-gzip"'
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            candidates = [value.strip() for value in if_none_match.split(",")]
+            if etag in candidates or gzip_etag in candidates or "*" in candidates:
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        byte_range = None
+        range_header = request.headers.get("range")
+        if range_header:
+            # If-Range与当前版本不一致时忽略Range，返回完整内容
+            if_range = request.headers.get("if-range")
+            if not if_range or if_range.strip() == etag:
+                byte_range = self._parse_range(range_header, size)
+
+        media_type = "text/x-diff; charset=utf-8"
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                self._iter_file(diff_path, start, end - start + 1),
+                status_code=status.HTTP_206_PARTIAL_CONTENT,
+                media_type=media_type,
+                headers=headers
+            )
+
+        if "gzip" in request.headers.get("accept-encoding", "").lower():
+            headers["Content-Encoding"] = "gzip"
+            headers["ETag"] = gzip_etag
+            return StreamingResponse(
+                self._iter_gzip(diff_path, size),
+                media_type=media_type,
+                headers=headers
+            )
+
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(
+            self._iter_file(diff_path, 0, size),
+            media_type=media_type,
+            headers=headers
+        )
+
+
+# 创建全局差异内容服务实例
+diff_content_service = DiffContentService()
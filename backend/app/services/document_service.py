@@ -3,17 +3,44 @@
 处理文档上传、切片、向量化等功能
 """
 import os
+import shutil
 import hashlib
 import mimetypes
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, Callable
 from pathlib import Path
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import (
     TextLoader, PyPDFLoader, UnstructuredWordDocumentLoader,
     UnstructuredMarkdownLoader, CSVLoader
 )
 from app.core.config import settings
-from app.core.vector_store import chroma_manager, generate_chunk_id, calculate_content_hash
+from app.core.tokenizer import count_tokens
+from app.core.text_splitter import get_text_splitter
+from app.core.vector_store import (
+    chroma_manager, generate_chunk_id, generate_content_chunk_id, calculate_content_hash
+)
+from app.core.embeddings import embedding_service
+from app.services.extraction_service import extraction_service
+
+
+def iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    """
+    按固定大小分批
+    
+    Args:
+        items: 可迭代对象
+        batch_size: 每批数量
+        
+    Yields:
+        批次列表
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 class DocumentProcessor:
@@ -29,6 +56,9 @@ class DocumentProcessor:
         '.csv': 'text/csv'
     }
     
+    # 流式切分时缓冲区累积到多少个切片大小后切分一次
+    STREAM_SPLIT_WINDOW = 8
+    
     def __init__(self):
         """初始化文档处理器"""
         # 确保上传目录存在
@@ -104,163 +134,363 @@ class DocumentProcessor:
         
         return file_path, new_filename
     
-    def load_document_content(self, file_path: str, file_type: str) -> List[str]:
+    def store_local_file(self, source_path: str, filename: str, kb_id: int, content_hash: str) -> Tuple[str, str]:
         """
-        加载文档内容
+        复制服务器本地文件到知识库目录（批量入库使用，不整体读入内存）
         
         Args:
-            file_path: 文件路径
-            file_type: 文件类型
+            source_path: 源文件路径
+            filename: 原始文件名
+            kb_id: 知识库ID
+            content_hash: 文件内容哈希
             
         Returns:
-            文档内容列表
+            (保存的文件路径, 新文件名)
         """
-        try:
-            if file_type == 'text/plain':
-                loader = TextLoader(file_path, encoding='utf-8')
-            elif file_type == 'text/markdown':
-                loader = UnstructuredMarkdownLoader(file_path)
-            elif file_type == 'application/pdf':
-                loader = PyPDFLoader(file_path)
-            elif file_type in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/msword']:
-                loader = UnstructuredWordDocumentLoader(file_path)
-            elif file_type == 'text/csv':
-                loader = CSVLoader(file_path)
-            else:
-                raise ValueError(f"不支持的文件类型: {file_type}")
+        kb_dir = os.path.join(settings.UPLOAD_DIR, f"kb_{kb_id}")
+        os.makedirs(kb_dir, exist_ok=True)
+        
+        new_filename = f"{content_hash[:16]}_{filename}"
+        file_path = os.path.join(kb_dir, new_filename)
+        shutil.copyfile(source_path, file_path)
+        
+        return file_path, new_filename
+    
+    def _create_loader(self, file_path: str, file_type: str):
+        """根据文件类型创建文档加载器"""
+        if file_type == 'text/plain':
+            return TextLoader(file_path, encoding='utf-8')
+        elif file_type == 'text/markdown':
+            return UnstructuredMarkdownLoader(file_path)
+        elif file_type == 'application/pdf':
+            return PyPDFLoader(file_path)
+        elif file_type in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/msword']:
+            return UnstructuredWordDocumentLoader(file_path)
+        elif file_type == 'text/csv':
+            return CSVLoader(file_path)
+        else:
+            raise ValueError(f"不支持的文件类型: {file_type}")
+    
+    def iter_document_content(self, file_path: str, file_type: str) -> Iterator[str]:
+        """
+        逐页加载文档内容（PDF按页、CSV按行产出，不一次性加载整个文档）
+        
+        PDF和Word文档在解析进程池中提取，其他类型使用langchain加载器。
+        
+        Args:
+            file_path: 文件路径
+            file_type: 文件类型
             
-            documents = loader.load()
-            return [doc.page_content for doc in documents]
+        Yields:
+            页面内容
+        """
+        pages = extraction_service.iter_pages(file_path, file_type)
+        if pages is not None:
+            yield from pages
+            return
         
-        except Exception as e:
-            print(f"加载文档失败: {e}")
-            return []
+        loader = self._create_loader(file_path, file_type)
+        for doc in loader.lazy_load():
+            yield doc.page_content
     
-    def split_document(
-        self, 
-        content: str, 
-        chunk_size: int = 1000, 
+    def iter_split_document(
+        self,
+        pages: Iterable[str],
+        chunk_size: int = 1000,
         chunk_overlap: int = 200
-    ) -> List[str]:
+    ) -> Iterator[str]:
         """
-        切分文档
+        流式切分文档
+        
+        页面按"\n\n"拼接进缓冲区，缓冲区达到STREAM_SPLIT_WINDOW个切片大小时切分，
+        产出除最后一个以外的切片，最后一个切片起点之后的文本留在缓冲区与后续页面拼接，
+        切片边界可以跨页，内存占用与文档大小无关。
         
         Args:
-            content: 文档内容
+            pages: 页面内容
             chunk_size: 切片大小
             chunk_overlap: 重叠大小
             
-        Returns:
-            切片列表
+        Yields:
+            切片
         """
-        try:
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=chunk_size,
-                chunk_overlap=chunk_overlap,
-                length_function=len,
-                is_separator_regex=False,
-            )
+        text_splitter = get_text_splitter(chunk_size, chunk_overlap, settings.TEXT_SPLITTER_LENGTH_UNIT)
+        window = chunk_size * self.STREAM_SPLIT_WINDOW
+        
+        buffer = None
+        for page in pages:
+            buffer = page if buffer is None else f"{buffer}\n\n{page}"
+            if len(buffer) < window:
+                continue
             
-            chunks = text_splitter.split_text(content)
-            return chunks
+            spans = text_splitter.split_spans(buffer)
+            carry_start = spans[-1][0] if len(spans) > 1 else 0
+            if carry_start <= 0:
+                continue
+            for start, end in spans[:-1]:
+                yield buffer[start:end]
+            buffer = buffer[carry_start:]
         
-        except Exception as e:
-            print(f"文档切分失败: {e}")
-            return [content]  # 如果切分失败，返回原内容
+        if buffer:
+            for chunk in text_splitter.split_text(buffer):
+                yield chunk
+    
+    @staticmethod
+    def _build_chunk_info(
+        document_id: int,
+        chunk_index: int,
+        chunk: str,
+        chunk_id: str,
+        content_hash: str,
+        base_metadata: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """构建切片信息（同时作为DocumentChunk字段和ChromaDB元数据来源）"""
+        chunk_metadata = {
+            **base_metadata,
+            "document_id": document_id,
+            "chunk_index": chunk_index,
+            "chunk_id": chunk_id,
+            "content_hash": content_hash
+        }
+        return {
+            "chunk_index": chunk_index,
+            "content": chunk,
+            "content_hash": content_hash,
+            "embedding_id": chunk_id,
+            "token_count": count_tokens(chunk),
+            "chunk_metadata": chunk_metadata
+        }
+    
+    def _upsert_chunk_infos(
+        self,
+        chunk_infos: List[Dict[str, Any]],
+        collection_name: str,
+        embedding_model: Optional[str]
+    ):
+        """计算切片向量并写入ChromaDB（按切片ID覆盖，重试时不会重复）"""
+        if not chunk_infos:
+            return
+        
+        # 相同内容的切片（文档修改后未变的部分、跨知识库的重复内容）直接复用缓存向量
+        model = embedding_service.model_for_collection(collection_name, embedding_model)
+        documents = [info["content"] for info in chunk_infos]
+        embeddings = embedding_service.embed_documents(
+            model, documents, content_hashes=[info["content_hash"] for info in chunk_infos]
+        )
+        success = chroma_manager.upsert_documents(
+            collection_name=collection_name,
+            documents=documents,
+            metadatas=[info["chunk_metadata"] for info in chunk_infos],
+            ids=[info["embedding_id"] for info in chunk_infos],
+            embeddings=embeddings
+        )
+        
+        if not success:
+            raise Exception("向量化存储失败")
     
     def process_document_chunks(
         self, 
         document_id: int,
         chunks: List[str],
         collection_name: str,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        embedding_model: Optional[str] = None,
+        start_index: int = 0,
+        occurrences: Optional[Dict[str, int]] = None
     ) -> List[Dict[str, Any]]:
         """
         处理文档切片
         
+        分批处理同一文档时，依次传入每批的起始序号和同一个occurrences字典。
+        
         Args:
             document_id: 文档ID
             chunks: 切片列表
             collection_name: ChromaDB集合名称
             metadata: 基础元数据
+            embedding_model: 知识库的嵌入模型
+            start_index: 第一个切片的序号
+            occurrences: 内容哈希 -> 已出现次数（跨批次共享）
             
         Returns:
             切片信息列表
         """
         chunk_infos = []
-        documents = []
-        metadatas = []
-        ids = []
+        occurrences = {} if occurrences is None else occurrences
+        base_metadata = metadata or {}
+        
+        for i, chunk in enumerate(chunks, start=start_index):
+            # 切片ID由内容哈希生成，便于之后增量重建索引
+            content_hash = calculate_content_hash(chunk)
+            occurrence = occurrences.get(content_hash, 0)
+            occurrences[content_hash] = occurrence + 1
+            chunk_id = generate_content_chunk_id(document_id, content_hash, occurrence)
+            
+            chunk_infos.append(self._build_chunk_info(
+                document_id, i, chunk, chunk_id, content_hash, base_metadata
+            ))
+        
+        self._upsert_chunk_infos(chunk_infos, collection_name, embedding_model)
+        
+        return chunk_infos
+    
+    def reindex_document_chunks(
+        self,
+        document_id: int,
+        chunks: Iterable[str],
+        existing_chunks: List[Any],
+        collection_name: str,
+        write_created: Callable[[Dict[str, Any]], None],
+        write_updated: Callable[[Dict[str, Any]], None],
+        metadata: Optional[Dict[str, Any]] = None,
+        embedding_model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        增量重建文档切片索引
+        
+        新切片按内容哈希与已有切片匹配：匹配到的沿用原切片ID和向量，只在位置或元数据
+        变化时更新ChromaDB元数据；未匹配的新切片计算向量后写入；多余的旧切片由调用方
+        在数据库提交后通过delete_chunk_embeddings删除。切片可以是流式切分的生成器，
+        向量库写入按INGEST_FLUSH_BATCH_SIZE分批进行；数据库变更逐条交给write_created/
+        write_updated（如写入中间文件），不在内存中累积切片内容。
         
+        Args:
+            document_id: 文档ID
+            chunks: 重新切分后的切片
+            existing_chunks: 已有切片的比对字段（id、chunk_index、content_hash、embedding_id、chunk_metadata）
+            collection_name: ChromaDB集合名称
+            write_created: 接收新切片信息（DocumentChunk字段）
+            write_updated: 接收已有切片需要更新的字段（包含切片id）
+            metadata: 基础元数据
+            embedding_model: 知识库的嵌入模型
+            
+        Returns:
+            变更统计：created / updated（数量）、deleted_ids / deleted_embedding_ids（多余切片）、
+            unchanged（未变化数量）、total（切片总数）
+        """
         base_metadata = metadata or {}
         
+        # 内容哈希 -> 按位置排序的已有切片
+        available: Dict[str, List[Any]] = {}
+        for row in sorted(existing_chunks, key=lambda row: row.chunk_index):
+            available.setdefault(row.content_hash, []).append(row)
+        used_ids = {row.embedding_id for row in existing_chunks if row.embedding_id}
+        
+        created = 0
+        updated = 0
+        unchanged = 0
+        total = 0
+        occurrences: Dict[str, int] = {}
+        
+        # 先写ChromaDB再提交数据库：中途失败时数据库仍指向完整的旧切片，重试可幂等覆盖
+        pending_created: List[Dict[str, Any]] = []
+        pending_updated: List[Dict[str, Any]] = []
+        batch_size = settings.INGEST_FLUSH_BATCH_SIZE
+        
         for i, chunk in enumerate(chunks):
-            # 生成切片ID和哈希
-            chunk_id = generate_chunk_id(document_id, i)
+            total += 1
             content_hash = calculate_content_hash(chunk)
+            occurrence = occurrences.get(content_hash, 0)
+            occurrences[content_hash] = occurrence + 1
             
-            # 准备切片元数据
-            chunk_metadata = {
-                **base_metadata,
-                "document_id": document_id,
-                "chunk_index": i,
-                "chunk_id": chunk_id,
-                "content_hash": content_hash
-            }
-            
-            # 收集用于ChromaDB的数据
-            documents.append(chunk)
-            metadatas.append(chunk_metadata)
-            ids.append(chunk_id)
+            candidates = available.get(content_hash)
+            if candidates:
+                row = candidates.pop(0)
+                info = self._build_chunk_info(
+                    document_id, i, chunk, row.embedding_id or generate_chunk_id(document_id, row.chunk_index),
+                    content_hash, base_metadata
+                )
+                if row.chunk_index != i or row.chunk_metadata != info["chunk_metadata"]:
+                    changes = {
+                        "id": row.id,
+                        "chunk_index": i,
+                        "embedding_id": info["embedding_id"],
+                        "chunk_metadata": info["chunk_metadata"]
+                    }
+                    write_updated(changes)
+                    updated += 1
+                    pending_updated.append(changes)
+                    if len(pending_updated) >= batch_size:
+                        self._update_chunk_metadata(pending_updated, collection_name)
+                        pending_updated = []
+                else:
+                    unchanged += 1
+                continue
             
-            # 收集切片信息
-            chunk_infos.append({
-                "chunk_index": i,
-                "content": chunk,
-                "content_hash": content_hash,
-                "embedding_id": chunk_id,
-                "token_count": len(chunk.split()),  # 简单的token计数
-                "chunk_metadata": chunk_metadata
-            })
-        
-        # 批量添加到ChromaDB
-        success = chroma_manager.add_documents(
+            chunk_id = generate_content_chunk_id(document_id, content_hash, occurrence)
+            while chunk_id in used_ids:
+                occurrence += 1
+                chunk_id = generate_content_chunk_id(document_id, content_hash, occurrence)
+            used_ids.add(chunk_id)
+            info = self._build_chunk_info(document_id, i, chunk, chunk_id, content_hash, base_metadata)
+            write_created(info)
+            created += 1
+            pending_created.append(info)
+            if len(pending_created) >= batch_size:
+                self._upsert_chunk_infos(pending_created, collection_name, embedding_model)
+                pending_created = []
+        
+        self._upsert_chunk_infos(pending_created, collection_name, embedding_model)
+        self._update_chunk_metadata(pending_updated, collection_name)
+        
+        removed = [row for rows in available.values() for row in rows]
+        return {
+            "created": created,
+            "updated": updated,
+            "deleted_ids": [row.id for row in removed],
+            "deleted_embedding_ids": [row.embedding_id for row in removed if row.embedding_id],
+            "unchanged": unchanged,
+            "total": total
+        }
+    
+    def _update_chunk_metadata(self, updates: List[Dict[str, Any]], collection_name: str):
+        """只更新切片在ChromaDB中的元数据，不重新计算向量"""
+        if not updates:
+            return
+        success = chroma_manager.update_documents(
             collection_name=collection_name,
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
+            ids=[update["embedding_id"] for update in updates],
+            metadatas=[update["chunk_metadata"] for update in updates]
         )
-        
         if not success:
-            raise Exception("向量化存储失败")
+            raise Exception("更新切片元数据失败")
+    
+    def delete_chunk_embeddings(self, collection_name: str, embedding_ids: List[str]) -> bool:
+        """
+        从向量存储中删除指定切片
         
-        return chunk_infos
+        Args:
+            collection_name: 集合名称
+            embedding_ids: 切片ID列表
+            
+        Returns:
+            是否删除成功
+        """
+        if not embedding_ids:
+            return True
+        return chroma_manager.delete_documents(collection_name=collection_name, ids=embedding_ids)
     
     def delete_document_from_vector_store(
         self, 
         document_id: int, 
-        collection_name: str,
-        chunk_count: int
+        collection_name: str
     ) -> bool:
         """
         从向量存储中删除文档
         
+        按document_id元数据删除，与切片ID的生成方式无关。
+        
         Args:
             document_id: 文档ID
             collection_name: 集合名称
-            chunk_count: 切片数量
             
         Returns:
             是否删除成功
         """
         try:
-            # 生成所有切片ID
-            chunk_ids = [generate_chunk_id(document_id, i) for i in range(chunk_count)]
-            
-            # 从ChromaDB删除
             return chroma_manager.delete_documents(
                 collection_name=collection_name,
-                ids=chunk_ids
+                where={"document_id": document_id}
             )
         except Exception as e:
             print(f"从向量存储删除文档失败: {e}")
@@ -347,84 +577,108 @@ class DocumentService:
         db.commit()
         db.refresh(doc)
 
-        # 后台处理文档
-        # TODO: 这里应该使用Celery任务
+        # 提交到ingestion队列异步处理（加载 → 切分 → 向量化 → 持久化），上传请求立即返回
+        from app.tasks.document_tasks import start_document_ingestion
         try:
-            await self.process_document(db, doc.id)
+            start_document_ingestion(doc.id)
         except Exception as e:
-            print(f"处理文档失败: {e}")
-            document.update_status(db, document_id=doc.id, status="failed", error_message=str(e))
+            print(f"提交文档处理任务失败: {e}")
+            document.update_status(db, document_id=doc.id, status="failed", error_message=f"提交处理任务失败: {str(e)}")
+            db.refresh(doc)
 
         return doc
 
-    async def process_document(self, db, document_id: int):
+    async def update_document(
+        self,
+        db,
+        knowledge_base_id: int,
+        document_id: int,
+        file,
+        metadata: str = None
+    ):
         """
-        处理文档（切片和向量化）
+        替换文档内容并增量重建索引
 
         Args:
             db: 数据库会话
+            knowledge_base_id: 知识库ID
             document_id: 文档ID
+            file: 新的文件
+            metadata: 元数据JSON字符串（为空时保留原元数据）
+
+        Returns:
+            (Document对象, 是否提交了重建索引)
         """
-        from app.crud.crud_knowledge_base import document, knowledge_base, document_chunk
+        from app.crud.crud_knowledge_base import document, DOCUMENT_PROCESSING_STATUSES
+        import json
 
-        # 获取文档信息
         doc = document.get(db, document_id)
-        if not doc:
+        if not doc or doc.knowledge_base_id != knowledge_base_id:
             raise ValueError("文档不存在")
 
-        # 获取知识库信息
-        kb = knowledge_base.get(db, doc.knowledge_base_id)
-        if not kb:
-            raise ValueError("知识库不存在")
+        if doc.status in DOCUMENT_PROCESSING_STATUSES:
+            raise ValueError("文档正在处理中，请稍后再试")
 
-        try:
-            # 更新状态为处理中
-            document.update_status(db, document_id=document_id, status="processing")
-
-            # 加载文档内容
-            content_list = self.processor.load_document_content(doc.file_path, doc.file_type)
-            if not content_list:
-                raise Exception("无法加载文档内容")
-
-            # 合并所有页面内容
-            full_content = "\n\n".join(content_list)
-
-            # 切分文档
-            chunks = self.processor.split_document(
-                full_content,
-                chunk_size=kb.chunk_size,
-                chunk_overlap=kb.chunk_overlap
-            )
+        if not self.processor.is_supported_file_type(file.filename):
+            raise ValueError(f"不支持的文件类型: {file.filename}")
 
-            # 处理切片并向量化
-            chunk_infos = self.processor.process_document_chunks(
-                document_id=document_id,
-                chunks=chunks,
-                collection_name=kb.collection_name,
-                metadata={
-                    "filename": doc.original_filename,
-                    "file_type": doc.file_type,
-                    "knowledge_base_id": kb.id
-                }
-            )
+        file_content = await file.read()
+        content_hash = hashlib.sha256(file_content).hexdigest()
 
-            # 保存切片到数据库
-            chunks_data = []
-            for chunk_info in chunk_infos:
-                chunks_data.append({
-                    "document_id": document_id,
-                    **chunk_info
-                })
+        if metadata:
+            try:
+                doc.doc_metadata = json.loads(metadata)
+            except json.JSONDecodeError:
+                pass
+
+        # 内容未变化且原索引完整时不需要重建
+        if content_hash == doc.content_hash and doc.status == "completed":
+            db.add(doc)
+            db.commit()
+            db.refresh(doc)
+            return doc, False
+
+        existing_doc = document.get_by_content_hash(db, content_hash=content_hash)
+        if existing_doc and existing_doc.id != doc.id:
+            raise ValueError("文件已存在")
+
+        file_path, new_filename = self.processor.save_uploaded_file(
+            file_content, file.filename, knowledge_base_id
+        )
+        old_file_path = doc.file_path
+
+        doc.filename = new_filename
+        doc.original_filename = file.filename
+        doc.file_path = file_path
+        doc.file_size = len(file_content)
+        doc.file_type = self.processor.get_file_type(file.filename)
+        doc.content_hash = content_hash
+        doc.status = "pending"
+        doc.error_message = None
+        db.add(doc)
+        db.commit()
+        db.refresh(doc)
 
-            document_chunk.create_chunks(db, chunks_data=chunks_data)
+        if old_file_path != file_path and os.path.exists(old_file_path):
+            try:
+                os.remove(old_file_path)
+            except OSError as e:
+                print(f"删除旧文档文件失败: {e}")
+
+        self.start_reindex(db, doc)
+        return doc, True
 
-            # 更新文档状态为完成
-            document.update_status(db, document_id=document_id, status="completed")
+    def start_reindex(self, db, doc):
+        """提交增量重建索引任务"""
+        from app.crud.crud_knowledge_base import document
+        from app.tasks.document_tasks import reindex_document
 
+        try:
+            reindex_document.delay(doc.id)
         except Exception as e:
-            # 更新状态为失败
-            document.update_status(db, document_id=document_id, status="failed", error_message=str(e))
-            raise
+            print(f"提交重建索引任务失败: {e}")
+            document.update_status(db, document_id=doc.id, status="failed", error_message=f"提交处理任务失败: {str(e)}")
+            db.refresh(doc)
 
 
 # 创建全局实例
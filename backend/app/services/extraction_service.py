@@ -0,0 +1,277 @@
+"""
+文档文本提取服务
+PDF/Word解析是纯Python的CPU密集型操作，放到独立的子进程中执行：大PDF按页范围拆分到多个子进程，
+按顺序重新拼接；每个文件有整体超时，子进程有内存上限
+
+子进程通过 python -m 启动而不是multiprocessing，在Celery prefork（守护进程）中同样可用；
+每个文件只使用自己启动的子进程，超时或崩溃时只终止该文件的子进程，不影响同时解析的其他文件
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from collections import deque
+from typing import Iterator, List, Optional
+from app.core.config import settings
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+
+PDF_FILE_TYPE = 'application/pdf'
+WORD_FILE_TYPES = (
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/msword'
+)
+
+# 子进程入口模块
+WORKER_MODULE = "app.services.extraction_service"
+
+# backend目录，子进程据此导入app包
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ExtractionError(Exception):
+    """解析超时或解析进程异常退出（与文件内容无关，可重试）"""
+    pass
+
+
+def _limit_memory(max_memory_bytes: int):
+    """限制子进程地址空间大小，超出时解析抛出MemoryError而不是拖垮整机"""
+    if RESOURCE_AVAILABLE and max_memory_bytes > 0:
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (max_memory_bytes, max_memory_bytes))
+        except (ValueError, OSError) as e:
+            print(f"设置解析进程内存上限失败: {e}")
+
+
+def _pdf_reader(file_path: str):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        try:
+            from PyPDF2 import PdfReader
+        except ImportError:
+            raise ValueError("需要安装pypdf或PyPDF2库来处理PDF文件")
+    return PdfReader(file_path)
+
+
+def _pdf_page_count(file_path: str) -> int:
+    return len(_pdf_reader(file_path).pages)
+
+
+def _extract_pdf_pages(file_path: str, start: int, end: int) -> List[str]:
+    """提取PDF第start到end-1页的文本（每个进程独立打开文件）"""
+    reader = _pdf_reader(file_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def _extract_word_document(file_path: str) -> List[str]:
+    """使用unstructured解析Word文档（与知识库原有加载方式一致）"""
+    from langchain_community.document_loaders import UnstructuredWordDocumentLoader
+    return [doc.page_content for doc in UnstructuredWordDocumentLoader(file_path).load()]
+
+
+def _extract_docx_paragraphs(file_path: str) -> str:
+    """使用python-docx按段落提取.docx文本"""
+    try:
+        from docx import Document
+    except ImportError:
+        raise ValueError("需要安装python-docx库来处理.docx文件")
+    return '\n'.join(paragraph.text for paragraph in Document(file_path).paragraphs)
+
+
+# 子进程可执行的解析任务
+WORKER_TASKS = {
+    "pdf_page_count": _pdf_page_count,
+    "pdf_pages": _extract_pdf_pages,
+    "word": _extract_word_document,
+    "docx": _extract_docx_paragraphs,
+}
+
+
+def _worker_main(argv: List[str]):
+    """
+    子进程入口
+
+    参数：任务名 结果文件 内存上限字节数 文件路径 [整数参数...]；
+    结果以JSON写入结果文件，解析失败时写入错误信息，由父进程决定如何报错。
+    """
+    task, output_path, max_memory_bytes, file_path, *args = argv
+    _limit_memory(int(max_memory_bytes))
+
+    try:
+        result = {"result": WORKER_TASKS[task](file_path, *(int(arg) for arg in args))}
+    except MemoryError:
+        result = {"error": "memory"}
+    except Exception as e:
+        result = {"error": "invalid", "message": str(e)}
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+class _ExtractionProcess:
+    """单个解析子进程（结果写入临时文件，避免输出写满管道后阻塞）"""
+
+    def __init__(self, task: str, file_path: str, *args: int):
+        fd, self.output_path = tempfile.mkstemp(prefix="extraction_", suffix=".json")
+        os.close(fd)
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [BACKEND_DIR, env.get("PYTHONPATH")]))
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-m", WORKER_MODULE,
+                task, self.output_path, str(settings.EXTRACTION_MAX_MEMORY_MB * 1024 * 1024),
+                file_path, *(str(arg) for arg in args)
+            ],
+            stdin=subprocess.DEVNULL,
+            env=env
+        )
+
+    def _remove_output(self):
+        try:
+            os.remove(self.output_path)
+        except OSError:
+            pass
+
+    def kill(self):
+        """终止子进程并清理结果文件"""
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self._remove_output()
+
+    def result(self, timeout: float):
+        """
+        等待解析结果
+
+        Raises:
+            ExtractionError: 超时或子进程异常退出（可重试）
+            ValueError: 文件无法解析或超出内存限制（重试无意义）
+        """
+        try:
+            self.process.wait(timeout=max(timeout, 0))
+        except subprocess.TimeoutExpired:
+            self.kill()
+            raise ExtractionError(f"文档解析超时（{settings.EXTRACTION_TIMEOUT}秒）")
+
+        try:
+            with open(self.output_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        finally:
+            self._remove_output()
+
+        if data is None:
+            raise ExtractionError(f"文档解析进程异常退出（退出码 {self.process.returncode}）")
+        if data.get("error") == "memory":
+            raise ValueError(f"文档解析超出内存限制（{settings.EXTRACTION_MAX_MEMORY_MB}MB）")
+        if "error" in data:
+            raise ValueError(f"文档解析失败: {data.get('message')}")
+        return data["result"]
+
+
+class ExtractionService:
+    """
+    文档文本提取服务
+
+    每个解析任务在独立子进程中执行，单个文件同时运行的子进程数不超过EXTRACTION_WORKERS。
+    """
+
+    @property
+    def max_workers(self) -> int:
+        return settings.EXTRACTION_WORKERS or os.cpu_count() or 1
+
+    def _run(self, task: str, file_path: str, *args: int):
+        """在子进程中执行单个解析任务"""
+        return _ExtractionProcess(task, file_path, *args).result(settings.EXTRACTION_TIMEOUT)
+
+    def iter_pdf_pages(self, file_path: str) -> Iterator[str]:
+        """
+        并行提取PDF各页文本
+
+        按EXTRACTION_PAGES_PER_TASK页一段分发到子进程，按页序产出；
+        同时运行的段数不超过工作进程数，已完成的段不会无限堆积在内存中。
+        超时只计算等待解析结果的时间（包括读取页数），不包括调用方处理已产出页面的时间。
+
+        Args:
+            file_path: PDF文件路径
+
+        Yields:
+            页面文本
+        """
+        remaining = float(settings.EXTRACTION_TIMEOUT)
+        started = time.monotonic()
+        page_count = _ExtractionProcess("pdf_page_count", file_path).result(remaining)
+        remaining -= time.monotonic() - started
+
+        pages_per_task = max(1, settings.EXTRACTION_PAGES_PER_TASK)
+        ranges = deque(
+            (start, min(start + pages_per_task, page_count))
+            for start in range(0, page_count, pages_per_task)
+        )
+
+        running: "deque[_ExtractionProcess]" = deque()
+        try:
+            while ranges or running:
+                while ranges and len(running) < self.max_workers:
+                    start, end = ranges.popleft()
+                    running.append(_ExtractionProcess("pdf_pages", file_path, start, end))
+                started = time.monotonic()
+                pages = running.popleft().result(remaining)
+                remaining -= time.monotonic() - started
+                yield from pages
+        finally:
+            # 出错、超时或调用方提前停止迭代时终止本文件其余的子进程
+            for process in running:
+                process.kill()
+
+    def iter_pages(self, file_path: str, file_type: str) -> Optional[Iterator[str]]:
+        """
+        提取文档页面文本
+
+        Args:
+            file_path: 文件路径
+            file_type: 文件MIME类型
+
+        Returns:
+            页面迭代器；非PDF/Word文档返回None，由调用方使用常规加载器
+        """
+        if file_type == PDF_FILE_TYPE:
+            return self.iter_pdf_pages(file_path)
+        if file_type in WORD_FILE_TYPES:
+            return iter(self._run("word", file_path))
+        return None
+
+    def extract_text(self, file_path: str) -> str:
+        """
+        提取PDF/.docx文件的完整文本（需求文件解析使用）
+
+        Args:
+            file_path: 文件路径
+
+        Returns:
+            文本内容
+        """
+        file_ext = os.path.splitext(file_path)[1].lower()
+        if file_ext == '.pdf':
+            return '\n'.join(self.iter_pdf_pages(file_path))
+        if file_ext == '.docx':
+            return self._run("docx", file_path)
+        raise ValueError(f"不支持的文件类型: {file_ext}")
+
+
+# 创建全局文本提取服务实例
+extraction_service = ExtractionService()
+
+
+if __name__ == "__main__":
+    _worker_main(sys.argv[1:])
@@ -0,0 +1,339 @@
+"""
+知识库批量入库服务
+处理压缩包/服务器目录的文件收集、按内容哈希去重和批次进度统计
+"""
+import os
+import shutil
+import tarfile
+import zipfile
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from sqlmodel import Session
+from app.core.config import settings
+from app.models.knowledge_base import Document, IngestionBatch
+from app.crud.crud_knowledge_base import document, ingestion_batch, DOCUMENT_PROCESSING_STATUSES
+from app.services.document_service import document_processor
+
+
+class BulkIngestionService:
+    """批量入库服务类"""
+
+    ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+    # 每插入多少条文档记录提交一次
+    COMMIT_BATCH_SIZE = 200
+
+    # 批次元数据中最多记录的跳过文件数
+    MAX_SKIPPED_RECORDS = 200
+
+    def is_archive(self, filename: str) -> bool:
+        """是否为支持的压缩包格式"""
+        return filename.lower().endswith(self.ARCHIVE_SUFFIXES)
+
+    @staticmethod
+    def batch_dir(batch_id: int) -> str:
+        """批次工作目录（保存上传的压缩包及解压文件）"""
+        return os.path.join(settings.UPLOAD_DIR, "ingestion", f"batch_{batch_id}")
+
+    @staticmethod
+    def resolve_directory(path: str) -> str:
+        """
+        校验服务器目录路径
+
+        只允许BULK_INGEST_ROOT下的目录，防止通过接口读取任意服务器文件。
+
+        Args:
+            path: 目录路径（绝对路径或相对BULK_INGEST_ROOT的路径）
+
+        Returns:
+            规范化后的绝对路径
+        """
+        if not settings.BULK_INGEST_ROOT:
+            raise ValueError("未配置BULK_INGEST_ROOT，服务器目录导入已禁用")
+
+        root = os.path.realpath(settings.BULK_INGEST_ROOT)
+        resolved = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, resolved]) != root:
+            raise ValueError("目录不在允许的导入范围内")
+        if not os.path.isdir(resolved):
+            raise ValueError("目录不存在")
+        return resolved
+
+    @staticmethod
+    def _safe_target(dest: str, name: str) -> Optional[str]:
+        """压缩包成员的解压路径，绝对路径或跳出目标目录的成员返回None"""
+        name = name.replace('\\', '/')
+        if name.startswith('/') or os.path.isabs(name):
+            return None
+        target = os.path.realpath(os.path.join(dest, name))
+        if os.path.commonpath([dest, target]) != dest:
+            return None
+        return target
+
+    def _check_limits(self, count: int, total_size: int):
+        if count > settings.BULK_INGEST_MAX_FILES:
+            raise ValueError(f"压缩包文件数超过限制: {settings.BULK_INGEST_MAX_FILES}")
+        if total_size > settings.BULK_INGEST_MAX_EXTRACTED_SIZE:
+            raise ValueError(f"压缩包解压后大小超过限制: {settings.BULK_INGEST_MAX_EXTRACTED_SIZE} bytes")
+
+    def extract_archive(self, archive_path: str, dest: str) -> str:
+        """
+        安全解压压缩包
+
+        只解压普通文件，跳过符号链接和路径穿越的成员，并限制文件数和解压后总大小。
+
+        Args:
+            archive_path: 压缩包路径
+            dest: 解压目录
+
+        Returns:
+            解压目录
+        """
+        dest = os.path.realpath(dest)
+        os.makedirs(dest, exist_ok=True)
+        count = 0
+        total_size = 0
+
+        if zipfile.is_zipfile(archive_path):
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    # 高位保存的是unix文件模式，用于识别符号链接
+                    is_symlink = (info.external_attr >> 16) & 0o170000 == 0o120000
+                    if info.is_dir() or is_symlink:
+                        continue
+                    target = self._safe_target(dest, info.filename)
+                    if not target or not document_processor.is_supported_file_type(target):
+                        continue
+                    count += 1
+                    total_size += info.file_size
+                    self._check_limits(count, total_size)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with archive.open(info) as source, open(target, "wb") as f:
+                        shutil.copyfileobj(source, f)
+        elif tarfile.is_tarfile(archive_path):
+            with tarfile.open(archive_path, "r:*") as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    target = self._safe_target(dest, member.name)
+                    if not target or not document_processor.is_supported_file_type(target):
+                        continue
+                    count += 1
+                    total_size += member.size
+                    self._check_limits(count, total_size)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    source = archive.extractfile(member)
+                    if source is None:
+                        continue
+                    with source, open(target, "wb") as f:
+                        shutil.copyfileobj(source, f)
+        else:
+            raise ValueError("无法识别的压缩包格式")
+
+        return dest
+
+    @staticmethod
+    def iter_files(root: str) -> Iterator[str]:
+        """按路径顺序遍历目录下的文件（跳过隐藏文件和目录，不跟随符号链接）"""
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+            for filename in sorted(filenames):
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                if os.path.isfile(path) and not os.path.islink(path):
+                    yield path
+
+    def register_files(
+        self,
+        db: Session,
+        batch: IngestionBatch,
+        root: str
+    ) -> Tuple[List[int], List[Dict[str, str]]]:
+        """
+        收集文件、按内容哈希去重并创建待处理的文档记录
+
+        每批文档记录与批次的document_ids在同一事务中提交；中途失败时删除已创建的文档记录和已复制的文件，
+        避免留下不会被提交入库、又会在重试时被判为"文件已存在"的文档。
+
+        Args:
+            db: 数据库会话
+            batch: 批次
+            root: 文件根目录
+
+        Returns:
+            (新建的文档ID列表, 跳过的文件列表)
+        """
+        skipped: List[Dict[str, str]] = []
+        candidates: List[Tuple[str, str, int]] = []
+        seen = set()
+
+        for path in self.iter_files(root):
+            relative = os.path.relpath(path, root)
+            if not document_processor.is_supported_file_type(path):
+                skipped.append({"file": relative, "reason": "不支持的文件类型"})
+                continue
+            size = os.path.getsize(path)
+            if size > settings.MAX_FILE_SIZE:
+                skipped.append({"file": relative, "reason": "文件大小超过限制"})
+                continue
+            content_hash = document_processor.calculate_file_hash(path)
+            if content_hash in seen:
+                skipped.append({"file": relative, "reason": "批次内重复文件"})
+                continue
+            seen.add(content_hash)
+            candidates.append((path, content_hash, size))
+            if len(candidates) > settings.BULK_INGEST_MAX_FILES:
+                raise ValueError(f"文件数超过限制: {settings.BULK_INGEST_MAX_FILES}")
+
+        existing = document.get_existing_hashes(db, content_hashes=[item[1] for item in candidates])
+        doc_metadata = (batch.batch_metadata or {}).get("doc_metadata") or {}
+
+        document_ids: List[int] = []
+        stored_files: List[str] = []
+        pending: List[Document] = []
+        try:
+            for path, content_hash, size in candidates:
+                relative = os.path.relpath(path, root)
+                if content_hash in existing:
+                    skipped.append({"file": relative, "reason": "文件已存在"})
+                    continue
+
+                filename = os.path.basename(path)
+                file_path, new_filename = document_processor.store_local_file(
+                    path, filename, batch.knowledge_base_id, content_hash
+                )
+                stored_files.append(file_path)
+                doc = Document(
+                    knowledge_base_id=batch.knowledge_base_id,
+                    filename=new_filename,
+                    original_filename=filename,
+                    file_path=file_path,
+                    file_size=size,
+                    file_type=document_processor.get_file_type(filename),
+                    content_hash=content_hash,
+                    status="pending",
+                    doc_metadata={**doc_metadata, "source_path": relative, "ingestion_batch_id": batch.id}
+                )
+                db.add(doc)
+                pending.append(doc)
+                if len(pending) >= self.COMMIT_BATCH_SIZE:
+                    self._flush(db, batch, pending, document_ids)
+                    pending = []
+
+            self._flush(db, batch, pending, document_ids)
+        except Exception:
+            self._discard(db, batch, document_ids, stored_files)
+            raise
+
+        return document_ids, skipped
+
+    @staticmethod
+    def _flush(db: Session, batch: IngestionBatch, documents: List[Document], document_ids: List[int]):
+        """写入一批文档记录，并在同一事务中把ID记录到批次（在提交前取出ID，提交后访问属性会逐条刷新）"""
+        db.flush()
+        document_ids.extend(doc.id for doc in documents)
+        batch.document_ids = list(document_ids)
+        db.add(batch)
+        db.commit()
+
+    @staticmethod
+    def _discard(db: Session, batch: IngestionBatch, document_ids: List[int], stored_files: List[str]):
+        """登记文件中途失败时，删除已创建的文档记录和已复制的文件"""
+        db.rollback()
+        try:
+            document.delete_by_ids(db, document_ids=document_ids)
+            batch.document_ids = []
+            db.add(batch)
+            db.commit()
+        except Exception as e:
+            # 文档记录仍在（ID已记录在批次中），保留文件使记录与文件一致
+            db.rollback()
+            print(f"清理批次{batch.id}已创建的文档记录失败: {e}")
+            return
+
+        for file_path in stored_files:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+    def prepare_batch(self, db: Session, batch_id: int) -> IngestionBatch:
+        """
+        准备批次：解压（如需要）、收集文件并创建文档记录
+
+        Args:
+            db: 数据库会话
+            batch_id: 批次ID
+
+        Returns:
+            更新后的批次
+        """
+        batch = ingestion_batch.get(db, batch_id)
+        if not batch:
+            raise ValueError("批量入库任务不存在")
+
+        ingestion_batch.update_batch(db, batch_id=batch_id, status="preparing")
+        work_dir = self.batch_dir(batch_id)
+        try:
+            if batch.source_type == "archive":
+                archive_path = (batch.batch_metadata or {}).get("archive_path")
+                if not archive_path or not os.path.exists(archive_path):
+                    raise ValueError("压缩包不存在")
+                root = self.extract_archive(archive_path, os.path.join(work_dir, "extracted"))
+            else:
+                root = self.resolve_directory(batch.source)
+
+            document_ids, skipped = self.register_files(db, batch, root)
+        finally:
+            # 文件已复制到知识库目录，清理压缩包和解压目录
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        metadata = dict(batch.batch_metadata or {})
+        metadata.pop("archive_path", None)
+        metadata["skipped"] = skipped[:self.MAX_SKIPPED_RECORDS]
+
+        return ingestion_batch.update_batch(
+            db,
+            batch_id=batch_id,
+            status="running" if document_ids else "completed",
+            total_files=len(document_ids),
+            skipped_files=len(skipped),
+            document_ids=document_ids,
+            batch_metadata=metadata
+        )
+
+    def get_progress(self, db: Session, batch: IngestionBatch) -> Dict[str, Any]:
+        """
+        汇总批次进度
+
+        Args:
+            db: 数据库会话
+            batch: 批次
+
+        Returns:
+            进度信息
+        """
+        counts = document.count_by_status(db, document_ids=batch.document_ids or [])
+        completed = counts.get("completed", 0)
+        failed = counts.get("failed", 0)
+        processing = sum(counts.get(status, 0) for status in DOCUMENT_PROCESSING_STATUSES)
+        finished = completed + failed
+
+        if batch.status in ("pending", "preparing"):
+            progress = 0.0
+        elif batch.total_files:
+            progress = round(finished * 100.0 / batch.total_files, 2)
+        else:
+            progress = 100.0
+
+        return {
+            "completed_documents": completed,
+            "failed_documents": failed,
+            "processing_documents": processing,
+            "status_counts": counts,
+            "progress": progress
+        }
+
+
+# 创建全局实例
+bulk_ingestion_service = BulkIngestionService()
@@ -8,6 +8,8 @@ from sqlmodel import Session, select
 from app.models.knowledge_base import KnowledgeBase, Document, DocumentChunk
 from app.schemas.knowledge_base import RAGSearchRequest, RAGSearchResponse, RAGSearchResult
 from app.core.vector_store import chroma_manager
+from app.core.embeddings import embedding_service
+from app.core.tokenizer import ContextBudgeter
 from app.services.document_service import document_processor
 
 
@@ -43,10 +45,11 @@ class RAGService:
         if not kb.is_active:
             raise ValueError("知识库未激活")
         
-        # 在ChromaDB中搜索
+        # 用与入库相同的嵌入模型向量化查询，再在ChromaDB中搜索
+        model = embedding_service.model_for_collection(kb.collection_name, kb.embedding_model)
         search_results = chroma_manager.search_documents(
             collection_name=kb.collection_name,
-            query_texts=[search_request.query],
+            query_embeddings=[embedding_service.embed_query(model, search_request.query)],
             n_results=search_request.top_k
         )
         
@@ -176,7 +179,9 @@ class RAGService:
         knowledge_base_id: int,
         query: str,
         max_context_length: int = 4000,
-        top_k: int = 10
+        top_k: int = 10,
+        max_context_tokens: Optional[int] = None,
+        model: Optional[str] = None
     ) -> Tuple[str, List[RAGSearchResult]]:
         """
         为查询获取上下文信息
@@ -185,8 +190,10 @@ class RAGService:
             db: 数据库会话
             knowledge_base_id: 知识库ID
             query: 查询文本
-            max_context_length: 最大上下文长度
+            max_context_length: 最大上下文长度（字符），未指定max_context_tokens时生效
             top_k: 搜索结果数量
+            max_context_tokens: 最大上下文token数，按相关度顺序填充，最后一个片段可截断
+            model: 用于计数的模型名
             
         Returns:
             (合并的上下文文本, 搜索结果列表)
@@ -202,6 +209,14 @@ class RAGService:
         
         response = self.search_knowledge_base(db, search_request)
         
+        if max_context_tokens is not None:
+            budgeter = ContextBudgeter(model)
+            context_parts = budgeter.fit_texts(
+                [result.content for result in response.results],
+                budget=max_context_tokens
+            )
+            return "\n\n".join(context_parts), response.results
+        
         # 合并上下文
         context_parts = []
         current_length = 0
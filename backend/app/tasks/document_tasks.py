@@ -0,0 +1,383 @@
+"""
+知识库文档入库相关Celery任务
+按 加载 → 切分 → 向量化 → 持久化 四个阶段串联执行，每个阶段独立重试，
+阶段之间通过上传目录下的JSONL中间文件逐行传递数据，各阶段内存占用与文档大小无关
+"""
+import os
+import json
+import shutil
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator
+from celery import chain
+from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.llm_limiter import backoff_delay
+from app.crud.crud_knowledge_base import (
+    document, knowledge_base, document_chunk, ingestion_batch, DOCUMENT_PROCESSING_STATUSES
+)
+from app.services.document_service import document_processor, iter_batches
+from app.services.ingestion_service import bulk_ingestion_service
+from app.services.extraction_service import ExtractionError
+
+# 文档处理状态（按阶段推进）
+STATUS_LOADING = "loading"
+STATUS_SPLITTING = "splitting"
+STATUS_EMBEDDING = "embedding"
+STATUS_PERSISTING = "persisting"
+
+
+def _stage_dir(document_id: int) -> str:
+    """文档入库中间文件目录"""
+    return os.path.join(settings.UPLOAD_DIR, "ingestion", f"doc_{document_id}")
+
+
+def _stage_path(document_id: int, name: str) -> str:
+    return os.path.join(_stage_dir(document_id), f"{name}.jsonl")
+
+
+@contextmanager
+def _stage_writer(document_id: int, name: str) -> Iterator[Callable[[Any], None]]:
+    """逐行写入阶段结果（先写临时文件，成功后再替换，重试时不会读到半截文件）"""
+    os.makedirs(_stage_dir(document_id), exist_ok=True)
+    path = _stage_path(document_id, name)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        yield lambda record: f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(f"{path}.tmp", path)
+
+
+def _iter_stage(document_id: int, name: str) -> Iterator[Any]:
+    """逐行读取上一阶段结果"""
+    path = _stage_path(document_id, name)
+    if not os.path.exists(path):
+        raise Exception(f"缺少阶段中间结果: {name}")
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _get_document_and_kb(db, document_id: int):
+    doc = document.get(db, document_id)
+    if not doc:
+        raise ValueError("文档不存在")
+    kb = knowledge_base.get(db, doc.knowledge_base_id)
+    if not kb:
+        raise ValueError("知识库不存在")
+    return doc, kb
+
+
+def _retry_or_fail(task, db, document_id: int, stage: str, exc: Exception):
+    """阶段失败时按退避重试，重试次数用尽后将文档标记为失败"""
+    # 数据错误（ValueError：文档/知识库不存在、内容为空）重试无意义，直接失败
+    if isinstance(exc, ValueError) or task.request.retries >= settings.DOCUMENT_STAGE_MAX_RETRIES:
+        document.update_status(
+            db, document_id=document_id, status="failed", error_message=f"{stage}失败: {str(exc)}"
+        )
+        shutil.rmtree(_stage_dir(document_id), ignore_errors=True)
+        raise exc
+
+    raise task.retry(
+        exc=exc,
+        countdown=backoff_delay(task.request.retries, base=settings.DOCUMENT_STAGE_RETRY_BASE_DELAY, cap=settings.DOCUMENT_STAGE_RETRY_MAX_DELAY),
+        max_retries=settings.DOCUMENT_STAGE_MAX_RETRIES
+    )
+
+
+@celery_app.task(bind=True)
+def load_document(self, document_id: int) -> int:
+    """阶段1：加载文档内容"""
+    db = next(get_db())
+
+    try:
+        doc, _ = _get_document_and_kb(db, document_id)
+        document.update_status(db, document_id=document_id, status=STATUS_LOADING)
+
+        pages = 0
+        with _stage_writer(document_id, "content") as write:
+            try:
+                for page in document_processor.iter_document_content(doc.file_path, doc.file_type):
+                    write(page)
+                    pages += 1
+            except ExtractionError:
+                # 解析超时或解析进程异常退出，按阶段退避重试
+                raise
+            except Exception as e:
+                # 文件损坏或格式错误，重试无意义
+                raise ValueError(f"无法加载文档内容: {str(e)}")
+        if not pages:
+            raise ValueError("无法加载文档内容")
+
+        return document_id
+
+    except Exception as e:
+        _retry_or_fail(self, db, document_id, "加载文档", e)
+
+    finally:
+        db.close()
+
+
+@celery_app.task(bind=True)
+def split_document(self, document_id: int) -> int:
+    """阶段2：切分文档"""
+    db = next(get_db())
+
+    try:
+        _, kb = _get_document_and_kb(db, document_id)
+        document.update_status(db, document_id=document_id, status=STATUS_SPLITTING)
+
+        with _stage_writer(document_id, "chunks") as write:
+            for chunk in document_processor.iter_split_document(
+                _iter_stage(document_id, "content"),
+                chunk_size=kb.chunk_size,
+                chunk_overlap=kb.chunk_overlap
+            ):
+                write(chunk)
+
+        return document_id
+
+    except Exception as e:
+        _retry_or_fail(self, db, document_id, "切分文档", e)
+
+    finally:
+        db.close()
+
+
+@celery_app.task(bind=True)
+def embed_document(self, document_id: int) -> int:
+    """阶段3：向量化并写入向量库（按切片ID覆盖写入，重试幂等）"""
+    db = next(get_db())
+
+    try:
+        doc, kb = _get_document_and_kb(db, document_id)
+        document.update_status(db, document_id=document_id, status=STATUS_EMBEDDING)
+
+        total = 0
+        occurrences: Dict[str, int] = {}
+        with _stage_writer(document_id, "embedded") as write:
+            for batch in iter_batches(_iter_stage(document_id, "chunks"), settings.INGEST_FLUSH_BATCH_SIZE):
+                chunk_infos = document_processor.process_document_chunks(
+                    document_id=document_id,
+                    chunks=batch,
+                    collection_name=kb.collection_name,
+                    metadata={
+                        "filename": doc.original_filename,
+                        "file_type": doc.file_type,
+                        "knowledge_base_id": kb.id
+                    },
+                    embedding_model=kb.embedding_model,
+                    start_index=total,
+                    occurrences=occurrences
+                )
+                for chunk_info in chunk_infos:
+                    write(chunk_info)
+                total += len(batch)
+
+        return document_id
+
+    except Exception as e:
+        _retry_or_fail(self, db, document_id, "向量化", e)
+
+    finally:
+        db.close()
+
+
+@celery_app.task(bind=True)
+def persist_document(self, document_id: int) -> Dict[str, Any]:
+    """阶段4：保存切片到数据库并完成入库"""
+    db = next(get_db())
+
+    try:
+        _get_document_and_kb(db, document_id)
+        document.update_status(db, document_id=document_id, status=STATUS_PERSISTING)
+
+        # 重试时先清理上次可能已写入的切片
+        document_chunk.delete_by_document(db, document_id=document_id)
+        total = 0
+        for batch in iter_batches(_iter_stage(document_id, "embedded"), settings.INGEST_FLUSH_BATCH_SIZE):
+            document_chunk.create_chunks(db, chunks_data=[
+                {"document_id": document_id, **chunk_info} for chunk_info in batch
+            ])
+            total += len(batch)
+
+        document.update_status(db, document_id=document_id, status="completed")
+        shutil.rmtree(_stage_dir(document_id), ignore_errors=True)
+
+        return {
+            "document_id": document_id,
+            "status": "completed",
+            "chunks": total
+        }
+
+    except Exception as e:
+        _retry_or_fail(self, db, document_id, "保存切片", e)
+
+    finally:
+        db.close()
+
+
+def start_document_ingestion(document_id: int):
+    """
+    提交文档入库流水线
+
+    各阶段依次执行，任一阶段重试耗尽后整条链终止，文档标记为failed。
+
+    Args:
+        document_id: 文档ID
+
+    Returns:
+        Celery AsyncResult
+    """
+    return chain(
+        load_document.si(document_id),
+        split_document.si(document_id),
+        embed_document.si(document_id),
+        persist_document.si(document_id)
+    ).apply_async()
+
+
+@celery_app.task(bind=True)
+def reindex_document(self, document_id: int) -> Dict[str, Any]:
+    """
+    增量重建文档索引
+    
+    重新加载并切分文档，按切片内容哈希与已有切片比对，只为新增内容计算向量，
+    未变化的切片保留原向量，多余的切片从数据库和向量库删除。
+    """
+    db = next(get_db())
+
+    try:
+        doc, kb = _get_document_and_kb(db, document_id)
+
+        # 逐页加载、流式切分并按批比对写入，三个步骤交替进行
+        document.update_status(db, document_id=document_id, status=STATUS_EMBEDDING)
+        chunks = document_processor.iter_split_document(
+            document_processor.iter_document_content(doc.file_path, doc.file_type),
+            chunk_size=kb.chunk_size,
+            chunk_overlap=kb.chunk_overlap
+        )
+        # 新增/更新的切片逐行写入中间文件，数据库变更在全部向量写入后按批应用
+        with _stage_writer(document_id, "reindex_created") as write_created, \
+                _stage_writer(document_id, "reindex_updated") as write_updated:
+            changes = document_processor.reindex_document_chunks(
+                document_id=document_id,
+                chunks=chunks,
+                existing_chunks=document_chunk.get_index_by_document(db, document_id=document_id),
+                collection_name=kb.collection_name,
+                write_created=write_created,
+                write_updated=write_updated,
+                metadata={
+                    "filename": doc.original_filename,
+                    "file_type": doc.file_type,
+                    "knowledge_base_id": kb.id
+                },
+                embedding_model=kb.embedding_model
+            )
+
+        if not changes["total"]:
+            raise ValueError("无法加载文档内容")
+
+        document.update_status(db, document_id=document_id, status=STATUS_PERSISTING)
+        document_chunk.apply_changes(
+            db,
+            document_id=document_id,
+            created=_iter_stage(document_id, "reindex_created"),
+            updated=_iter_stage(document_id, "reindex_updated"),
+            deleted_ids=changes["deleted_ids"]
+        )
+        shutil.rmtree(_stage_dir(document_id), ignore_errors=True)
+        # 数据库已不再引用多余切片，删除失败只会留下无引用的向量
+        if not document_processor.delete_chunk_embeddings(kb.collection_name, changes["deleted_embedding_ids"]):
+            print(f"删除文档{document_id}的多余切片向量失败")
+
+        document.update_status(db, document_id=document_id, status="completed")
+
+        return {
+            "document_id": document_id,
+            "status": "completed",
+            "chunks": changes["total"],
+            "created": changes["created"],
+            "updated": changes["updated"],
+            "deleted": len(changes["deleted_ids"]),
+            "unchanged": changes["unchanged"]
+        }
+
+    except Exception as e:
+        _retry_or_fail(self, db, document_id, "重建索引", e)
+
+    finally:
+        db.close()
+
+
+@celery_app.task(bind=True)
+def prepare_ingestion_batch(self, batch_id: int):
+    """批量入库：解压/收集文件、去重并创建文档记录，然后开始分批提交"""
+    db = next(get_db())
+
+    try:
+        batch = bulk_ingestion_service.prepare_batch(db, batch_id)
+        if batch.status == "running":
+            dispatch_ingestion_batch.delay(batch_id)
+        return {
+            "batch_id": batch_id,
+            "total_files": batch.total_files,
+            "skipped_files": batch.skipped_files
+        }
+
+    except Exception as e:
+        ingestion_batch.update_batch(db, batch_id=batch_id, status="failed", error_message=str(e))
+        raise
+
+    finally:
+        db.close()
+
+
+@celery_app.task(bind=True)
+def dispatch_ingestion_batch(self, batch_id: int):
+    """
+    批量入库：按窗口提交文档入库流水线
+
+    每次运行统计已提交但未结束的文档数，补充提交到BULK_INGEST_WINDOW，
+    未全部结束时延迟重新调度自身（不在worker中阻塞等待）。
+    """
+    db = next(get_db())
+
+    try:
+        batch = ingestion_batch.get(db, batch_id)
+        if not batch or batch.status != "running":
+            return
+
+        document_ids = batch.document_ids or []
+        dispatched = batch.dispatched
+
+        # 流水线丢失（worker被杀、消息丢失）的文档不会再推进，超时后标记为失败，批次才能结束
+        stale = document.fail_stale(
+            db,
+            document_ids=document_ids[:dispatched],
+            before=datetime.utcnow() - timedelta(seconds=settings.BULK_INGEST_STALE_TIMEOUT),
+            error_message=f"入库超时：超过{settings.BULK_INGEST_STALE_TIMEOUT}秒未完成"
+        )
+        if stale:
+            print(f"批量入库任务{batch_id}中{stale}个文档超时，已标记为失败")
+
+        counts = document.count_by_status(db, document_ids=document_ids[:dispatched])
+        in_flight = sum(counts.get(status, 0) for status in DOCUMENT_PROCESSING_STATUSES)
+
+        room = max(0, settings.BULK_INGEST_WINDOW - in_flight)
+        to_dispatch = document_ids[dispatched:dispatched + room]
+        if to_dispatch:
+            # 从提交时开始计算超时（文档记录可能在很早之前创建）
+            document.touch(db, document_ids=to_dispatch)
+            for document_id in to_dispatch:
+                start_document_ingestion(document_id)
+            dispatched += len(to_dispatch)
+            ingestion_batch.update_batch(db, batch_id=batch_id, dispatched=dispatched)
+
+        if dispatched >= len(document_ids) and in_flight == 0 and not to_dispatch:
+            ingestion_batch.update_batch(db, batch_id=batch_id, status="completed")
+            return
+
+        self.apply_async((batch_id,), countdown=settings.BULK_INGEST_POLL_INTERVAL)
+
+    finally:
+        db.close()
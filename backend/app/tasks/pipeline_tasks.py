@@ -10,11 +10,15 @@ from typing import Dict, Any
 from celery import current_task
 from app.core.celery_app import celery_app
 from app.core.llm_client import llm_manager
+from app.core.llm_limiter import backoff_delay
+from app.core.tokenizer import ContextBudgeter
+from app.core.config import settings
 from app.core.database import get_db
 from app.crud.crud_task import pipeline_task, code_diff_task, requirement_parse_task, task_execution
 from app.crud.crud_prompt import prompt_template
 from app.crud.crud_knowledge_base import knowledge_base
 from app.services.rag_service import rag_service
+from app.services.code_review_service import code_review_service
 
 
 @celery_app.task(bind=True)
@@ -62,8 +66,11 @@ def execute_pipeline(self, task_id: int, config_override: Dict[str, Any] = None)
         # 获取代码差异内容
         code_diff_content = ""
         code_diff_summary = ""
+        repository_id = None
         if task.code_diff_task_id:
             code_task = code_diff_task.get(db, task.code_diff_task_id)
+            if code_task:
+                repository_id = code_task.repository_id
             if code_task and code_task.diff_file_path and os.path.exists(code_task.diff_file_path):
                 with open(code_task.diff_file_path, 'r', encoding='utf-8') as f:
                     code_diff_content = f.read()
@@ -96,11 +103,23 @@ def execute_pipeline(self, task_id: int, config_override: Dict[str, Any] = None)
                     query_content += f"需求内容: {requirement_content[:1000]}"
                 
                 if query_content.strip():
+                    # 知识库上下文预算：模型窗口扣除输出预留和prompt中的固定内容
+                    llm_options = {**(task.config or {}), **(config_override or {})}
+                    # 按流水线配置的客户端（client_type）取模型，与实际执行LLM调用的模型一致
+                    pipeline_client = llm_manager.get_client(llm_options.get("client_type"))
+                    model_name = pipeline_client.model if pipeline_client else None
+                    budgeter = ContextBudgeter(
+                        model_name,
+                        max_output_tokens=llm_options.get("max_tokens", settings.LLM_MAX_TOKENS)
+                    )
+                    # 代码评审按差异块拆分评审，差异内容不计入单次prompt
+                    fixed_content = requirement_content if task.pipeline_type == "code_review" else code_diff_content + requirement_content
                     context, _ = rag_service.get_context_for_query(
                         db,
                         query=query_content,
                         knowledge_base_id=task.knowledge_base_id,
-                        max_context_length=2000
+                        max_context_tokens=min(settings.RAG_MAX_CONTEXT_TOKENS, budgeter.remaining(fixed_content)),
+                        model=model_name
                     )
                     knowledge_context = context
             except Exception as e:
@@ -130,9 +149,9 @@ def execute_pipeline(self, task_id: int, config_override: Dict[str, Any] = None)
                     "task_description": task.description or ""
                 }
                 
-                final_prompt = await prompt_service.resolve_prompt_content(
+                final_prompt = asyncio.run(prompt_service.resolve_prompt_content(
                     db, template.content, variables
-                )
+                ))
         
         # 如果没有模板，使用默认prompt
         if not final_prompt:
@@ -158,13 +177,21 @@ def execute_pipeline(self, task_id: int, config_override: Dict[str, Any] = None)
         # 调用LLM
         start_time = time.time()
         
+        review_stats = {}
         if task.pipeline_type == "code_review":
-            llm_response = asyncio.run(llm_manager.review_code(
+            # 大差异按文件/差异块拆分后并发评审，未变化的差异块复用历史结果
+            llm_kwargs = {key: value for key, value in llm_config.items() if key != "focus_areas"}
+            review_outcome = asyncio.run(code_review_service.review_diff(
                 code_diff=code_diff_content,
                 requirements=requirement_content,
                 focus_areas=llm_config.get("focus_areas", ["security", "quality"]),
-                **llm_config
+                db=db,
+                repository_id=repository_id,
+                pipeline_task_id=task.id,
+                **llm_kwargs
             ))
+            llm_response = review_outcome.to_llm_response()
+            review_stats = review_outcome.stats()
         else:
             # 通用文本完成
             llm_response = asyncio.run(llm_manager.text_completion(
@@ -209,7 +236,10 @@ def execute_pipeline(self, task_id: int, config_override: Dict[str, Any] = None)
             resources_used={
                 "llm_model": llm_response.model,
                 "tokens_used": llm_response.tokens_used,
-                "processing_time": execution_time
+                "processing_time": execution_time,
+                "cache_hit": llm_response.cached,
+                "llm_cache": llm_manager.cache_stats(),
+                **review_stats
             }
         )
         
@@ -238,7 +268,11 @@ def execute_pipeline(self, task_id: int, config_override: Dict[str, Any] = None)
             error_message=str(e)
         )
         
-        raise self.retry(exc=e, countdown=60, max_retries=3)
+        raise self.retry(
+            exc=e,
+            countdown=backoff_delay(self.request.retries, base=settings.TASK_RETRY_BASE_DELAY, cap=settings.TASK_RETRY_MAX_DELAY),
+            max_retries=settings.TASK_MAX_RETRIES
+        )
     
     finally:
         db.close()
@@ -8,7 +8,9 @@ import asyncio
 from typing import Dict, Any
 from celery import current_task
 from app.core.celery_app import celery_app
+from app.core.config import settings
 from app.core.llm_client import llm_manager
+from app.core.llm_limiter import backoff_delay
 from app.core.database import get_db
 from app.crud.crud_task import requirement_parse_task, task_execution
 
@@ -136,7 +138,9 @@ def parse_requirement_text(self, task_id: int, config: Dict[str, Any] = None):
             resources_used={
                 "llm_model": llm_response.model,
                 "tokens_used": llm_response.tokens_used,
-                "processing_time": processing_time
+                "processing_time": processing_time,
+                "cache_hit": llm_response.cached,
+                "llm_cache": llm_manager.cache_stats()
             }
         )
         
@@ -164,7 +168,11 @@ def parse_requirement_text(self, task_id: int, config: Dict[str, Any] = None):
             error_message=str(e)
         )
         
-        raise self.retry(exc=e, countdown=60, max_retries=3)
+        raise self.retry(
+            exc=e,
+            countdown=backoff_delay(self.request.retries, base=settings.TASK_RETRY_BASE_DELAY, cap=settings.TASK_RETRY_MAX_DELAY),
+            max_retries=settings.TASK_MAX_RETRIES
+        )
     
     finally:
         db.close()
@@ -216,21 +224,10 @@ def process_requirement_file(self, task_id: int, file_path: str, config: Dict[st
         if file_ext in ['.txt', '.md']:
             with open(file_path, 'r', encoding='utf-8') as f:
                 content = f.read()
-        elif file_ext in ['.docx']:
-            try:
-                from docx import Document
-                doc = Document(file_path)
-                content = '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-            except ImportError:
-                raise Exception("需要安装python-docx库来处理.docx文件")
-        elif file_ext in ['.pdf']:
-            try:
-                import PyPDF2
-                with open(file_path, 'rb') as f:
-                    reader = PyPDF2.PdfReader(f)
-                    content = '\n'.join([page.extract_text() for page in reader.pages])
-            except ImportError:
-                raise Exception("需要安装PyPDF2库来处理PDF文件")
+        elif file_ext in ['.docx', '.pdf']:
+            # 在解析子进程中提取，大PDF按页范围并行解析
+            from app.services.extraction_service import extraction_service
+            content = extraction_service.extract_text(file_path)
         else:
             raise Exception(f"不支持的文件类型: {file_ext}")
         
@@ -300,7 +297,11 @@ def process_requirement_file(self, task_id: int, file_path: str, config: Dict[st
             error_message=str(e)
         )
         
-        raise self.retry(exc=e, countdown=60, max_retries=3)
+        raise self.retry(
+            exc=e,
+            countdown=backoff_delay(self.request.retries, base=settings.TASK_RETRY_BASE_DELAY, cap=settings.TASK_RETRY_MAX_DELAY),
+            max_retries=settings.TASK_MAX_RETRIES
+        )
     
     finally:
         db.close()
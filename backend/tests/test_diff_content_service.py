@@ -0,0 +1,55 @@
+"""
+差异内容分页测试
+校验按文件分页读取的内容与原始差异逐字节一致
+"""
+import pytest
+from app.core.config import settings
+from app.services.diff_content_service import DiffContentService
+
+
+def file_diff(path: str, lines: int) -> str:
+    body = "".join(f"-旧内容 {i}\n+新内容 {i}\n" for i in range(lines))
+    return (
+        f"diff --git a/{path} b/{path}\n"
+        f"index 1111111..2222222 100644\n"
+        f"--- a/{path}\n"
+        f"+++ b/{path}\n"
+        f"@@ -1,{lines} +1,{lines} @@\n"
+        f"{body}"
+    )
+
+
+SAMPLE_DIFF = "".join(file_diff(f"src/模块_{i}.py", i % 5 + 1) for i in range(12)).encode("utf-8")
+
+
+@pytest.fixture
+def diff_path(tmp_path):
+    path = tmp_path / "sample.diff"
+    path.write_bytes(SAMPLE_DIFF)
+    return str(path)
+
+
+@pytest.mark.parametrize("limit, max_bytes", [(1, 1 << 20), (5, 1 << 20), (100, 1 << 20), (100, 300)])
+def test_pages_reproduce_diff(monkeypatch, diff_path, limit, max_bytes):
+    monkeypatch.setattr(settings, "DIFF_PAGE_MAX_BYTES", max_bytes)
+    service = DiffContentService()
+
+    contents = []
+    offset = 0
+    while offset is not None:
+        page = service.read_page(diff_path, offset=offset, limit=limit)
+        contents.append(page["content"])
+        offset = page["next_offset"]
+
+    assert "".join(contents).encode("utf-8") == SAMPLE_DIFF
+
+
+def test_file_content_matches_own_range(diff_path):
+    service = DiffContentService()
+    total_files = service.list_files(diff_path, limit=100)["total_files"]
+
+    contents = [service.get_file(diff_path, i)["content"] for i in range(total_files)]
+    for i, content in enumerate(contents):
+        assert content.startswith(f"diff --git a/src/模块_{i}.py ")
+        assert content.count("diff --git ") == 1
+    assert "".join(contents).encode("utf-8") == SAMPLE_DIFF
@@ -0,0 +1,89 @@
+"""
+差异索引测试
+校验逐文件/逐差异块的字节区间首尾相接、互不重叠，并覆盖整个差异文件
+"""
+import pytest
+from app.core.diff_utils import DiffIndexBuilder, build_diff_index, read_diff_range
+
+
+SAMPLE_DIFF = (
+    "diff --git a/app/core/vector_store.py b/app/core/vector_store.py\n"
+    "index 1111111..2222222 100644\n"
+    "--- a/app/core/vector_store.py\n"
+    "+++ b/app/core/vector_store.py\n"
+    "@@ -1,3 +1,4 @@\n"
+    " import os\n"
+    "+import threading\n"
+    " import hashlib\n"
+    " from typing import List\n"
+    "@@ -20,2 +21,2 @@ class ChromaDBManager:\n"
+    "-    pass\n"
+    "+    return None\n"
+    " # 结束\n"
+    "diff --git a/docs/图片.png b/docs/图片.png\n"
+    "new file mode 100644\n"
+    "index 0000000..3333333\n"
+    "Binary files /dev/null and b/docs/图片.png differ\n"
+    "diff --git a/README.md b/README.md\n"
+    "index 4444444..5555555 100644\n"
+    "--- a/README.md\n"
+    "+++ b/README.md\n"
+    "@@ -1 +1 @@\n"
+    "-旧标题\n"
+    "\\ No newline at end of file\n"
+    "+新标题\n"
+    "\\ No newline at end of file"
+).encode("utf-8")
+
+
+def assert_tiled(ranges, start, end):
+    """区间按顺序首尾相接，恰好覆盖[start, end)"""
+    position = start
+    for offset, length in ranges:
+        assert offset == position
+        assert length > 0
+        position = offset + length
+    assert position == end
+
+
+def build_index(data: bytes, chunk_size: int) -> dict:
+    builder = DiffIndexBuilder()
+    for i in range(0, len(data), chunk_size):
+        builder.feed(data[i:i + chunk_size])
+    return builder.index()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+def test_ranges_tile_diff(chunk_size):
+    index = build_index(SAMPLE_DIFF, chunk_size)
+
+    assert index["total_bytes"] == len(SAMPLE_DIFF)
+    assert [entry["path"] for entry in index["files"]] == [
+        "app/core/vector_store.py", "docs/图片.png", "README.md"
+    ]
+    assert (index["files_changed"], index["lines_added"], index["lines_deleted"]) == (3, 3, 2)
+    assert_tiled([(entry["offset"], entry["length"]) for entry in index["files"]], 0, index["total_bytes"])
+
+    for entry in index["files"]:
+        hunks = entry["hunks"]
+        if hunks:
+            # 差异块从第一个@@行开始，一直覆盖到文件区间末尾
+            assert_tiled([(hunk[0], hunk[1]) for hunk in hunks], hunks[0][0], entry["offset"] + entry["length"])
+
+
+def test_file_range_excludes_next_header(tmp_path):
+    diff_path = tmp_path / "sample.diff"
+    diff_path.write_bytes(SAMPLE_DIFF)
+    index = build_diff_index(str(diff_path), chunk_size=16)
+
+    contents = [read_diff_range(str(diff_path), entry["offset"], entry["length"]) for entry in index["files"]]
+    for content in contents:
+        assert content.startswith("diff --git ")
+        assert content.count("diff --git ") == 1
+    assert "".join(contents).encode("utf-8") == SAMPLE_DIFF
+
+    first = index["files"][0]
+    hunk_texts = [read_diff_range(str(diff_path), hunk[0], hunk[1]) for hunk in first["hunks"]]
+    assert hunk_texts[0].startswith("@@ -1,3 +1,4 @@")
+    assert sum(line.startswith("@@") for line in hunk_texts[0].splitlines()) == 1
+    assert hunk_texts[1].endswith(" # 结束\n")